@@ -0,0 +1,276 @@
+"""
+Admission control for upstream LLM calls.
+
+Every call needs one of LLM_MAX_CONCURRENCY slots. Before queueing, a
+request must fit the user's token buckets for requests and tokens per
+minute. When all slots are busy, waiters are ordered by start-time fair
+queuing: each user's next request is tagged after their previous ones, by
+its estimated token count, so a user with many or large queued requests
+cannot hold back a light user. Full queues and empty buckets are rejected
+immediately with a Retry-After hint. Work made of many calls (a batch) is
+charged to the buckets once with budget(); its calls then only take slots.
+
+The configured limits are for the whole app, but the state is per worker
+process: each of the WEB_CONCURRENCY workers enforces its share (the limit
+divided by the worker count) on the requests it happens to receive. Queueing
+needs several requests in flight per process, so gunicorn.conf.py runs
+threaded (gthread) workers.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '64'))
+LLM_MAX_QUEUE_PER_USER = int(os.environ.get('LLM_MAX_QUEUE_PER_USER', '4'))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', '20'))
+USER_REQUESTS_PER_MINUTE = float(os.environ.get('USER_REQUESTS_PER_MINUTE', '20'))
+USER_REQUEST_BURST = float(os.environ.get('USER_REQUEST_BURST', '10'))
+USER_TOKENS_PER_MINUTE = float(os.environ.get('USER_TOKENS_PER_MINUTE', '40000'))
+USER_TOKEN_BURST = float(os.environ.get('USER_TOKEN_BURST', '20000'))
+MAX_TRACKED_USERS = 10000
+
+# Same variable gunicorn reads for its default worker count
+WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+
+
+def per_worker(total, minimum=1):
+    """This worker's share of an app-wide limit."""
+    return max(minimum, total / WORKERS)
+
+
+WORKER_MAX_CONCURRENCY = int(per_worker(LLM_MAX_CONCURRENCY))
+WORKER_MAX_QUEUE = int(per_worker(LLM_MAX_QUEUE))
+WORKER_REQUESTS_PER_MINUTE = per_worker(USER_REQUESTS_PER_MINUTE, 0)
+WORKER_REQUEST_BURST = per_worker(USER_REQUEST_BURST)
+WORKER_TOKENS_PER_MINUTE = per_worker(USER_TOKENS_PER_MINUTE, 0)
+WORKER_TOKEN_BURST = per_worker(USER_TOKEN_BURST)
+
+QUEUE_DEPTH = metrics.gauge('llm_queue_depth', 'Requests waiting for an upstream LLM slot')
+INFLIGHT = metrics.gauge('llm_inflight', 'Upstream LLM calls in progress')
+QUEUE_WAIT = metrics.histogram('llm_queue_wait_seconds', 'Time spent waiting for an upstream LLM slot')
+REJECTED = metrics.counter('llm_admission_rejected_total', 'Requests rejected by admission control', ('reason',))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        # `now` may predate the bucket when it was read before the bucket was created
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` is available (0 if it is now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def take(self, amount):
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return amount
+
+    def give(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'event', 'granted')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+
+class FairScheduler:
+    def __init__(self, concurrency=WORKER_MAX_CONCURRENCY, max_queue=WORKER_MAX_QUEUE,
+                 max_queue_per_user=LLM_MAX_QUEUE_PER_USER, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        self._queued_per_user = {}
+        self._request_buckets = {}
+        self._token_buckets = {}
+
+    def _buckets(self, user_id, now):
+        req = self._request_buckets.get(user_id)
+        if req is None:
+            if len(self._request_buckets) >= MAX_TRACKED_USERS:
+                self._prune(now)
+            req = self._request_buckets[user_id] = TokenBucket(WORKER_REQUESTS_PER_MINUTE, WORKER_REQUEST_BURST)
+            self._token_buckets[user_id] = TokenBucket(WORKER_TOKENS_PER_MINUTE, WORKER_TOKEN_BURST)
+        return req, self._token_buckets[user_id]
+
+    def _prune(self, now):
+        # Users whose buckets have refilled carry no state worth keeping
+        for user_id in list(self._request_buckets):
+            if user_id in self._queued_per_user:
+                continue
+            if self._request_buckets[user_id].wait_time(WORKER_REQUEST_BURST, now) == 0 and \
+                    self._token_buckets[user_id].wait_time(WORKER_TOKEN_BURST, now) == 0:
+                del self._request_buckets[user_id]
+                del self._token_buckets[user_id]
+                self._finish_tags.pop(user_id, None)
+
+    def _tag(self, user_id, cost):
+        start = max(self._virtual_time, self._finish_tags.get(user_id, 0.0))
+        self._finish_tags[user_id] = start + cost
+        return start
+
+    def _charge(self, user_id, tokens, now):
+        req_bucket, tok_bucket = self._buckets(user_id, now)
+        wait = max(req_bucket.wait_time(1, now), tok_bucket.wait_time(tokens, now))
+        if wait > 0:
+            REJECTED.inc(reason='rate_limited')
+            raise AdmissionRejected('rate_limited', wait)
+        req_bucket.take(1)
+        return tok_bucket.take(tokens)
+
+    def charge(self, user_id, tokens=0):
+        """Take one request and `tokens` from user_id's buckets without taking a slot.
+
+        Returns the tokens taken, which a bucket caps at its burst size.
+        """
+        with self._lock:
+            return self._charge(user_id, tokens, time.monotonic())
+
+    def refund(self, user_id, tokens):
+        with self._lock:
+            if tokens and user_id in self._token_buckets:
+                self._token_buckets[user_id].give(tokens)
+
+    def acquire(self, user_id, tokens=0, charge=True):
+        """Wait for a slot; with charge=False the caller has already paid via charge()."""
+        now = time.monotonic()
+        with self._lock:
+            if charge:
+                self._charge(user_id, tokens, now)
+            cost = max(tokens, 1)
+
+            if self._inflight < self.concurrency and not self._heap:
+                self._inflight += 1
+                self._virtual_time = max(self._virtual_time, self._tag(user_id, cost))
+                INFLIGHT.set(self._inflight)
+                QUEUE_WAIT.observe(0.0)
+                return
+            if len(self._heap) >= self.max_queue or \
+                    self._queued_per_user.get(user_id, 0) >= self.max_queue_per_user:
+                if charge:
+                    self._request_buckets[user_id].give(1)
+                    self._token_buckets[user_id].give(tokens)
+                REJECTED.inc(reason='queue_full')
+                raise AdmissionRejected('queue_full', self.queue_timeout / 4)
+
+            waiter = _Waiter(user_id)
+            heapq.heappush(self._heap, (self._tag(user_id, cost), next(self._seq), waiter))
+            self._queued_per_user[user_id] = self._queued_per_user.get(user_id, 0) + 1
+            QUEUE_DEPTH.set(len(self._heap))
+
+        waiter.event.wait(self.queue_timeout)
+        QUEUE_WAIT.observe(time.monotonic() - now)
+        with self._lock:
+            if waiter.granted:
+                return
+            # Timed out: withdraw from the queue
+            self._heap = [entry for entry in self._heap if entry[2] is not waiter]
+            heapq.heapify(self._heap)
+            self._dequeued(user_id)
+            QUEUE_DEPTH.set(len(self._heap))
+        REJECTED.inc(reason='timeout')
+        raise AdmissionRejected('timeout', self.queue_timeout / 4)
+
+    def _dequeued(self, user_id):
+        left = self._queued_per_user.get(user_id, 1) - 1
+        if left:
+            self._queued_per_user[user_id] = left
+        else:
+            self._queued_per_user.pop(user_id, None)
+
+    def release(self, user_id=None, refund_tokens=0):
+        with self._lock:
+            if user_id is not None and refund_tokens and user_id in self._token_buckets:
+                self._token_buckets[user_id].give(refund_tokens)
+            if self._heap:
+                tag, _, waiter = heapq.heappop(self._heap)
+                self._virtual_time = max(self._virtual_time, tag)
+                self._dequeued(waiter.user_id)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self._inflight -= 1
+            INFLIGHT.set(self._inflight)
+            QUEUE_DEPTH.set(len(self._heap))
+
+    def stats(self):
+        with self._lock:
+            return {'inflight': self._inflight, 'queued': len(self._heap), 'concurrency': self.concurrency}
+
+
+scheduler = FairScheduler()
+
+
+def estimate_tokens(text, max_tokens=0):
+    return len(text or '') // 4 + 1 + max_tokens
+
+
+def _unused(tokens, ticket):
+    used = ticket['used_tokens']
+    return max(0, tokens - used) if used is not None else 0
+
+
+@contextmanager
+def upstream_slot(user_id, tokens=0, charge=True):
+    """Hold an upstream slot; set `ticket['used_tokens']` to refund unused estimate.
+
+    With charge=False the call only waits for a slot: its tokens were paid
+    for up front by an enclosing budget().
+    """
+    scheduler.acquire(user_id, tokens, charge=charge)
+    ticket = {'used_tokens': None}
+    try:
+        yield ticket
+    finally:
+        scheduler.release(user_id, _unused(tokens, ticket) if charge else 0)
+
+
+@contextmanager
+def budget(user_id, tokens):
+    """Charge user_id's buckets once for a group of calls made with charge=False.
+
+    Counts as one request of `tokens` estimated tokens; set `ticket['used_tokens']`
+    to the group's total to refund the rest.
+    """
+    taken = scheduler.charge(user_id, tokens)
+    ticket = {'used_tokens': None}
+    try:
+        yield ticket
+    finally:
+        scheduler.refund(user_id, _unused(taken, ticket))
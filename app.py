@@ -1,29 +1,83 @@
-from flask import Flask
+"""
+Application factory.
+
+Importing this module only creates the unbound SQLAlchemy extension: it does
+not configure logging, connect to the database or touch the schema. Call
+create_app() to get a configured app with all routes registered, and create
+or upgrade the schema explicitly with `flask --app main init-db`.
+"""
+from flask import Flask, current_app
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase
 import os
+import sqlite3
+import click
 from werkzeug.middleware.proxy_fix import ProxyFix
 import logging
-
-logging.basicConfig(level=logging.DEBUG)
+import replicas
 
 class Base(DeclarativeBase):
     pass
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only honours ON DELETE CASCADE with foreign keys switched on
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+db = SQLAlchemy(model_class=Base, session_options={'class_': replicas.RoutingSession})
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    'pool_pre_ping': True,
-    "pool_recycle": 300,
-}
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        'pool_pre_ping': True,
+        "pool_recycle": 300,
+    }
+    app.config["SQLALCHEMY_BINDS"] = replicas.binds()
+    if config:
+        app.config.update(config)
 
-db = SQLAlchemy(app, model_class=Base)
+    db.init_app(app)
 
-with app.app_context():
     import models
-    db.create_all()
+    import routes
+    import metrics
+    import profiling
+    import assets
+    import compression
+    import passwords
+    routes.init_app(app)
+    metrics.init_app(app, db)
+    profiling.init_app(app)
+    assets.init_app(app)
+    compression.init_app(app)
+    passwords.init_app(app)
+    replicas.init_app(app, db)
+    app.cli.add_command(init_db_command)
+    return app
+
+def init_db(app):
+    """Create missing tables and the full-text index (idempotent)."""
+    import models
+    import search
+    with app.app_context():
+        db.create_all()
+        search.setup(db)
     logging.info("Database tables created")
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create missing database tables and indexes."""
+    init_db(current_app)
+    click.echo('Database initialized')
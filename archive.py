@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Archive tier for the messages of inactive chats.
+
+Chats untouched for ARCHIVE_AFTER_DAYS have their messages moved out of the
+messages table into message_segments: each segment holds up to
+ARCHIVE_SEGMENT_SIZE messages stored column by column (all ids, then all
+roles, then all contents, ...) as zlib-compressed JSON, which compresses far
+better than row by row. The chat row stays where it is, with archived_at set.
+
+GET /api/chats/<id> reads archived chats transparently: segments are
+decompressed on demand and the result is kept in a per-worker LRU of
+ARCHIVE_CACHE_SIZE chats. Archived messages stay in the search index (see
+search.index_archived), so /api/search still finds them. Asking a new
+question in an archived chat moves its messages back into the messages
+table first, under their original IDs, so context building works as before.
+
+Run it periodically (e.g. daily from cron):
+
+    python archive.py --older-than-days 90
+
+Chats archived before archived messages were indexed can be made
+searchable with `python archive.py --index-search`.
+"""
+import argparse
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import metrics
+import search
+from app import create_app, db
+from cache import TTLCache
+from models import ArchivedMessageSearch, Chat, Message, MessageSegment
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_SEGMENT_SIZE = int(os.environ.get('ARCHIVE_SEGMENT_SIZE', '500'))
+ARCHIVE_BATCH = int(os.environ.get('ARCHIVE_BATCH', '50'))
+ARCHIVE_CACHE_SIZE = int(os.environ.get('ARCHIVE_CACHE_SIZE', '256'))
+ARCHIVE_CACHE_TTL = float(os.environ.get('ARCHIVE_CACHE_TTL', '600'))
+
+CODEC = 'zlib-json-columns-1'
+FIELDS = ('id', 'role', 'content', 'images_json', 'created_at', 'model', 'prompt_tokens',
+          'completion_tokens', 'latency_ms', 'ttft_ms', 'cache_hit', 'cancelled')
+
+# (chat_id, archived_at) -> list of rehydrated messages
+_rehydrated = TTLCache(maxsize=ARCHIVE_CACHE_SIZE, ttl=ARCHIVE_CACHE_TTL)
+
+
+def encode(rows):
+    columns = {f: [getattr(row, f) for row in rows] for f in FIELDS}
+    columns['created_at'] = [v.isoformat() if v else None for v in columns['created_at']]
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def decode(codec, data, chat_id):
+    """Messages of one segment as attribute-style records, oldest first."""
+    if codec != CODEC:
+        raise ValueError(f'unknown segment codec: {codec}')
+    columns = json.loads(zlib.decompress(data))
+    columns['created_at'] = [datetime.fromisoformat(v) if v else None for v in columns['created_at']]
+    return [SimpleNamespace(chat_id=chat_id, **dict(zip(FIELDS, values)))
+            for values in zip(*(columns[f] for f in FIELDS))]
+
+
+def archive_chat(chat_id, now):
+    """Move one chat's messages into segments; returns (messages, compressed bytes)."""
+    rows = db.session.execute(
+        db.select(*(getattr(Message, f) for f in FIELDS))
+        .where(Message.chat_id == chat_id).order_by(Message.id)).all()
+    stored = 0
+    for seq, start in enumerate(range(0, len(rows), ARCHIVE_SEGMENT_SIZE)):
+        chunk = rows[start:start + ARCHIVE_SEGMENT_SIZE]
+        data = encode(chunk)
+        stored += len(data)
+        db.session.add(MessageSegment(chat_id=chat_id, seq=seq, first_message_id=chunk[0].id,
+                                      last_message_id=chunk[-1].id, message_count=len(chunk),
+                                      codec=CODEC, data=data))
+    if rows:
+        search.index_archived(db, chat_id, rows)
+        # Only what was encoded: a message committed meanwhile stays in the hot table
+        Message.query.filter(Message.chat_id == chat_id, Message.id <= rows[-1].id) \
+            .delete(synchronize_session=False)
+    # Keep updated_at: archiving is not activity and must not reorder the sidebar
+    Chat.query.filter(Chat.id == chat_id).update({'archived_at': now, 'updated_at': Chat.updated_at},
+                                                  synchronize_session=False)
+    return len(rows), stored
+
+
+def archive_inactive(older_than, limit=None):
+    """Archive chats not updated since `older_than`; returns totals for the run."""
+    totals = {'chats': 0, 'messages': 0, 'compressed_bytes': 0}
+    while limit is None or totals['chats'] < limit:
+        size = ARCHIVE_BATCH if limit is None else min(ARCHIVE_BATCH, limit - totals['chats'])
+        chat_ids = [row.id for row in db.session.query(Chat.id).filter(
+            Chat.updated_at < older_than, Chat.archived_at.is_(None), Chat.deleted_at.is_(None)
+        ).order_by(Chat.updated_at).limit(size)]
+        if not chat_ids:
+            break
+        now = datetime.now()
+        for chat_id in chat_ids:
+            messages, stored = archive_chat(chat_id, now)
+            totals['messages'] += messages
+            totals['compressed_bytes'] += stored
+        db.session.commit()
+        totals['chats'] += len(chat_ids)
+        logging.info('Archived %d chats (%d messages so far)', totals['chats'], totals['messages'])
+    return totals
+
+
+def chat_stats(chat_id):
+    """(last message id, message count) of an archived chat, for its ETag."""
+    seg_last, seg_count = db.session.query(db.func.max(MessageSegment.last_message_id),
+                                           db.func.sum(MessageSegment.message_count)) \
+        .filter(MessageSegment.chat_id == chat_id).one()
+    hot_last, hot_count = db.session.query(db.func.max(Message.id), db.func.count(Message.id)) \
+        .filter(Message.chat_id == chat_id).one()
+    return max(seg_last or 0, hot_last or 0) or None, (seg_count or 0) + hot_count
+
+
+def archived_messages(chat):
+    """Messages in an archived chat's segments, oldest first, from the LRU or the database."""
+    key = (chat.id, chat.archived_at)
+    cached = _rehydrated.get(key)
+    metrics.record_cache('archive', cached is not None)
+    if cached is not None:
+        return cached
+    segments = db.session.query(MessageSegment.codec, MessageSegment.data) \
+        .filter(MessageSegment.chat_id == chat.id).order_by(MessageSegment.seq).all()
+    rows = [msg for seg in segments for msg in decode(seg.codec, seg.data, chat.id)]
+    _rehydrated.set(key, rows)
+    return rows
+
+
+def messages(chat):
+    """All messages of an archived chat: its segments plus any written while it was archived."""
+    hot = Message.query.filter(Message.chat_id == chat.id).order_by(Message.id).all()
+    return archived_messages(chat) + hot
+
+
+def restore(chat):
+    """Move an archived chat's messages back into the messages table (caller commits).
+
+    Concurrent calls for the same chat are safe: clearing archived_at is the
+    claim, and the row lock it takes makes a second request wait and then
+    find nothing to restore. Returns whether this call restored the chat.
+    """
+    archived_at = chat.archived_at
+    # Restoring is not activity by itself; the caller bumps updated_at if it adds a message
+    claimed = Chat.query.filter(Chat.id == chat.id, Chat.archived_at.isnot(None)) \
+        .update({'archived_at': None, 'updated_at': Chat.updated_at}, synchronize_session=False)
+    if claimed:
+        rows = archived_messages(SimpleNamespace(id=chat.id, archived_at=archived_at))
+        search.unindex_archived(db, chat.id)
+        if rows:
+            db.session.execute(db.insert(Message), [vars(row) for row in rows])
+        MessageSegment.query.filter(MessageSegment.chat_id == chat.id).delete(synchronize_session=False)
+        _rehydrated.pop((chat.id, archived_at))
+    db.session.expire(chat, ['archived_at', 'messages'])
+    return bool(claimed)
+
+
+def index_unsearchable():
+    """Add archived chats that have no search entries to the index; returns the number of chats."""
+    if search.dialect(db) not in ('postgresql', 'sqlite'):
+        return 0
+    indexed = 0
+    while True:
+        chats = db.session.query(Chat).filter(
+            Chat.archived_at.isnot(None),
+            db.session.query(MessageSegment.id).filter(MessageSegment.chat_id == Chat.id).exists(),
+            ~db.session.query(ArchivedMessageSearch.message_id)
+            .filter(ArchivedMessageSearch.chat_id == Chat.id).exists()
+        ).limit(ARCHIVE_BATCH).all()
+        if not chats:
+            return indexed
+        for chat in chats:
+            search.index_archived(db, chat.id, archived_messages(chat))
+        db.session.commit()
+        indexed += len(chats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move messages of inactive chats into compressed segments')
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--limit', type=int, help='Archive at most this many chats')
+    parser.add_argument('--index-search', action='store_true',
+                        help='Add already archived chats to the search index instead of archiving')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    if args.index_search:
+        with create_app().app_context():
+            print(f'Indexed {index_unsearchable()} archived chats for search')
+        return
+    with create_app().app_context():
+        totals = archive_inactive(datetime.now() - timedelta(days=args.older_than_days), args.limit)
+    print(f"Archived {totals['chats']} chats, {totals['messages']} messages "
+          f"into {totals['compressed_bytes']} compressed bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Fingerprinted, precompressed static assets.
+
+`python assets.py` copies each file in ASSETS from static/ to
+static/dist/ under a name containing a hash of its content, writes gzip and
+(if the brotli package is installed) brotli versions next to it, and
+records the mapping in static/dist/manifest.json. Templates link assets with
+asset_url('js/chat.js'); built files are served from /assets/ with
+`Cache-Control: immutable` and the best precompressed variant the client
+accepts. Without a build, asset_url falls back to the plain static file.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS = ['css/chat.css', 'js/chat.js']
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def build(sources=ASSETS, static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Write hashed and precompressed copies of sources; returns the manifest."""
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for source in sources:
+        with open(os.path.join(static_dir, source), 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(os.path.basename(source))
+        name = f'{stem}.{fingerprint(data)}{ext}'
+        path = os.path.join(dist_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # mtime=0 keeps the gzip output identical across builds
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[source] = name
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    current = set(manifest.values())
+    for fn in os.listdir(dist_dir):
+        base = fn[:-3] if fn.endswith(('.gz', '.br')) else fn
+        if fn != 'manifest.json' and base not in current:
+            os.remove(os.path.join(dist_dir, fn))
+    return manifest
+
+
+def load_manifest(path=MANIFEST):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts (q > 0) from an Accept-Encoding header."""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class AssetMiddleware:
+    """Serve built assets in front of Flask, so no session, login or metrics work is done for them."""
+
+    def __init__(self, wsgi_app, prefix='/assets/', directory=DIST_DIR):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.directory = directory
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.wsgi_app(environ, start_response)
+        return self.respond(environ, path[len(self.prefix):])(environ, start_response)
+
+    def respond(self, environ, name):
+        from werkzeug.exceptions import MethodNotAllowed, NotFound
+        from werkzeug.utils import send_file
+
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return MethodNotAllowed(['GET', 'HEAD'])
+        if '/' in name or name.startswith('.') or name.endswith(('.gz', '.br')):
+            return NotFound()
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            return NotFound()
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        encoding = None
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, coding
+                break
+        resp = send_file(path, environ, mimetype=mimetype, conditional=True, etag=True)
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = IMMUTABLE
+        return resp
+
+
+def init_app(app):
+    from flask import request, url_for
+
+    manifest = load_manifest()
+    app.wsgi_app = AssetMiddleware(app.wsgi_app)
+
+    @app.context_processor
+    def _asset_helpers():
+        def asset_url(source):
+            name = manifest.get(source)
+            if name is None:
+                return url_for('static', filename=source)
+            return f'{request.script_root}/assets/{name}'
+        return {'asset_url': asset_url}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets')
+    parser.parse_args()
+    manifest = build()
+    for source, name in manifest.items():
+        path = os.path.join(DIST_DIR, name)
+        sizes = [f'{os.path.getsize(path)} B']
+        sizes += [f'{coding} {os.path.getsize(path + suffix)} B'
+                  for coding, suffix in ENCODINGS if os.path.exists(path + suffix)]
+        print(f"{source} -> {name} ({', '.join(sizes)})")
+    if brotli is None:
+        print('brotli not installed; wrote gzip variants only')
+
+
+if __name__ == '__main__':
+    main()
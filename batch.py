@@ -0,0 +1,180 @@
+"""
+Concurrent fan-out for /api/ask/batch.
+
+Every question in a batch is sent upstream on its own worker thread, at most
+`parallelism` at a time, and results are yielded in completion order. The
+batch is charged to the user's rate limits once, for its total estimated
+tokens (see admission.budget), so its calls only wait for upstream slots; a
+call that finds the slot queue full waits and retries until
+BATCH_ADMISSION_TIMEOUT instead of failing the item. Questions see their chat's history as of the start of the batch, and
+all resulting messages are written with one executemany insert and a single
+commit at the end.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import admission
+import cancellation
+from app import db
+from models import Message
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '200'))
+BATCH_MAX_PARALLELISM = int(os.environ.get('BATCH_MAX_PARALLELISM', '8'))
+BATCH_ADMISSION_TIMEOUT = float(os.environ.get('BATCH_ADMISSION_TIMEOUT', '300'))
+
+
+class BatchItem:
+    def __init__(self, index, chat_id, question, images=None, model=None):
+        self.index = index
+        self.chat_id = chat_id
+        self.question = question
+        self.images = images or []
+        self.model = model
+        self.history = None
+        self.asked_at = None
+        self.answered_at = None
+        self.response = None
+        self.error = None
+        self.stats = {}
+
+    def result(self):
+        record = {'index': self.index, 'chat_id': self.chat_id}
+        if self.error:
+            record['error'] = self.error
+        else:
+            record.update(response=self.response, model=self.stats.get('model'),
+                          latency_ms=self.stats.get('latency_ms'))
+        return record
+
+
+def parse_items(data):
+    """BatchItems from a request body, or raise ValueError.
+
+    Items are question strings or objects with question, chat_id, model and
+    images; chat_id and model default to the top-level values.
+    """
+    raw = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('items must be a non-empty list')
+    if len(raw) > BATCH_MAX_ITEMS:
+        raise ValueError(f'at most {BATCH_MAX_ITEMS} items per batch')
+    items = []
+    for index, entry in enumerate(raw):
+        if isinstance(entry, str):
+            entry = {'question': entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f'item {index}: expected a string or an object')
+        question = (entry.get('question') or '').strip()
+        images = entry.get('images') or []
+        chat_id = entry.get('chat_id') or data.get('chat_id')
+        if not question and not images:
+            raise ValueError(f'item {index}: question required')
+        if not chat_id:
+            raise ValueError(f'item {index}: chat_id required')
+        items.append(BatchItem(index, chat_id, question, images, entry.get('model') or data.get('model')))
+    return items
+
+
+def parallelism_for(requested):
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return BATCH_MAX_PARALLELISM
+    return max(1, min(requested, BATCH_MAX_PARALLELISM))
+
+
+def estimated_tokens(item):
+    return admission.estimate_tokens(item.question, 2000)
+
+
+def used_tokens(items):
+    """Tokens the batch consumed: reported usage, or the estimate for calls that did not report it."""
+    total = 0
+    for item in items:
+        if item.asked_at is None:
+            continue
+        if item.stats.get('prompt_tokens') is not None:
+            total += item.stats['prompt_tokens'] + (item.stats.get('completion_tokens') or 0)
+        else:
+            total += estimated_tokens(item)
+    return total
+
+
+def _answer(user_id, item, call, generation):
+    tokens = estimated_tokens(item)
+    deadline = time.monotonic() + BATCH_ADMISSION_TIMEOUT
+    while not generation.cancelled:
+        try:
+            # Already paid for by the batch's budget; only a slot is needed
+            with admission.upstream_slot(user_id, tokens=tokens, charge=False), cancellation.activate(generation):
+                item.asked_at = datetime.now()
+                item.response, item.error = call(item)
+                item.answered_at = datetime.now()
+            if generation.cancelled and not item.response:
+                item.error = 'cancelled'
+            elif not item.response and not item.error:
+                item.error = 'Empty response'
+            return item
+        except admission.AdmissionRejected as e:
+            wait = min(e.retry_after, deadline - time.monotonic())
+            if wait <= 0:
+                item.error = f'Rejected by admission control ({e.reason})'
+                return item
+            generation.wait(wait)
+    item.error = 'cancelled'
+    return item
+
+
+def run(user_id, items, call, parallelism, generation):
+    """Answer items concurrently with call(item) -> (response, error); yields items as they finish."""
+    executor = ThreadPoolExecutor(max_workers=min(parallelism, len(items)), thread_name_prefix='batch')
+    try:
+        futures = [executor.submit(_answer, user_id, item, call, generation) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _message_row(chat_id, role, content, created_at, images=None, stats=None):
+    stats = stats or {}
+    return {
+        'chat_id': chat_id,
+        'role': role,
+        'content': content,
+        'images_json': json.dumps(images) if images else None,
+        'created_at': created_at,
+        'model': stats.get('model'),
+        'prompt_tokens': stats.get('prompt_tokens'),
+        'completion_tokens': stats.get('completion_tokens'),
+        'latency_ms': stats.get('latency_ms'),
+        'ttft_ms': stats.get('ttft_ms'),
+        'cache_hit': stats.get('cache_hit', False),
+        'cancelled': False,
+    }
+
+
+def save(chats, items):
+    """Persist the questions that were sent and the answers that came back; returns the number saved."""
+    rows = []
+    now = datetime.now()
+    for item in sorted(items, key=lambda i: i.index):
+        if item.asked_at is None:
+            continue
+        rows.append(_message_row(item.chat_id, 'user', item.question or '[Image message]',
+                                 item.asked_at, images=item.images))
+        if item.response:
+            rows.append(_message_row(item.chat_id, 'assistant', item.response,
+                                     item.answered_at or now, stats=item.stats))
+        chat = chats[item.chat_id]
+        if chat.title == 'New Chat' and item.question:
+            chat.title = item.question[:30] + ('...' if len(item.question) > 30 else '')
+        chat.updated_at = now
+    if not rows:
+        return 0
+    db.session.execute(db.insert(Message), rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Sequential /api/ask loop versus one /api/ask/batch call.
+
+Answers the same N questions both ways against a running app and reports
+wall time, throughput and the time to the first batch result. With the
+stub's fixed latency, the batch should take about
+ceil(N / parallelism) * latency instead of N * latency.
+
+    python -m benchmarks.stub_openrouter --port 8999 --latency fixed --latency-ms 500 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:8999/api/v1 OPENROUTER_API_KEY=stub \
+    USER_REQUESTS_PER_MINUTE=10000 USER_REQUEST_BURST=1000 gunicorn -w 1 --threads 16 main:app &
+    python -m benchmarks.batch_bench --base-url http://127.0.0.1:8000 --questions 100 --parallelism 8
+"""
+import argparse
+import json
+import time
+import uuid
+
+import requests
+
+from benchmarks.common import save_results
+from benchmarks.load_test import QUESTIONS
+
+
+def login(session, base_url, username, password):
+    resp = session.post(f'{base_url}/login', json={'username': username, 'password': password})
+    if resp.status_code != 200:
+        resp = session.post(f'{base_url}/register', json={'username': username, 'password': password})
+    resp.raise_for_status()
+
+
+def new_chat(session, base_url):
+    chat_id = f'bench_{uuid.uuid4().hex}'
+    session.post(f'{base_url}/api/chats', json={'id': chat_id, 'title': 'Batch benchmark'}).raise_for_status()
+    return chat_id
+
+
+def run_sequential(session, base_url, questions):
+    chat_id = new_chat(session, base_url)
+    errors = 0
+    start = time.perf_counter()
+    for question in questions:
+        resp = session.post(f'{base_url}/api/ask', json={'chat_id': chat_id, 'question': question})
+        errors += resp.status_code != 200
+    elapsed = time.perf_counter() - start
+    return {'seconds': round(elapsed, 3), 'per_second': round(len(questions) / elapsed, 2), 'errors': errors}
+
+
+def run_batch(session, base_url, questions, parallelism):
+    chat_id = new_chat(session, base_url)
+    errors = 0
+    first = None
+    start = time.perf_counter()
+    with session.post(f'{base_url}/api/ask/batch', stream=True,
+                      json={'chat_id': chat_id, 'items': questions, 'parallelism': parallelism}) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            record = json.loads(line)
+            if 'index' in record:
+                if first is None:
+                    first = time.perf_counter() - start
+                errors += 'error' in record
+    elapsed = time.perf_counter() - start
+    return {'seconds': round(elapsed, 3), 'per_second': round(len(questions) / elapsed, 2), 'errors': errors,
+            'first_result_ms': round((first or 0) * 1000, 1), 'parallelism': parallelism}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sequential asks with /api/ask/batch')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--parallelism', type=int, default=8)
+    parser.add_argument('--username', default='batch_bench')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--skip-sequential', action='store_true')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip('/')
+    session = requests.Session()
+    login(session, base_url, args.username, args.password)
+    questions = [f'{QUESTIONS[i % len(QUESTIONS)]} ({i})' for i in range(args.questions)]
+
+    results = {'questions': args.questions}
+    if not args.skip_sequential:
+        results['sequential'] = run_sequential(session, base_url, questions)
+        print('sequential', results['sequential'])
+    results['batch'] = run_batch(session, base_url, questions, args.parallelism)
+    print('batch     ', results['batch'])
+    print('Saved to', save_results('batch_bench', results, args.output))
+
+
+if __name__ == '__main__':
+    main()
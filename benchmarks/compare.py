@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(obj, prefix=''):
+    out = {}
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        if isinstance(obj, (int, float)) and not isinstance(obj, bool):
+            out[prefix] = obj
+        return out
+    for key, value in items:
+        out.update(flatten(value, f'{prefix}.{key}' if prefix else str(key)))
+    return out
+
+
+def lower_is_better(key):
+    leaf = key.rsplit('.', 1)[-1]
+    return leaf.endswith(('_ms', '_s', '_bytes')) or leaf in ('errors',)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark JSON files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change reported as a regression')
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"baseline {old.get('revision')}  vs  candidate {new.get('revision')}")
+    a, b = flatten(old['results']), flatten(new['results'])
+    regressions = 0
+    for key in sorted(set(a) & set(b)):
+        if a[key] == 0:
+            # No percentage from a zero baseline; any rise of a lower-is-better value (e.g. errors) is a regression
+            if not (lower_is_better(key) and b[key] > 0):
+                continue
+            change = float('inf')
+        else:
+            change = (b[key] - a[key]) / abs(a[key]) * 100
+        if lower_is_better(key):
+            worse = change > args.threshold
+        elif key.rsplit('.', 1)[-1] in ('rps', 'docs_per_s', 'qps'):
+            worse = change < -args.threshold
+        else:
+            continue
+        marker = 'REGRESSION' if worse else ''
+        regressions += bool(worse)
+        print(f'{key:<60} {a[key]:>12} {b[key]:>12} {change:>+8.1f}% {marker}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+End-to-end load generator for the chat app.
+
+Each virtual user registers (or logs in), then repeatedly creates a chat
+through /api/chats, asks questions through /api/ask and refreshes the
+sidebar like chat.html does. Reports RPS and p50/p95/p99 per endpoint and
+stores the run as JSON under benchmarks/results/.
+
+Questions are sent with "no_cache": true, so every ask reaches the upstream
+(the fixed question set would otherwise be answered from the semantic cache
+after warm-up). Pass --use-cache to measure with the cache on.
+
+Run the app against the local stub so no API credits are used:
+
+    python -m benchmarks.stub_openrouter --port 8999 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:8999/api/v1 OPENROUTER_API_KEY=stub gunicorn -w 4 main:app &
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000 --concurrency 16 --duration 60
+"""
+import argparse
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.common import save_results, summarize
+
+QUESTIONS = [
+    'How do python decorators work?',
+    'Explain list comprehensions with an example.',
+    'What is the difference between a tuple and a list?',
+    'How does the GIL affect threads?',
+    'Write a function that reverses a string.',
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, elapsed, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def timed(recorder, endpoint, fn, *args, expected=(), **kwargs):
+    """Call fn and record its latency; statuses in `expected` do not count as errors."""
+    start = time.perf_counter()
+    try:
+        resp = fn(*args, **kwargs)
+        ok = resp.status_code < 400 or resp.status_code in expected
+    except requests.RequestException:
+        resp, ok = None, False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    return resp
+
+
+def authenticate(session, base_url, username, password, recorder):
+    # The first run has no account yet: that 401 is how we know to register
+    resp = timed(recorder, 'POST /login', session.post, f'{base_url}/login',
+                 json={'username': username, 'password': password}, expected=(401,))
+    if resp is not None and resp.status_code == 200:
+        return True
+    resp = timed(recorder, 'POST /register', session.post, f'{base_url}/register',
+                 json={'username': username, 'password': password})
+    return resp is not None and resp.status_code == 200
+
+
+def virtual_user(idx, args, recorder, deadline):
+    session = requests.Session()
+    username = f'{args.user_prefix}{idx}'
+    if not authenticate(session, args.base_url, username, args.password, recorder):
+        return 0
+
+    asked = 0
+    while time.monotonic() < deadline and (not args.requests or asked < args.requests):
+        chat_id = f'bench_{uuid.uuid4().hex}'
+        timed(recorder, 'POST /api/chats', session.post, f'{args.base_url}/api/chats',
+              json={'id': chat_id, 'title': 'Benchmark'})
+        for turn in range(args.turns):
+            if time.monotonic() >= deadline or (args.requests and asked >= args.requests):
+                break
+            question = QUESTIONS[(idx + asked) % len(QUESTIONS)]
+            timed(recorder, 'POST /api/ask', session.post, f'{args.base_url}/api/ask',
+                  json={'question': question, 'chat_id': chat_id, 'no_cache': not args.use_cache},
+                  timeout=args.timeout)
+            asked += 1
+            if args.poll_chats:
+                timed(recorder, 'GET /api/chats', session.get, f'{args.base_url}/api/chats')
+    return asked
+
+
+def run(args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(virtual_user, i, args, recorder, deadline) for i in range(args.concurrency)]
+        asked = sum(f.result() for f in futures)
+    wall = time.perf_counter() - start
+
+    endpoints = {}
+    total = 0
+    for endpoint, values in sorted(recorder.latencies.items()):
+        summary = summarize(values)
+        summary['errors'] = recorder.errors.get(endpoint, 0)
+        summary['rps'] = round(len(values) / wall, 3) if wall else None
+        endpoints[endpoint] = summary
+        total += len(values)
+
+    return {
+        'config': {
+            'base_url': args.base_url,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'turns': args.turns,
+            'poll_chats': args.poll_chats,
+            'use_cache': args.use_cache,
+        },
+        'wall_s': round(wall, 3),
+        'questions': asked,
+        'total_requests': total,
+        'rps': round(total / wall, 3) if wall else None,
+        'endpoints': endpoints,
+    }
+
+
+def print_report(results):
+    print(f"\n{results['total_requests']} requests in {results['wall_s']}s "
+          f"({results['rps']} req/s, {results['questions']} questions)")
+    print(f"{'endpoint':<20} {'count':>7} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for endpoint, s in results['endpoints'].items():
+        print(f"{endpoint:<20} {s['count']:>7} {s['rps']:>8} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} {s['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /login, /api/chats and /api/ask')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30.0, help='Run length in seconds')
+    parser.add_argument('--requests', type=int, default=0, help='Stop each user after this many questions (0 = no limit)')
+    parser.add_argument('--turns', type=int, default=3, help='Questions per chat before starting a new one')
+    parser.add_argument('--no-poll', dest='poll_chats', action='store_false', help='Do not refresh /api/chats after each answer')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='Let /api/ask answer repeated questions from the semantic cache')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--user-prefix', default='bench_user_')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--output', help='Where to write the JSON results (default: benchmarks/results/)')
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip('/')
+
+    results = run(args)
+    print_report(results)
+    path = save_results('load_test', results, args.output)
+    print('Results saved to', path)
+
+
+if __name__ == '__main__':
+    main()
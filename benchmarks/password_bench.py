@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Login throughput at different password hash cost settings.
+
+For each method, a burst of concurrent logins verifies passwords through
+passwords.verify_password (the bounded hashing slots used by /login) while a
+probe thread measures how long a trivial request-like task waits, i.e. how
+responsive the serving threads stay during the burst.
+
+    python -m benchmarks.password_bench --methods pbkdf2:sha256:600000 scrypt:16384:8:1 scrypt:32768:8:1
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+import passwords
+from benchmarks.common import save_results, summarize
+
+
+def probe(stop, latencies, interval=0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        sum(range(1000))
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+
+
+def bench_method(method, logins, concurrency):
+    pwhash = generate_password_hash('correct horse battery staple', method=method)
+    login_latencies, probe_latencies, busy = [], [], 0
+    lock = threading.Lock()
+
+    def login():
+        nonlocal busy
+        start = time.perf_counter()
+        try:
+            passwords.verify_password(pwhash, 'correct horse battery staple')
+        except passwords.HashingBusy:
+            with lock:
+                busy += 1
+            return
+        with lock:
+            login_latencies.append(time.perf_counter() - start)
+
+    stop = threading.Event()
+    prober = threading.Thread(target=probe, args=(stop, probe_latencies), daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(logins):
+            pool.submit(login)
+    wall = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    return {
+        'method': passwords.method_prefix(method),
+        'logins': logins,
+        'concurrency': concurrency,
+        'hash_workers': passwords.PASSWORD_HASH_WORKERS,
+        'wall_s': round(wall, 3),
+        'logins_per_s': round(len(login_latencies) / wall, 2) if wall else None,
+        'rejected_busy': busy,
+        'login': summarize(login_latencies),
+        'probe': summarize(probe_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark login throughput per password hash cost')
+    parser.add_argument('--methods', nargs='+', default=['pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1'])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32, help='Simultaneous login requests')
+    parser.add_argument('--output', help='Where to write the JSON results (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    runs = {}
+    print(f"{'method':<24} {'logins/s':>9} {'p50':>9} {'p99':>9} {'probe p99':>10} {'busy':>5}")
+    for method in args.methods:
+        r = bench_method(method, args.logins, args.concurrency)
+        runs[r['method']] = r
+        print(f"{r['method']:<24} {r['logins_per_s']:>9} {r['login'].get('p50_ms'):>9} "
+              f"{r['login'].get('p99_ms'):>9} {r['probe'].get('p99_ms'):>10} {r['rejected_busy']:>5}")
+    print('Results saved to', save_results('password_hashing', {'runs': runs}, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Replay a captured request log (see request_log.py) against a running app.
+
+Entries from all given files are merged by timestamp and re-sent at their
+original spacing divided by --speed (--speed 0 sends as fast as
+--concurrency allows). Each original user is mapped to a benchmark account
+and each original chat to a fresh chat on the target, so conversations keep
+their shape. Reports per-endpoint latency, schedule slip (how late requests
+went out compared with the scaled timeline) and how many answers matched
+the captured response hash.
+
+    python -m benchmarks.stub_openrouter --port 8999 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:8999/api/v1 OPENROUTER_API_KEY=stub gunicorn -w 4 main:app &
+    python -m benchmarks.replay 'request_logs/requests-*.jsonl' --base-url http://127.0.0.1:8000 --speed 2
+"""
+import argparse
+import glob
+import hashlib
+import json
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.common import save_results, summarize
+from benchmarks.load_test import Recorder
+
+
+def load_entries(patterns, skip_outcomes=(), limit=None):
+    entries = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    if entry.get('outcome') not in skip_outcomes:
+                        entries.append(entry)
+    entries.sort(key=lambda e: e['ts'])
+    return entries[:limit] if limit else entries
+
+
+class Target:
+    """Benchmark accounts and chats on the server being replayed against."""
+
+    def __init__(self, base_url, password, users):
+        self.base_url = base_url
+        self.password = password
+        self.users = users
+        self.accounts = {}
+        self.chats = {}
+        self.local = threading.local()
+
+    def username(self, original_user):
+        return f'replay_{zlib.crc32(str(original_user).encode()) % self.users}'
+
+    def prepare(self, entries):
+        """Log in every account and create every chat before the timed run."""
+        for entry in entries:
+            username = self.username(entry.get('user_id'))
+            session = self.accounts.get(username)
+            if session is None:
+                session = self.accounts[username] = requests.Session()
+                creds = {'username': username, 'password': self.password}
+                resp = session.post(f'{self.base_url}/login', json=creds)
+                if resp.status_code != 200:
+                    resp = session.post(f'{self.base_url}/register', json=creds)
+                resp.raise_for_status()
+            key = (entry.get('user_id'), entry.get('chat_id'))
+            if key not in self.chats:
+                chat_id = self.chats[key] = f'replay_{uuid.uuid4().hex}'
+                session.post(f'{self.base_url}/api/chats',
+                             json={'id': chat_id, 'title': 'Replay'}).raise_for_status()
+
+    def session(self, original_user):
+        # requests.Session is not thread-safe: each thread gets its own copy of the account's cookies
+        sessions = self.local.__dict__.setdefault('sessions', {})
+        username = self.username(original_user)
+        if username not in sessions:
+            session = sessions[username] = requests.Session()
+            session.cookies.update(self.accounts[username].cookies)
+        return sessions[username]
+
+
+def send(target, entry, endpoint):
+    session = target.session(entry.get('user_id'))
+    payload = {'chat_id': target.chats[(entry.get('user_id'), entry.get('chat_id'))], 'question': entry['question']}
+    url = f'{target.base_url}{endpoint}'
+    if endpoint.endswith('/stream'):
+        text = None
+        with session.post(url, json=payload, stream=True) as resp:
+            for line in resp.iter_lines():
+                record = json.loads(line)
+                if record.get('done'):
+                    text = record.get('response')
+        return resp.status_code, text
+    resp = session.post(url, json=payload)
+    return resp.status_code, (resp.json().get('response') if resp.status_code == 200 else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured /api/ask log against a server')
+    parser.add_argument('logs', nargs='+', help='Log files or glob patterns')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--speed', type=float, default=1.0, help='Pace multiplier; 0 sends without waiting')
+    parser.add_argument('--concurrency', type=int, default=64, help='Most requests in flight at once')
+    parser.add_argument('--users', type=int, default=16, help='Benchmark accounts original users map onto')
+    parser.add_argument('--endpoint', help='Send every entry to this endpoint instead of the captured one')
+    parser.add_argument('--include-rejected', action='store_true', help='Also replay asks that were rate limited')
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    skip = () if args.include_rejected else ('rejected',)
+    entries = load_entries(args.logs, skip, args.limit)
+    if not entries:
+        parser.error('no entries to replay')
+    target = Target(args.base_url.rstrip('/'), args.password, args.users)
+    target.prepare(entries)
+    recorder = Recorder()
+    slips = []
+    matched = compared = 0
+    counts_lock = threading.Lock()
+
+    def replay(entry, scheduled):
+        nonlocal matched, compared
+        endpoint = args.endpoint or entry.get('endpoint') or '/api/ask'
+        slips.append(time.perf_counter() - scheduled)
+        start = time.perf_counter()
+        try:
+            status, text = send(target, entry, endpoint)
+        except requests.RequestException:
+            status, text = None, None
+        recorder.record(f'POST {endpoint}', time.perf_counter() - start, status == 200)
+        if text and entry.get('response_sha256'):
+            with counts_lock:
+                compared += 1
+                matched += hashlib.sha256(text.encode('utf-8')).hexdigest() == entry['response_sha256']
+
+    first = entries[0]['ts']
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for entry in entries:
+            scheduled = start + (entry['ts'] - first) / args.speed if args.speed > 0 else start
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(replay, entry, scheduled)
+    elapsed = time.perf_counter() - start
+
+    captured = entries[-1]['ts'] - first
+    results = {
+        'entries': len(entries),
+        'speed': args.speed,
+        'captured_seconds': round(captured, 3),
+        'replay_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(entries) / elapsed, 2),
+        'schedule_slip': summarize(slips),
+        'endpoints': {name: dict(summarize(lat), errors=recorder.errors.get(name, 0))
+                      for name, lat in recorder.latencies.items()},
+        'response_hash_matches': matched,
+        'response_hash_compared': compared,
+    }
+    print(f"{len(entries)} requests in {elapsed:.1f}s (captured over {captured:.1f}s, speed {args.speed})")
+    for name, summary in results['endpoints'].items():
+        print(f"{name:<24} p50 {summary['p50_ms']:8.1f} ms   p95 {summary['p95_ms']:8.1f} ms   errors {summary['errors']}")
+    print(f"schedule slip p95 {results['schedule_slip']['p95_ms']:.1f} ms; "
+          f"{matched}/{compared} answers matched the captured hash")
+    print('Saved to', save_results('replay', results, args.output))
+
+
+if __name__ == '__main__':
+    main()
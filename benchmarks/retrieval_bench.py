@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Retrieval and indexing micro-benchmark on synthetic corpora.
+
+Generates a deterministic Zipf-distributed corpus, then for every variant
+measures index build time, index size on disk, searcher open time and query
+latency percentiles over a fixed query set.
+
+    python -m benchmarks.retrieval_bench --docs 10000 100000 --variants whoosh whoosh-multiproc
+
+New retrieval modes plug in by registering a variant:
+
+    @register_variant('my-mode')
+    class MyMode(Variant):
+        def build(self, docs, index_dir): ...
+        def open(self, index_dir): ...
+        def query(self, handle, text, top_k): ...
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import save_results, summarize
+
+VARIANTS = {}
+
+
+def register_variant(name):
+    def decorator(cls):
+        cls.name = name
+        VARIANTS[name] = cls
+        return cls
+    return decorator
+
+
+class Variant:
+    name = None
+
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def build(self, docs, index_dir):
+        raise NotImplementedError
+
+    def open(self, index_dir):
+        raise NotImplementedError
+
+    def query(self, handle, text, top_k):
+        raise NotImplementedError
+
+    def close(self, handle):
+        pass
+
+
+@register_variant('whoosh')
+class WhooshVariant(Variant):
+    """The shipped path: index_docs.index_documents + query_local_llm.retrieve."""
+
+    writer_kwargs = {}
+
+    def build(self, docs, index_dir):
+        from index_docs import index_documents, open_or_create_index
+        ix = open_or_create_index(index_dir)
+        return index_documents(ix, docs, update=False, **self.writer_kwargs)
+
+    def open(self, index_dir):
+        from whoosh import index
+        return index.open_dir(index_dir)
+
+    def query(self, handle, text, top_k):
+        from query_local_llm import retrieve
+        return retrieve(text, handle, top_k=top_k)
+
+
+@register_variant('whoosh-multiproc')
+class WhooshMultiprocVariant(WhooshVariant):
+    """Same index built with a larger RAM buffer and several writer processes."""
+
+    @property
+    def writer_kwargs(self):
+        return {'procs': self.options.get('procs', os.cpu_count() or 2),
+                'limitmb': self.options.get('limitmb', 256), 'multisegment': True}
+
+
+def make_vocabulary(size, rng):
+    consonants, vowels = 'bcdfghjklmnprstvz', 'aeiou'
+    words = set()
+    while len(words) < size:
+        n = rng.randint(2, 4)
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(n)))
+    return sorted(words)
+
+
+class SyntheticCorpus:
+    """Deterministic corpus with a Zipf-like term distribution."""
+
+    def __init__(self, n_docs, vocab_size=50000, doc_words=200, seed=42):
+        self.n_docs = n_docs
+        self.doc_words = doc_words
+        self.seed = seed
+        rng = random.Random(seed)
+        self.vocab = make_vocabulary(vocab_size, rng)
+        rng.shuffle(self.vocab)
+        weights = [1.0 / (rank + 1) for rank in range(len(self.vocab))]
+        total = 0.0
+        self.cumulative = []
+        for w in weights:
+            total += w
+            self.cumulative.append(total)
+
+    def __iter__(self):
+        rng = random.Random(self.seed + 1)
+        for i in range(self.n_docs):
+            length = max(10, int(rng.gauss(self.doc_words, self.doc_words / 4)))
+            words = rng.choices(self.vocab, cum_weights=self.cumulative, k=length)
+            yield f'synthetic/{i:07d}.txt', ' '.join(words[:5]), ' '.join(words)
+
+    def queries(self, n, seed=7):
+        # Mid-frequency terms: common enough to match, rare enough to rank
+        rng = random.Random(seed)
+        pool = self.vocab[50:5000] if len(self.vocab) > 5000 else self.vocab
+        return [' '.join(rng.sample(pool, rng.randint(1, 3))) for _ in range(n)]
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            total += os.path.getsize(os.path.join(root, fn))
+    return total
+
+
+def bench_variant(variant, corpus, queries, top_k, workdir, repeat):
+    index_dir = os.path.join(workdir, f'{variant.name}_{corpus.n_docs}')
+    shutil.rmtree(index_dir, ignore_errors=True)
+
+    start = time.perf_counter()
+    count = variant.build(iter(corpus), index_dir)
+    build_s = time.perf_counter() - start
+
+    open_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handle = variant.open(index_dir)
+        open_times.append(time.perf_counter() - start)
+        variant.close(handle)
+
+    handle = variant.open(index_dir)
+    # Warm-up pass so OS caches are comparable between variants
+    for q in queries[:10]:
+        variant.query(handle, q, top_k)
+    latencies, hits = [], 0
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            results = variant.query(handle, q, top_k)
+            latencies.append(time.perf_counter() - start)
+            hits += bool(results)
+    variant.close(handle)
+
+    return {
+        'variant': variant.name,
+        'docs': count,
+        'build_s': round(build_s, 3),
+        'docs_per_s': round(count / build_s, 1) if build_s else None,
+        'index_bytes': dir_size(index_dir),
+        'open': summarize(open_times),
+        'query': summarize(latencies),
+        'qps': round(len(latencies) / sum(latencies), 1) if latencies else None,
+        'hit_rate': round(hits / len(latencies), 3) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark index build and retrieval on synthetic corpora')
+    parser.add_argument('--docs', type=int, nargs='+', default=[10000], help='Corpus sizes (10k-1M)')
+    parser.add_argument('--variants', nargs='+', default=['whoosh'], choices=sorted(VARIANTS))
+    parser.add_argument('--vocab', type=int, default=50000)
+    parser.add_argument('--doc-words', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top_k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='Where to build indexes (default: temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='Keep built indexes')
+    parser.add_argument('--output', help='Where to write the JSON results (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='retrieval_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    runs = []
+    try:
+        for n_docs in args.docs:
+            corpus = SyntheticCorpus(n_docs, vocab_size=args.vocab, doc_words=args.doc_words, seed=args.seed)
+            queries = corpus.queries(args.queries)
+            for name in args.variants:
+                print(f'[{name}] {n_docs} docs...', flush=True)
+                result = bench_variant(VARIANTS[name](), corpus, queries, args.top_k, workdir, args.repeat)
+                q = result['query']
+                print(f"  build {result['build_s']}s, {result['index_bytes'] / 1e6:.1f} MB, "
+                      f"open p50 {result['open']['p50_ms']}ms, query p50/p95/p99 "
+                      f"{q['p50_ms']}/{q['p95_ms']}/{q['p99_ms']}ms")
+                runs.append(result)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'config': {'vocab': args.vocab, 'doc_words': args.doc_words, 'queries': args.queries,
+                   'top_k': args.top_k, 'repeat': args.repeat, 'seed': args.seed},
+        'runs': {f"{r['variant']}@{r['docs']}": r for r in runs},
+    }
+    print('Results saved to', save_results('retrieval', results, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Semantic answer cache micro-benchmark.
+
+Fills a SemanticCache with synthetic questions, then measures lookup latency
+and hit rate for rephrasings of stored questions (expected hits), for stored
+"convert X to Y" questions asked the other way round (expected misses) and
+for unrelated questions (expected misses), plus the memory held by the
+signature array. Rephrasings reorder the content words and swap in filler
+and stop words, like "how do X Y work" versus "explain Y in X"; a quarter of
+the stored questions are conversions, rephrased as "convert X into Y" or
+"convert to Y from X".
+
+    python -m benchmarks.semantic_cache_bench --entries 1000 10000 --threshold 0.75
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import save_results, summarize
+from semantic_cache import SemanticCache
+
+VOCABULARY = [f'term{i}' for i in range(5000)]
+TEMPLATES = ['how do {} work', 'explain {}', 'what is {}', 'can you tell me about {}', '{} example please']
+CONVERSIONS = ['how do i convert {0} to {1}', 'convert {0} into {1}', 'can you convert to {1} from {0}']
+SCOPE = ('bench-model', None)
+
+
+def question(rng, words, reverse=False):
+    """A rephrasing of words; a (source, target) tuple asks for a conversion."""
+    if isinstance(words, tuple):
+        source, target = reversed(words) if reverse else words
+        return rng.choice(CONVERSIONS).format(source, target)
+    shuffled = list(words)
+    rng.shuffle(shuffled)
+    return rng.choice(TEMPLATES).format(' '.join(shuffled))
+
+
+def stored_words(rng):
+    if rng.random() < 0.25:
+        return tuple(rng.sample(VOCABULARY, 2))
+    return rng.sample(VOCABULARY, rng.randint(2, 6))
+
+
+def run(entries, probes, threshold, seed):
+    rng = random.Random(seed)
+    cache = SemanticCache(capacity=entries, threshold=threshold, ttl=3600)
+    stored = [stored_words(rng) for _ in range(entries)]
+    conversions = [words for words in stored if isinstance(words, tuple)]
+    start = time.perf_counter()
+    for words in stored:
+        cache.store(question(rng, words), SCOPE, 'answer')
+    fill = time.perf_counter() - start
+
+    results = {'entries': len(cache), 'fill_ms': round(fill * 1000, 1),
+               'signature_bytes': cache.signatures.itemsize * len(cache.signatures)}
+    for kind in ('rephrased', 'reversed', 'unrelated'):
+        timings, hits = [], 0
+        for _ in range(probes):
+            if kind == 'unrelated':
+                words = rng.sample(VOCABULARY, rng.randint(2, 6))
+            else:
+                words = rng.choice(stored if kind == 'rephrased' else conversions)
+            text = question(rng, words, reverse=kind == 'reversed')
+            t = time.perf_counter()
+            hit = cache.lookup(text, SCOPE)
+            timings.append(time.perf_counter() - t)
+            hits += hit is not None
+        results[kind] = dict(summarize(timings), hit_rate=round(hits / probes, 3))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the semantic answer cache')
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--probes', type=int, default=2000)
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    results = {}
+    for entries in args.entries:
+        results[str(entries)] = run(entries, args.probes, args.threshold, args.seed)
+        r = results[str(entries)]
+        print(f"{entries:>7} entries  fill {r['fill_ms']:8.1f} ms  "
+              f"hit p50 {r['rephrased']['p50_ms']:.3f} ms p99 {r['rephrased']['p99_ms']:.3f} ms "
+              f"rate {r['rephrased']['hit_rate']:.2f}  reversed rate {r['reversed']['hit_rate']:.2f}  "
+              f"miss p50 {r['unrelated']['p50_ms']:.3f} ms p99 {r['unrelated']['p99_ms']:.3f} ms "
+              f"rate {r['unrelated']['hit_rate']:.2f}")
+    print('Saved to', save_results('semantic_cache_bench', results, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Import-time and cold-start benchmark.
+
+Each measurement is the wall time of a fresh interpreter, so nothing is
+cached between runs except the OS page cache and __pycache__:
+
+- interpreter: `python -c pass`, the floor everything else includes
+- import_app:  `import app` (the factory module only)
+- create_app:  `import main`, i.e. every module plus create_app()
+- first_request: create_app() plus the first request served through the
+  WSGI stack (GET /login)
+
+It also checks that importing the app has no side effects: no database file
+is created. Use --max-create-app-ms in CI to fail when startup regresses.
+
+    python -m benchmarks.startup_bench --runs 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import save_results, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBES = {
+    'interpreter': 'pass',
+    'import_app': 'import app',
+    'create_app': 'import main',
+    'first_request': (
+        'import main\n'
+        'from werkzeug.test import create_environ, run_wsgi_app\n'
+        'body, status, headers = run_wsgi_app(main.app, create_environ("/login"), buffered=True)\n'
+        'assert status.startswith("200"), status\n'
+    ),
+}
+
+
+
+def run_probe(code, env):
+    """Wall time of a fresh interpreter running code, interpreter startup included."""
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - start
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'probe failed')
+    return elapsed
+
+
+def slowest_imports(module, env, top):
+    """Modules with the highest cumulative import time, from -X importtime."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT, env=env,
+                         capture_output=True, text=True, timeout=120)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        # Only top-level packages, to keep the list readable
+        if '.' not in name:
+            rows.append({'module': name, 'cumulative_ms': round(int(cumulative_us) / 1000, 1)})
+    rows.sort(key=lambda r: r['cumulative_ms'], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time and cold start of the app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    parser.add_argument('--max-create-app-ms', type=float, help='Exit non-zero if p50 create_app exceeds this')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'startup.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', SESSION_SECRET='bench')
+        for code in PROBES.values():
+            # Warm __pycache__ and the page cache so runs measure steady-state cold starts
+            run_probe(code, env)
+
+        results = {}
+        for name, code in PROBES.items():
+            timings = [run_probe(code, env) for _ in range(args.runs)]
+            results[name] = summarize(timings)
+            print(f"{name:<14} p50 {results[name]['p50_ms']:8.1f} ms   max {results[name]['max_ms']:8.1f} ms")
+        results['side_effect_free'] = not os.path.exists(db_path)
+        results['slowest_imports'] = slowest_imports('main', env, args.top)
+
+    print('import has no side effects:', results['side_effect_free'])
+    print(json.dumps(results['slowest_imports'], indent=2))
+    print('Saved to', save_results('startup_bench', results, args.output))
+
+    failed = not results['side_effect_free']
+    if args.max_create_app_ms is not None and results['create_app']['p50_ms'] > args.max_create_app_ms:
+        print(f"create_app p50 {results['create_app']['p50_ms']} ms exceeds {args.max_create_app_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
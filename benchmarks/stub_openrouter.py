@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI/OpenRouter-compatible stand-in for benchmarks.
+
+Serves POST /api/v1/chat/completions (and /v1/chat/completions) with a
+configurable latency distribution, optional SSE streaming and error
+injection, so the web app can be load tested without spending API credits.
+
+    python -m benchmarks.stub_openrouter --port 8999 --latency lognormal --latency-ms 800
+    OPENROUTER_BASE_URL=http://127.0.0.1:8999/api/v1 OPENROUTER_API_KEY=stub python main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('the quick brown fox jumps over the lazy dog while python decorators wrap '
+         'functions and generators yield values lazily').split()
+
+
+class StubConfig:
+    def __init__(self, latency='fixed', latency_ms=500.0, jitter_ms=100.0, ttft_ms=150.0,
+                 error_rate=0.0, error_status=500, timeout_rate=0.0, tokens=120, seed=None):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ttft_ms = ttft_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.tokens = tokens
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def sample_latency(self):
+        with self.lock:
+            if self.latency == 'uniform':
+                value = self.rng.uniform(max(0.0, self.latency_ms - self.jitter_ms), self.latency_ms + self.jitter_ms)
+            elif self.latency == 'normal':
+                value = self.rng.gauss(self.latency_ms, self.jitter_ms)
+            elif self.latency == 'lognormal':
+                # latency_ms is the median, jitter_ms controls the tail
+                sigma = max(self.jitter_ms, 1.0) / max(self.latency_ms, 1.0)
+                value = self.latency_ms * self.rng.lognormvariate(0.0, sigma)
+            else:
+                value = self.latency_ms
+        return max(0.0, value) / 1000.0
+
+    def roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/models'):
+                self._send_json(200, {'data': [{'id': 'stub-model'}]})
+            else:
+                self._send_json(404, {'error': {'message': 'not found'}})
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._send_json(404, {'error': {'message': 'not found'}})
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send_json(400, {'error': {'message': 'invalid JSON'}})
+                return
+            with config.lock:
+                config.requests += 1
+
+            total = config.sample_latency()
+            if config.roll(config.timeout_rate):
+                # Hang long enough for the client timeout to fire
+                time.sleep(max(total, 60.0))
+                return
+            if config.roll(config.error_rate):
+                time.sleep(min(total, config.ttft_ms / 1000.0))
+                self._send_json(config.error_status, {'error': {'message': 'injected error', 'code': config.error_status}})
+                return
+
+            model = payload.get('model') or 'stub-model'
+            prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in payload.get('messages') or [])
+            n_tokens = min(int(payload.get('max_tokens') or config.tokens), config.tokens)
+            words = [WORDS[i % len(WORDS)] for i in range(n_tokens)]
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': n_tokens,
+                     'total_tokens': prompt_tokens + n_tokens}
+
+            if payload.get('stream'):
+                self._stream(model, words, usage, total)
+                return
+
+            time.sleep(total)
+            self._send_json(200, {
+                'id': f'stub-{config.requests}',
+                'object': 'chat.completion',
+                'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ' '.join(words)}}],
+                'usage': usage,
+            })
+
+        def _stream(self, model, words, usage, total):
+            ttft = min(config.ttft_ms / 1000.0, total)
+            per_token = (total - ttft) / max(len(words), 1)
+            time.sleep(ttft)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            try:
+                for i, word in enumerate(words):
+                    chunk = {'model': model, 'choices': [{'index': 0, 'delta': {'content': (' ' if i else '') + word}}]}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                    if per_token:
+                        time.sleep(per_token)
+                final = {'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+                self.wfile.write(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(config, host='127.0.0.1', port=8999):
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config, host='127.0.0.1', port=0):
+    """Start a stub server on a background thread; returns (server, base_url)."""
+    server = serve(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}/api/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenRouter-compatible stub server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'normal', 'lognormal'], default='fixed')
+    parser.add_argument('--latency-ms', type=float, default=500.0, help='Fixed/mean/median total latency')
+    parser.add_argument('--jitter-ms', type=float, default=100.0, help='Spread of the latency distribution')
+    parser.add_argument('--ttft-ms', type=float, default=150.0, help='Time to first token when streaming')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction of requests that never answer')
+    parser.add_argument('--tokens', type=int, default=120, help='Completion tokens per answer')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        ttft_ms=args.ttft_ms, error_rate=args.error_rate, error_status=args.error_status,
+                        timeout_rate=args.timeout_rate, tokens=args.tokens, seed=args.seed)
+    server = serve(config, args.host, args.port)
+    print(f'Stub OpenRouter listening on http://{args.host}:{args.port}/api/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nExiting.')
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
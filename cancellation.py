@@ -0,0 +1,282 @@
+"""
+Cancellation of in-flight generations.
+
+/api/ask calls that carry a client-chosen request_id are registered here for
+as long as the upstream call runs. POST /api/ask/<request_id>/cancel, or the
+client disconnecting from /api/ask/stream, cancels the generation: the
+upstream socket is shut down, which wakes the worker blocked on it at once
+instead of after the upstream timeout, and whatever text had arrived is kept
+as a partial answer. A connection stops being tied to the generation as soon
+as it goes back to the shared pool, so a late cancel never reaches a socket
+that another request is using.
+
+A cancel that reaches a different worker process than the one running the
+generation is written to the cancel_requests table; every process with
+active generations polls it every CANCEL_POLL_INTERVAL seconds.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import metrics
+from flask import current_app
+
+from app import db
+from models import CancelRequest
+
+CANCEL_POLL_INTERVAL = float(os.environ.get('CANCEL_POLL_INTERVAL', '0.5'))
+CANCEL_REQUEST_TTL = timedelta(seconds=int(os.environ.get('CANCEL_REQUEST_TTL', '120')))
+MAX_REQUEST_ID_LENGTH = 64
+
+CANCELLED = metrics.counter('llm_cancelled_total', 'Generations cancelled before completion', ('reason',))
+
+
+class DuplicateRequest(Exception):
+    pass
+
+
+class Generation:
+    def __init__(self, user_id, request_id):
+        self.user_id = user_id
+        self.request_id = request_id
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._aborts = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds; returns True early if cancelled."""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, fn):
+        """Run fn when the generation is cancelled (immediately if it already is); returns fn for discard()."""
+        with self._lock:
+            if not self._event.is_set():
+                self._aborts.append(fn)
+                return fn
+        fn()
+        return fn
+
+    def discard(self, fn):
+        """Forget a callback registered with on_cancel()."""
+        with self._lock:
+            try:
+                self._aborts.remove(fn)
+            except ValueError:
+                pass
+
+    def cancel(self, reason='client'):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            aborts, self._aborts = self._aborts, []
+        CANCELLED.inc(reason=reason)
+        for fn in aborts:
+            try:
+                fn()
+            except Exception:
+                logging.exception('Abort callback failed for request %s', self.request_id)
+        return True
+
+
+_active = {}
+_lock = threading.Lock()
+_local = threading.local()
+_poller = None
+
+
+def valid_request_id(request_id):
+    return isinstance(request_id, str) and 0 < len(request_id) <= MAX_REQUEST_ID_LENGTH
+
+
+@contextmanager
+def track(user_id, request_id=None):
+    """Register a generation for the duration of the block."""
+    key = (user_id, request_id or uuid.uuid4().hex)
+    generation = Generation(*key)
+    with _lock:
+        if key in _active:
+            raise DuplicateRequest(key[1])
+        _active[key] = generation
+    _ensure_poller()
+    try:
+        with activate(generation):
+            yield generation
+    finally:
+        with _lock:
+            _active.pop(key, None)
+
+
+@contextmanager
+def activate(generation):
+    """Make upstream calls on this thread abortable through generation."""
+    previous = getattr(_local, 'generation', None)
+    _local.generation = generation
+    try:
+        yield generation
+    finally:
+        _local.generation = previous
+
+
+def current():
+    return getattr(_local, 'generation', None)
+
+
+def cancel(user_id, request_id, reason='client'):
+    """Cancel a generation; returns True if it ran in this process."""
+    with _lock:
+        generation = _active.get((user_id, request_id))
+    if generation is not None:
+        generation.cancel(reason)
+        return True
+    if CANCEL_POLL_INTERVAL > 0:
+        db.session.add(CancelRequest(user_id=user_id, request_id=request_id))
+        db.session.commit()
+    return False
+
+
+def _ensure_poller():
+    global _poller
+    if CANCEL_POLL_INTERVAL <= 0 or (_poller is not None and _poller.is_alive()):
+        return
+    with _lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = threading.Thread(target=_poll_forever, args=(current_app._get_current_object(),),
+                                       name='cancel-poller', daemon=True)
+            _poller.start()
+
+
+def _poll_forever(app):
+    while True:
+        time.sleep(CANCEL_POLL_INTERVAL)
+        with _lock:
+            keys = list(_active)
+        if keys:
+            poll_once(app, keys)
+
+
+def poll_once(app, keys):
+    with app.app_context():
+        try:
+            rows = CancelRequest.query.filter(
+                CancelRequest.request_id.in_([request_id for _, request_id in keys])).all()
+            for row in rows:
+                with _lock:
+                    generation = _active.get((row.user_id, row.request_id))
+                if generation is not None:
+                    generation.cancel('client')
+                    db.session.delete(row)
+            CancelRequest.query.filter(
+                CancelRequest.created_at < datetime.now() - CANCEL_REQUEST_TTL).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            logging.exception('Polling cancel requests failed')
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def _shutdown(sock):
+    # close() does not wake a thread blocked in recv() on the socket; shutdown() does
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _SocketAbort:
+    """Shuts a socket down on cancel, until disarmed when its connection is done with the response."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.armed = True
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.armed:
+                _shutdown(self.sock)
+
+    def disarm(self):
+        with self.lock:
+            self.armed = False
+
+
+class _AbortableMixin:
+    _abort = None
+
+    def getresponse(self, *args, **kwargs):
+        generation = current()
+        if generation is not None and self.sock is not None:
+            self.release_abort()
+            self._abort = (generation, generation.on_cancel(_SocketAbort(self.sock)))
+        return super().getresponse(*args, **kwargs)
+
+    def release_abort(self):
+        # Pooled connections are reused by other requests: a late cancel must not reach them
+        if self._abort is not None:
+            generation, abort = self._abort
+            self._abort = None
+            abort.disarm()
+            generation.discard(abort)
+
+
+def _release_on_put(pool_cls):
+    # A connection goes back to the pool once its response has been read or
+    # released. http.client may close() the connection object earlier while the
+    # response is still reading from the socket, so close() is not the place.
+    class Pool(pool_cls):
+        def _put_conn(self, conn):
+            if conn is not None:
+                conn.release_abort()
+            super()._put_conn(conn)
+    return Pool
+
+
+_session = None
+
+
+def http_session():
+    """Shared requests session; connections made for a tracked generation are shut down when it is cancelled."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _build_session():
+    # requests is only imported once the first upstream call is made
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class AbortableHTTPConnectionPool(_release_on_put(HTTPConnectionPool)):
+        ConnectionCls = type('AbortableHTTPConnection', (_AbortableMixin, HTTPConnection), {})
+
+    class AbortableHTTPSConnectionPool(_release_on_put(HTTPSConnectionPool)):
+        ConnectionCls = type('AbortableHTTPSConnection', (_AbortableMixin, HTTPSConnection), {})
+
+    class AbortableAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': AbortableHTTPConnectionPool,
+                                                       'https': AbortableHTTPSConnectionPool}
+
+    session = requests.Session()
+    session.mount('http://', AbortableAdapter())
+    session.mount('https://', AbortableAdapter())
+    return session
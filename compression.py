@@ -0,0 +1,46 @@
+"""
+On-the-fly gzip for dynamic JSON responses.
+
+Responses of COMPRESS_MIMETYPES at least COMPRESS_MIN_SIZE bytes long are
+gzipped when the client accepts it. Streamed responses (NDJSON exports and
+answers) and responses that already carry a Content-Encoding are left
+alone. Strong ETags become weak, since the compressed bytes differ from the
+representation the ETag was computed for.
+"""
+import gzip
+import os
+
+from assets import accepted_encodings
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+COMPRESS_MIMETYPES = {'application/json'}
+
+
+def should_compress(response, accept_encoding):
+    if COMPRESS_MIN_SIZE <= 0 or response.mimetype not in COMPRESS_MIMETYPES:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if 'gzip' not in accepted_encodings(accept_encoding):
+        return False
+    return response.content_length is not None and response.content_length >= COMPRESS_MIN_SIZE
+
+
+def init_app(app):
+    from flask import request
+
+    @app.after_request
+    def _compress_response(response):
+        if response.mimetype in COMPRESS_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+        if not should_compress(response, request.headers.get('Accept-Encoding')):
+            return response
+        response.set_data(gzip.compress(response.get_data(), compresslevel=COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
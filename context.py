@@ -0,0 +1,124 @@
+"""
+Conversation context for multi-turn chats.
+
+The prompt sent upstream is a rolling summary of older turns (stored on the
+Chat row) followed by every later message verbatim: at least the last
+CONTEXT_TURNS turns, and up to CONTEXT_SUMMARY_BATCH more. Once that many
+extra turns have built up they are folded into the summary in one call, so
+only new messages are ever summarized and long chats cost roughly the same
+per turn as short ones.
+"""
+import os
+
+from app import db
+from models import Message
+
+CONTEXT_TURNS = int(os.environ.get('CONTEXT_TURNS', '4'))
+CONTEXT_MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS', '3000'))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_MAX_TOKENS', '400'))
+CONTEXT_SUMMARY_BATCH = int(os.environ.get('CONTEXT_SUMMARY_BATCH', '4'))
+
+SUMMARY_PROMPT = '''Update the running summary of a conversation between a user and an assistant.
+Keep facts, decisions, names and open questions; drop pleasantries. Reply with the new summary only,
+in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}'''
+
+
+def estimate_tokens(text):
+    return len(text or '') // 4 + 1
+
+
+def truncate_tokens(text, max_tokens):
+    limit = max_tokens * 4
+    return text if len(text) <= limit else text[:limit].rsplit(' ', 1)[0] + ' ...'
+
+
+def format_transcript(messages):
+    return '\n'.join(f'{m.role}: {m.content}' for m in messages)
+
+
+def unsummarized_messages(chat, limit):
+    """The newest `limit` messages not yet folded into the summary, oldest first."""
+    query = Message.query.filter(Message.chat_id == chat.id)
+    if chat.summary_upto_id:
+        query = query.filter(Message.id > chat.summary_upto_id)
+    rows = query.order_by(Message.id.desc()).limit(limit).all()
+    rows.reverse()
+    return rows
+
+
+def fold_summary(chat, verbatim_from_id, summarize):
+    """Summarize the oldest unsummarized messages before the verbatim window.
+
+    Takes as many as fit in CONTEXT_MAX_TOKENS and moves summary_upto_id to
+    the last one the summarizer actually saw.
+    """
+    query = Message.query.filter(Message.chat_id == chat.id)
+    if chat.summary_upto_id:
+        query = query.filter(Message.id > chat.summary_upto_id)
+    if verbatim_from_id is not None:
+        query = query.filter(Message.id < verbatim_from_id)
+    pending, budget = [], CONTEXT_MAX_TOKENS
+    for msg in query.order_by(Message.id).limit(CONTEXT_SUMMARY_BATCH * 2 * 4):
+        cost = estimate_tokens(format_transcript([msg]))
+        if pending and cost > budget:
+            break
+        pending.append(msg)
+        budget -= cost
+    if not pending:
+        return False
+
+    prompt = SUMMARY_PROMPT.format(
+        max_words=CONTEXT_SUMMARY_MAX_TOKENS * 3 // 4,
+        summary=chat.summary or '(none)',
+        # Only cuts anything when a single message is over the budget on its own
+        transcript=truncate_tokens(format_transcript(pending), CONTEXT_MAX_TOKENS)
+    )
+    summary = summarize(prompt) if summarize else None
+    if not summary:
+        # Extractive fallback: keep the start of each message
+        parts = [chat.summary] if chat.summary else []
+        parts += [f'{m.role}: {m.content[:200]}' for m in pending]
+        summary = '\n'.join(parts)
+        summary = summary[-CONTEXT_SUMMARY_MAX_TOKENS * 4:]
+    chat.summary = truncate_tokens(summary.strip(), CONTEXT_SUMMARY_MAX_TOKENS)
+    chat.summary_upto_id = pending[-1].id
+    return True
+
+
+def build_history(chat, summarize=None):
+    """Messages (role/content dicts) to send before the new question.
+
+    Every message after summary_upto_id is sent verbatim: the window grows
+    from CONTEXT_TURNS turns until CONTEXT_SUMMARY_BATCH more turns have
+    built up behind it, and only then are those folded into the summary.
+    """
+    window = CONTEXT_TURNS * 2
+    fetch = window + CONTEXT_SUMMARY_BATCH * 2
+    recent = unsummarized_messages(chat, fetch)
+    if len(recent) >= fetch and len(recent) > window:
+        verbatim_from_id = recent[-window].id if window else None
+        if fold_summary(chat, verbatim_from_id, summarize):
+            db.session.flush()
+            recent = unsummarized_messages(chat, fetch)
+
+    history = []
+    budget = CONTEXT_MAX_TOKENS
+    if chat.summary:
+        history.append({'role': 'system', 'content': f'Summary of the earlier conversation:\n{chat.summary}'})
+        budget -= estimate_tokens(chat.summary)
+
+    turns = []
+    for msg in reversed(recent):
+        cost = estimate_tokens(msg.content)
+        if cost > budget:
+            break
+        budget -= cost
+        turns.append({'role': msg.role, 'content': msg.content})
+    turns.reverse()
+    return history + turns
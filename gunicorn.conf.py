@@ -0,0 +1,50 @@
+"""
+Gunicorn settings, picked up automatically when gunicorn runs from the repository root.
+
+Workers are threaded (gthread, GUNICORN_THREADS requests at a time each,
+WEB_CONCURRENCY workers): a request waiting on the LLM does not block its
+worker, and the per-worker admission queue in admission.py can order
+concurrent requests fairly.
+
+With GUNICORN_PRELOAD=1 the app is imported once in the master and workers
+fork from it, so they start with every module already loaded instead of
+each paying the import cost.
+"""
+import logging
+import os
+import sys
+
+wsgi_app = 'main:app'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+def on_starting(server):
+    if preload_app:
+        # Loaded lazily by the app on first use; import it here so workers inherit it
+        import requests  # noqa: F401
+
+
+def post_fork(server, worker):
+    main = sys.modules.get('main')
+    if main is None:
+        return
+    # Database connections opened in the master must not be shared across processes
+    from app import db
+    with main.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Runs in the exiting worker: write its final metric updates before child_exit folds them
+    import metrics
+    metrics.flush(force=True)
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -11,15 +11,14 @@ def create_schema():
     return Schema(path=ID(stored=True, unique=True), title=TEXT(stored=True), content=TEXT(stored=True, analyzer=StemmingAnalyzer()))
 
 
-def index_docs(docs_path, index_dir):
+def open_or_create_index(index_dir):
     if not os.path.exists(index_dir):
         os.makedirs(index_dir)
-        ix = index.create_in(index_dir, create_schema())
-    else:
-        ix = index.open_dir(index_dir)
+        return index.create_in(index_dir, create_schema())
+    return index.open_dir(index_dir)
 
-    writer = ix.writer()
-    count = 0
+
+def iter_docs(docs_path):
     for root, _, files in os.walk(docs_path):
         for fn in sorted(files):
             if not fn.lower().endswith('.txt'):
@@ -29,12 +28,26 @@ def index_docs(docs_path, index_dir):
                 txt = f.read().strip()
             if not txt:
                 continue
-            writer.update_document(path=path, title=fn, content=txt)
-            count += 1
+            yield path, fn, txt
+
+
+def index_documents(ix, docs, update=True, **writer_kwargs):
+    """Write (path, title, content) tuples to ix; returns the number indexed."""
+    writer = ix.writer(**writer_kwargs)
+    add = writer.update_document if update else writer.add_document
+    count = 0
+    for path, title, content in docs:
+        add(path=path, title=title, content=content)
+        count += 1
     writer.commit()
     return count
 
 
+def index_docs(docs_path, index_dir):
+    ix = open_or_create_index(index_dir)
+    return index_documents(ix, iter_docs(docs_path))
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--docs_path', default='docs', help='Folder with .txt docs')
@@ -1,5 +1,12 @@
-from app import app
-import routes
+import logging
+import os
+
+from app import create_app, init_db
+
+app = create_app()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    # The development server sets up the schema itself; deployments run `flask --app main init-db`
+    init_db(app)
     app.run(host="0.0.0.0", port=5000, debug=False)
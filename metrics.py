@@ -0,0 +1,419 @@
+"""
+Prometheus-style instrumentation for the chat app.
+
+Counters, gauges and histograms live in a per-process registry and are
+updated under a short per-metric lock, so they are cheap enough to leave on
+in production. When PROMETHEUS_MULTIPROC_DIR is set (gunicorn with several
+workers), every process snapshots its registry into that directory from a
+background thread every METRICS_FLUSH_INTERVAL seconds and once more when it
+exits, and the /metrics endpoint merges the snapshots of all workers.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def describe(self):
+        return {'kind': self.kind, 'doc': self.documentation, 'labelnames': list(self.labelnames)}
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def describe(self):
+        desc = super().describe()
+        desc['buckets'] = list(self.buckets)
+        return desc
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: dict(m.describe(), values=m.snapshot()) for m in metrics}
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+REQUEST_LATENCY = histogram('http_request_duration_seconds', 'HTTP request latency by route', ('route', 'method', 'status'))
+LLM_TTFB = histogram('llm_time_to_first_byte_seconds', 'Upstream LLM time to first byte', ('backend', 'model'))
+LLM_DURATION = histogram('llm_request_duration_seconds', 'Upstream LLM total request time', ('backend', 'model'))
+LLM_REQUESTS = counter('llm_requests_total', 'Upstream LLM calls by outcome', ('backend', 'model', 'outcome'))
+LLM_TOKENS = counter('llm_tokens_total', 'Tokens sent to and received from the LLM', ('backend', 'model', 'direction'))
+DB_QUERIES = histogram('db_queries_per_request', 'Number of SQL statements executed per request', ('route',), buckets=COUNT_BUCKETS)
+DB_TIME = histogram('db_time_per_request_seconds', 'Time spent in SQL per request', ('route',))
+RETRIEVAL_LATENCY = histogram('retrieval_duration_seconds', 'Document retrieval latency', ('mode',))
+CACHE_REQUESTS = counter('cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# --- multi-process support -------------------------------------------------
+
+_lock = threading.Lock()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(MULTIPROC_DIR, f'metrics_{pid or os.getpid()}.json')
+
+
+def _dead_path():
+    return os.path.join(MULTIPROC_DIR, 'metrics_dead.json')
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def flush(force=False):
+    """Write this process' registry to PROMETHEUS_MULTIPROC_DIR (rate limited)."""
+    global _last_flush
+    if not MULTIPROC_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    # A forced flush (timer, exit) waits briefly for one already in progress
+    acquired = _flush_lock.acquire(timeout=1) if force else _flush_lock.acquire(blocking=False)
+    if not acquired:
+        return
+    try:
+        _last_flush = now
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        _write_snapshot(_snapshot_path(), REGISTRY.snapshot())
+    except OSError:
+        pass
+    finally:
+        _flush_lock.release()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush(force=True)
+
+
+def start_flusher():
+    """Flush this process' snapshot periodically and at exit, whether or not it serves requests."""
+    global _flusher_pid
+    if not MULTIPROC_DIR or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        # A flusher inherited across fork has no thread in this process
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+        atexit.register(flush, force=True)
+
+
+def mark_process_dead(pid):
+    """Fold a dead worker's snapshot into metrics_dead.json and remove it.
+
+    Called from gunicorn's child_exit hook, so snapshots of exited workers do
+    not pile up and a new worker that reuses the PID starts from a clean file.
+    Counters and histograms keep counting towards the totals; gauges are dropped.
+    """
+    if not MULTIPROC_DIR:
+        return
+    path = _snapshot_path(pid)
+    snap = _read_snapshot(path)
+    if snap is not None:
+        live = {k: v for k, v in snap.items() if v['kind'] != 'gauge'}
+        dead = _read_snapshot(_dead_path()) or {}
+        merged = _merge([dead, live])
+        _write_snapshot(_dead_path(), {
+            name: dict(data, values=[[list(key), value] for key, value in data['values'].items()])
+            for name, data in merged.items()})
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _collect_snapshots():
+    snapshots = [REGISTRY.snapshot()]
+    if not MULTIPROC_DIR or not os.path.isdir(MULTIPROC_DIR):
+        return snapshots
+    own = os.getpid()
+    dead = _read_snapshot(_dead_path())
+    if dead is not None:
+        snapshots.append(dead)
+    for fn in os.listdir(MULTIPROC_DIR):
+        if not (fn.startswith('metrics_') and fn.endswith('.json')):
+            continue
+        try:
+            pid = int(fn[len('metrics_'):-len('.json')])
+        except ValueError:
+            continue
+        if pid == own:
+            continue
+        snap = _read_snapshot(os.path.join(MULTIPROC_DIR, fn))
+        if snap is None:
+            continue
+        if not _pid_alive(pid):
+            # Counters and histograms of dead workers are still part of the
+            # totals; their gauges are not.
+            snap = {k: v for k, v in snap.items() if v['kind'] != 'gauge'}
+        snapshots.append(snap)
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snap in snapshots:
+        for name, data in snap.items():
+            target = merged.setdefault(name, dict(data, values={}))
+            for labels, value in data['values']:
+                key = tuple(labels)
+                current = target['values'].get(key)
+                if data['kind'] == 'histogram':
+                    if current is None:
+                        target['values'][key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                else:
+                    target['values'][key] = (current or 0) + value
+    return merged
+
+
+# --- exposition ------------------------------------------------------------
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def render():
+    lines = []
+    merged = _merge(_collect_snapshots())
+    for name in sorted(merged):
+        data = merged[name]
+        names = data['labelnames']
+        lines.append(f'# HELP {name} {data["doc"]}')
+        lines.append(f'# TYPE {name} {data["kind"]}')
+        for key, value in sorted(data['values'].items()):
+            if data['kind'] == 'histogram':
+                counts, total, count = value
+                cumulative = 0
+                for bound, c in zip(list(data['buckets']) + [float('inf')], counts):
+                    cumulative += c
+                    le = _format_number(float(bound))
+                    lines.append(f'{name}_bucket{_format_labels(names, key, ("le", le))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(names, key)} {_format_number(total)}')
+                lines.append(f'{name}_count{_format_labels(names, key)} {count}')
+            else:
+                lines.append(f'{name}{_format_labels(names, key)} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Flask / SQLAlchemy integration ----------------------------------------
+
+def _install_db_hooks(engine):
+    from flask import g, has_request_context
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if has_request_context() and hasattr(g, '_metrics_db_queries'):
+            g._metrics_db_queries += 1
+            g._metrics_db_time += elapsed
+
+
+def init_app(app, db=None):
+    """Register request timing hooks, SQL counters and the /metrics endpoint."""
+    if not METRICS_ENABLED:
+        return
+
+    from flask import Response, abort, g, request
+
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                _install_db_hooks(engine)
+
+    @app.before_request
+    def _metrics_start_timer():
+        start_flusher()
+        g._metrics_start = time.perf_counter()
+        g._metrics_db_queries = 0
+        g._metrics_db_time = 0.0
+
+    @app.after_request
+    def _metrics_record_request(response):
+        start = getattr(g, '_metrics_start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route=route,
+                                method=request.method, status=response.status_code)
+        DB_QUERIES.observe(g._metrics_db_queries, route=route)
+        DB_TIME.observe(g._metrics_db_time, route=route)
+        flush()
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(403)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,7 +1,7 @@
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+import passwords
 import uuid
 
 class User(UserMixin, db.Model):
@@ -15,31 +15,121 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
-    chats = db.relationship('Chat', backref='user', lazy=True, cascade="all, delete-orphan")
+    chats = db.relationship('Chat', backref='user', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return passwords.needs_rehash(self.password_hash)
 
 
 
 class Chat(db.Model):
     __tablename__ = 'chats'
+    __table_args__ = (db.Index('ix_chats_user_updated', 'user_id', 'updated_at'),)
     id = db.Column(db.String, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String, nullable=False, default='New Chat')
+    summary = db.Column(db.Text, nullable=True)
+    summary_upto_id = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
-    messages = db.relationship('Message', backref='chat', lazy=True, cascade="all, delete-orphan", order_by="Message.created_at")
+    # Set while a background purge is deleting the chat; hidden from every query
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # Set while the chat's messages live in message_segments instead of messages
+    archived_at = db.Column(db.DateTime, nullable=True)
+    
+    messages = db.relationship('Message', backref='chat', lazy=True, cascade="all, delete-orphan",
+                               order_by="Message.created_at", passive_deletes=True)
+
+class ChatTombstone(db.Model):
+    __tablename__ = 'chat_tombstones'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.String, nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+class DeletionJob(db.Model):
+    __tablename__ = 'deletion_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False, index=True)
+    kind = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default='queued')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class MessageSegment(db.Model):
+    """Compressed, column-oriented copy of up to ARCHIVE_SEGMENT_SIZE messages of an archived chat."""
+    __tablename__ = 'message_segments'
+    __table_args__ = (db.UniqueConstraint('chat_id', 'seq'),)
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.String, db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    codec = db.Column(db.String, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+class ArchivedMessageSearch(db.Model):
+    """Search index entry for a message moved into a segment (the full-text part is dialect-specific)."""
+    __tablename__ = 'archived_message_search'
+    message_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    chat_id = db.Column(db.String, db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=False, index=True)
+    role = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime)
+
+class CancelRequest(db.Model):
+    __tablename__ = 'cancel_requests'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False)
+    request_id = db.Column(db.String(64), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+class SessionRevocation(db.Model):
+    """Tells every worker to stop trusting a user's session cookies and cached row."""
+    __tablename__ = 'session_revocations'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
 
 class Message(db.Model):
     __tablename__ = 'messages'
     id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(db.String, db.ForeignKey('chats.id'), nullable=False)
+    chat_id = db.Column(db.String, db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=False, index=True)
     role = db.Column(db.String, nullable=False)
     content = db.Column(db.Text, nullable=False)
     images_json = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # Usage and latency of the upstream call that produced an assistant message
+    model = db.Column(db.String, nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    ttft_ms = db.Column(db.Integer, nullable=True)
+    cache_hit = db.Column(db.Boolean, nullable=False, default=False)
+    # True when the generation was cancelled and content is the partial answer
+    cancelled = db.Column(db.Boolean, nullable=False, default=False)
+
+class CacheHit(db.Model):
+    """A near-duplicate answer served from the semantic cache, and whether it fit the question."""
+    __tablename__ = 'cache_hits'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False, index=True)
+    message_id = db.Column(db.Integer, nullable=True)
+    model = db.Column(db.String, nullable=True)
+    question = db.Column(db.Text, nullable=False)
+    matched_question = db.Column(db.Text, nullable=False)
+    similarity = db.Column(db.Float, nullable=False)
+    # Assumed right until the user says otherwise
+    correct = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
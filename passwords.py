@@ -0,0 +1,71 @@
+"""
+Password hashing with configurable cost and bounded concurrency.
+
+Hashes run on the request thread (scrypt and pbkdf2 release the GIL), but
+at most PASSWORD_HASH_WORKERS at a time per process, with up to
+PASSWORD_HASH_QUEUE more waiting for a turn. Anything beyond that fails fast
+with HashingBusy, which /login and /register turn into a 503, so a login
+burst cannot pile up CPU work.
+"""
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Any method werkzeug understands, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_HASH_SALT_LENGTH = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH', '16'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', '32'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a hash waited too long for its turn."""
+
+
+# Hashes admitted (running or waiting) and hashes running
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+_running = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS)
+_method_prefix = None
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy('Password hashing queue is full')
+    try:
+        if not _running.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+            raise HashingBusy('Password hashing timed out')
+        try:
+            return fn(*args)
+        finally:
+            _running.release()
+    finally:
+        _slots.release()
+
+
+def init_app(app):
+    # Working out the prefix costs a full hash; pay it at startup, not in the first login
+    method_prefix()
+
+
+def method_prefix(method=None):
+    """The parameter prefix werkzeug writes for `method`, e.g. "scrypt:32768:8:1"."""
+    global _method_prefix
+    if method is not None:
+        return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+    if _method_prefix is None:
+        _method_prefix = method_prefix(PASSWORD_HASH_METHOD)
+    return _method_prefix
+
+
+def hash_password(password, method=None):
+    return _run(generate_password_hash, password, method or PASSWORD_HASH_METHOD, PASSWORD_HASH_SALT_LENGTH)
+
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return not pwhash or pwhash.split('$', 1)[0] != method_prefix()
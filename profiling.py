@@ -0,0 +1,161 @@
+"""
+Opt-in request profiling.
+
+A request is profiled when it is picked by PROFILE_SAMPLE_RATE or when it
+carries an `X-Profile: <PROFILE_TOKEN>` header. Profiles are written to
+PROFILE_DIR either as cProfile pstats files (PROFILE_MODE=cprofile) or as
+collapsed stacks from a wall-clock sampler (PROFILE_MODE=sample), which can
+be fed straight into flamegraph.pl or speedscope. Only the newest
+PROFILE_MAX_FILES profiles are kept.
+
+When neither a sample rate nor a token is configured no hooks are installed,
+so the disabled path costs nothing.
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000.0
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+
+EXTENSIONS = ('.pstats', '.collapsed')
+_retention_lock = threading.Lock()
+
+
+def enabled():
+    return PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f'{stack} {count}\n')
+
+
+class CProfiler:
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+def _should_profile(headers):
+    if PROFILE_TOKEN and headers.get('X-Profile') == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profile_name(method, path, elapsed):
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', path).strip('-')[:60] or 'root'
+    ext = '.pstats' if PROFILE_MODE == 'cprofile' else '.collapsed'
+    return f'{int(time.time() * 1000)}_{os.getpid()}_{method}_{slug}_{int(elapsed * 1000)}ms{ext}'
+
+
+def _enforce_retention():
+    with _retention_lock:
+        profiles = list_profiles()
+        for entry in profiles[PROFILE_MAX_FILES:]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, entry['name']))
+            except OSError:
+                pass
+
+
+def list_profiles():
+    """Profiles in PROFILE_DIR, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = []
+    for fn in os.listdir(PROFILE_DIR):
+        if not fn.endswith(EXTENSIONS):
+            continue
+        path = os.path.join(PROFILE_DIR, fn)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append({'name': fn, 'size': st.st_size, 'created': int(st.st_mtime * 1000)})
+    entries.sort(key=lambda e: e['name'], reverse=True)
+    return entries
+
+
+def is_profile_name(name):
+    return name.endswith(EXTENSIONS) and os.path.basename(name) == name and not name.startswith('.')
+
+
+def init_app(app):
+    if not enabled():
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _profiling_start():
+        if not _should_profile(request.headers):
+            return
+        if PROFILE_MODE == 'cprofile':
+            profiler = CProfiler()
+        else:
+            profiler = StackSampler(threading.get_ident())
+        g._profiler = profiler
+        g._profile_start = time.perf_counter()
+        profiler.start()
+
+    @app.teardown_request
+    def _profiling_stop(exc):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return
+        profiler.stop()
+        elapsed = time.perf_counter() - g.pop('_profile_start')
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.write(os.path.join(PROFILE_DIR, _profile_name(request.method, request.path, elapsed)))
+            _enforce_retention()
+        except OSError as e:
+            app.logger.warning('Failed to write profile: %s', e)
@@ -0,0 +1,183 @@
+"""
+Set-based deletion of chats and users.
+
+Small deletions run inline as two DELETE ... WHERE ... IN statements. Large
+ones hide the chats immediately (deleted_at + tombstones) and hand the work
+to a background thread that deletes messages in batches, committing after
+each batch so no request, and no single transaction, ever blocks on a big
+purge. Jobs and hidden chats left behind by a worker that died mid-purge
+(including account deletions, whose user row is only removed at the end)
+are finished with `python purge.py --pending`.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app import create_app, db
+from models import CacheHit, Chat, ChatTombstone, DeletionJob, Message, MessageSegment, User
+
+PURGE_SYNC_MAX_MESSAGES = int(os.environ.get('PURGE_SYNC_MAX_MESSAGES', '2000'))
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '1000'))
+PURGE_BATCH_PAUSE = float(os.environ.get('PURGE_BATCH_PAUSE', '0.01'))
+CHAT_CHUNK = 500
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+    return _executor
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def count_messages(chat_ids):
+    total = 0
+    for chunk in _chunks(chat_ids, CHAT_CHUNK):
+        total += db.session.query(db.func.count(Message.id)).filter(Message.chat_id.in_(chunk)).scalar()
+    return total
+
+
+def delete_chats_now(chat_ids):
+    """Delete chats and their messages with set-based statements (no ORM loads)."""
+    for chunk in _chunks(chat_ids, CHAT_CHUNK):
+        Message.query.filter(Message.chat_id.in_(chunk)).delete(synchronize_session=False)
+        MessageSegment.query.filter(MessageSegment.chat_id.in_(chunk)).delete(synchronize_session=False)
+        Chat.query.filter(Chat.id.in_(chunk)).delete(synchronize_session=False)
+
+
+def hide_chats(user_id, chat_ids):
+    now = datetime.now()
+    for chunk in _chunks(chat_ids, CHAT_CHUNK):
+        Chat.query.filter(Chat.id.in_(chunk)).update({'deleted_at': now}, synchronize_session=False)
+    db.session.add_all([ChatTombstone(chat_id=chat_id, user_id=user_id, deleted_at=now) for chat_id in chat_ids])
+
+
+def delete_chats(user_id, chat_ids):
+    """Delete the given chats of user_id; returns a DeletionJob when deferred, else None."""
+    chat_ids = [row.id for chunk in _chunks(list(chat_ids), CHAT_CHUNK)
+                for row in db.session.query(Chat.id).filter(
+                    Chat.user_id == user_id, Chat.id.in_(chunk), Chat.deleted_at.is_(None))]
+    if not chat_ids:
+        return None
+
+    hide_chats(user_id, chat_ids)
+    if count_messages(chat_ids) <= PURGE_SYNC_MAX_MESSAGES:
+        delete_chats_now(chat_ids)
+        db.session.commit()
+        return None
+
+    job = DeletionJob(user_id=user_id, kind='chats', total=len(chat_ids))
+    db.session.add(job)
+    db.session.commit()
+    _get_executor().submit(run_job, current_app._get_current_object(), job.id)
+    return job
+
+
+def delete_user(user_id):
+    """Hide all of a user's chats now and delete them and the user in the background."""
+    chat_ids = [row.id for row in db.session.query(Chat.id).filter(
+        Chat.user_id == user_id, Chat.deleted_at.is_(None))]
+    hide_chats(user_id, chat_ids)
+    job = DeletionJob(user_id=user_id, kind='user', total=len(chat_ids))
+    db.session.add(job)
+    db.session.commit()
+    _get_executor().submit(run_job, current_app._get_current_object(), job.id)
+    return job
+
+
+def _purge_hidden_chats(user_id, job=None):
+    while True:
+        chat_ids = [row.id for row in db.session.query(Chat.id).filter(
+            Chat.user_id == user_id, Chat.deleted_at.isnot(None)).limit(CHAT_CHUNK)]
+        if not chat_ids:
+            return
+        while True:
+            batch = [row.id for row in db.session.query(Message.id).filter(
+                Message.chat_id.in_(chat_ids)).limit(PURGE_BATCH_SIZE)]
+            if not batch:
+                break
+            Message.query.filter(Message.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+            time.sleep(PURGE_BATCH_PAUSE)
+        MessageSegment.query.filter(MessageSegment.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+        Chat.query.filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
+        if job is not None:
+            job.done = (job.done or 0) + len(chat_ids)
+        db.session.commit()
+
+
+def run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(DeletionJob, job_id)
+        if job is None:
+            return
+        job.status = 'running'
+        db.session.commit()
+        try:
+            _purge_hidden_chats(job.user_id, job)
+            if job.kind == 'user':
+                ChatTombstone.query.filter_by(user_id=job.user_id).delete(synchronize_session=False)
+                CacheHit.query.filter_by(user_id=job.user_id).delete(synchronize_session=False)
+                DeletionJob.query.filter(DeletionJob.user_id == job.user_id,
+                                         DeletionJob.id != job.id).delete(synchronize_session=False)
+                User.query.filter_by(id=job.user_id).delete(synchronize_session=False)
+            job.status = 'done'
+            job.finished_at = datetime.now()
+            db.session.commit()
+        except Exception:
+            logging.exception('Deletion job %s failed', job_id)
+            db.session.rollback()
+            job = db.session.get(DeletionJob, job_id)
+            if job is not None:
+                job.status = 'failed'
+                db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def purge_pending(app):
+    """Finish purges interrupted by a worker restart; returns (jobs resumed, users swept)."""
+    with app.app_context():
+        # User jobs first: they also remove the user row, and drop the user's other jobs
+        job_ids = [row.id for row in db.session.query(DeletionJob.id).filter(
+            DeletionJob.status.in_(('queued', 'running', 'failed'))
+        ).order_by((DeletionJob.kind == 'user').desc(), DeletionJob.id)]
+    for job_id in job_ids:
+        run_job(app, job_id)
+    with app.app_context():
+        user_ids = [row.user_id for row in db.session.query(Chat.user_id).filter(
+            Chat.deleted_at.isnot(None)).distinct()]
+        for user_id in user_ids:
+            _purge_hidden_chats(user_id)
+        return len(job_ids), len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Purge deleted chats')
+    parser.add_argument('--pending', action='store_true',
+                        help='Finish interrupted deletion jobs and delete chats they left hidden')
+    args = parser.parse_args()
+    if args.pending:
+        jobs, users = purge_pending(create_app())
+        print(f'Resumed {jobs} deletion jobs; purged hidden chats for {users} users')
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
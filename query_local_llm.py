@@ -1,8 +1,7 @@
 import argparse
 import pickle
 import os
-from whoosh import index
-from whoosh.qparser import MultifieldParser
+import metrics
 
 
 PROMPT_TEMPLATE = '''You are a helpful assistant. Use the provided context to answer the user's question. If the answer is not contained in the context, say you don't know.
@@ -20,6 +19,7 @@ def load_index(index_dir, meta_path):
         raise FileNotFoundError(f'Index directory not found: {index_dir}')
     if not os.path.exists(meta_path):
         raise FileNotFoundError(f'Metadata file not found: {meta_path}')
+    from whoosh import index
     ix = index.open_dir(index_dir)
     with open(meta_path, 'rb') as f:
         meta = pickle.load(f)
@@ -27,11 +27,13 @@ def load_index(index_dir, meta_path):
 
 
 def retrieve(query, ix, top_k=3):
+    from whoosh.qparser import MultifieldParser
     qp = MultifieldParser(['title', 'content'], schema=ix.schema)
     q = qp.parse(query)
-    with ix.searcher() as searcher:
-        results = searcher.search(q, limit=top_k)
-        contexts = [r['content'] for r in results]
+    with metrics.RETRIEVAL_LATENCY.time(mode='whoosh'):
+        with ix.searcher() as searcher:
+            results = searcher.search(q, limit=top_k)
+            contexts = [r['content'] for r in results]
     return contexts
 
 
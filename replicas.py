@@ -0,0 +1,168 @@
+"""
+Read-replica routing.
+
+Set DATABASE_REPLICA_URLS to a comma-separated list of replica database URLs
+and GET/HEAD requests read from one of them instead of the primary
+(DATABASE_URL). Writes always go to the primary, and once a request writes
+anything the rest of it reads from the primary too.
+
+Read-your-writes: after a user's POST/PUT/DELETE, their reads stay on the
+primary for REPLICA_STICKY_SECONDS. The window is kept in the session cookie,
+so it follows the user across workers, and is also renewed per worker on
+every commit, which covers answers saved at the end of a streamed response.
+
+A background thread checks each replica every REPLICA_HEALTH_INTERVAL
+seconds; a replica that fails a check or drops a connection is skipped until
+it passes again, and reads fall back to the primary when none is healthy.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+import metrics
+from cache import TTLCache
+
+DATABASE_REPLICA_URLS = [u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', '5'))
+SESSION_KEY = '_db_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+READS = metrics.counter('db_read_requests_total', 'Read-only requests by database target', ('target',))
+HEALTHY = metrics.gauge('db_replica_healthy', 'Whether a read replica is in rotation', ('replica',))
+
+log = logging.getLogger(__name__)
+
+_healthy = {}
+_lock = threading.Lock()
+_checker = None
+# user_id -> True for users who committed on this worker within the sticky window
+_recent_writers = TTLCache(maxsize=4096, ttl=REPLICA_STICKY_SECONDS)
+
+
+def bind_keys():
+    return [f'replica_{i}' for i in range(len(DATABASE_REPLICA_URLS))]
+
+
+def binds():
+    """SQLALCHEMY_BINDS entries for the configured replicas."""
+    return dict(zip(bind_keys(), DATABASE_REPLICA_URLS))
+
+
+class RoutingSession(Session):
+    """Sends reads to the replica chosen for the current request, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            key = g.get('db_replica')
+            if key is not None:
+                if not self._flushing and not isinstance(clause, UpdateBase):
+                    return self._db.engines[key]
+                # Pin the rest of the request to the primary so it reads its own write
+                g.db_replica = None
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def sticky():
+    until = session.get(SESSION_KEY)
+    if until and until > time.time():
+        return True
+    user_id = session.get('_user_id')
+    return user_id is not None and user_id in _recent_writers
+
+
+def choose():
+    """Bind key of a healthy replica for this request, or None for the primary."""
+    if not DATABASE_REPLICA_URLS or request.method not in READ_METHODS:
+        return None
+    if sticky():
+        READS.inc(target='primary_sticky')
+        return None
+    _ensure_checker()
+    candidates = [key for key in bind_keys() if _healthy.get(key, True)]
+    if not candidates:
+        READS.inc(target='primary_fallback')
+        return None
+    READS.inc(target='replica')
+    return random.choice(candidates)
+
+
+def mark(key, healthy, reason=None):
+    with _lock:
+        was = _healthy.get(key, True)
+        _healthy[key] = healthy
+    HEALTHY.set(1 if healthy else 0, replica=key)
+    if was and not healthy:
+        log.warning('Read replica %s out of rotation: %s', key, reason)
+    elif healthy and not was:
+        log.info('Read replica %s back in rotation', key)
+
+
+def check(app):
+    """Run a trivial query against every replica and update its health."""
+    with app.app_context():
+        engines = current_app.extensions['sqlalchemy'].engines
+        for key in bind_keys():
+            try:
+                with engines[key].connect() as conn:
+                    conn.execute(text('SELECT 1'))
+            except Exception as e:
+                mark(key, False, e)
+            else:
+                mark(key, True)
+
+
+def _check_forever(app):
+    while True:
+        time.sleep(REPLICA_HEALTH_INTERVAL)
+        check(app)
+
+
+def _ensure_checker():
+    global _checker
+    if REPLICA_HEALTH_INTERVAL <= 0 or (_checker is not None and _checker.is_alive()):
+        return
+    with _lock:
+        if _checker is None or not _checker.is_alive():
+            _checker = threading.Thread(target=_check_forever, args=(current_app._get_current_object(),),
+                                        name='replica-health', daemon=True)
+            _checker.start()
+
+
+def _install_engine_hooks(key, engine):
+    @event.listens_for(engine, 'handle_error')
+    def _replica_error(context):
+        if context.is_disconnect:
+            mark(key, False, context.original_exception)
+
+
+def init_app(app, db):
+    if not DATABASE_REPLICA_URLS:
+        return
+
+    with app.app_context():
+        for key in bind_keys():
+            _install_engine_hooks(key, db.engines[key])
+            HEALTHY.set(1, replica=key)
+
+    @event.listens_for(db.session, 'after_commit')
+    def _remember_writer(db_session):
+        if has_request_context() and REPLICA_STICKY_SECONDS > 0:
+            user_id = session.get('_user_id')
+            if user_id is not None:
+                _recent_writers.set(user_id, True)
+
+    @app.before_request
+    def _route_reads():
+        if request.method not in READ_METHODS:
+            if REPLICA_STICKY_SECONDS > 0:
+                session[SESSION_KEY] = time.time() + REPLICA_STICKY_SECONDS
+            return
+        g.db_replica = choose()
@@ -0,0 +1,163 @@
+"""
+Structured JSONL log of /api/ask traffic.
+
+With REQUEST_LOG_DIR set, every /api/ask and /api/ask/stream call appends
+one JSON line: the question, model, outcome, timings, token counts, sizes
+and a SHA-256 of the answer. Requests only put the entry on a bounded
+in-memory queue; a background thread writes queued entries in batches, so
+the request path never touches the disk. When the queue is full the entry is
+dropped and counted in request_log_entries_total{result="dropped"}.
+
+Each worker process writes its own requests-<pid>.jsonl, rotated to
+requests-<pid>-<epoch ms>.jsonl once it reaches REQUEST_LOG_MAX_BYTES or is
+REQUEST_LOG_ROTATE_SECONDS old; only the newest REQUEST_LOG_BACKUPS rotated
+files are kept. benchmarks/replay.py re-drives captured logs against a server.
+"""
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+REQUEST_LOG_DIR = os.environ.get('REQUEST_LOG_DIR')
+REQUEST_LOG_MAX_BYTES = int(os.environ.get('REQUEST_LOG_MAX_BYTES', str(64 * 1024 * 1024)))
+REQUEST_LOG_ROTATE_SECONDS = float(os.environ.get('REQUEST_LOG_ROTATE_SECONDS', '3600'))
+REQUEST_LOG_BACKUPS = int(os.environ.get('REQUEST_LOG_BACKUPS', '24'))
+REQUEST_LOG_QUEUE_SIZE = int(os.environ.get('REQUEST_LOG_QUEUE_SIZE', '10000'))
+REQUEST_LOG_FLUSH_INTERVAL = float(os.environ.get('REQUEST_LOG_FLUSH_INTERVAL', '1'))
+REQUEST_LOG_BATCH_SIZE = 512
+
+ENTRIES = metrics.counter('request_log_entries_total', 'Request log entries by result', ('result',))
+
+log = logging.getLogger(__name__)
+
+
+def enabled():
+    return bool(REQUEST_LOG_DIR)
+
+
+def response_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() if text else None
+
+
+def ask_entry(endpoint, started, user_id, chat_id, question, images, stats, response, outcome):
+    """One log line for an ask; `started` is the time.time() the request began."""
+    return {
+        'ts': round(started, 3),
+        'endpoint': endpoint,
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'question': question,
+        'images': len(images or []),
+        'model': stats.get('model'),
+        'outcome': outcome,
+        'total_ms': int((time.time() - started) * 1000),
+        'ttft_ms': stats.get('ttft_ms'),
+        'latency_ms': stats.get('latency_ms'),
+        'prompt_tokens': stats.get('prompt_tokens'),
+        'completion_tokens': stats.get('completion_tokens'),
+        'question_bytes': len(question.encode('utf-8')),
+        'response_bytes': len(response.encode('utf-8')) if response else 0,
+        'response_sha256': response_hash(response),
+    }
+
+
+class RequestLog:
+    """Bounded queue drained by one writer thread into a rotating JSONL file."""
+
+    def __init__(self, directory, max_bytes=REQUEST_LOG_MAX_BYTES, rotate_seconds=REQUEST_LOG_ROTATE_SECONDS,
+                 backups=REQUEST_LOG_BACKUPS, queue_size=REQUEST_LOG_QUEUE_SIZE,
+                 flush_interval=REQUEST_LOG_FLUSH_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'requests-{self.pid}.jsonl')
+        self._file = None
+        self._opened = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-log', daemon=True)
+        self._thread.start()
+
+    def put(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            ENTRIES.inc(result='dropped')
+
+    def close(self, timeout=5):
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not (self._stopped.is_set() and self.queue.empty()):
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < REQUEST_LOG_BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                if batch:
+                    self._write(batch)
+                elif self._file is not None and self._due():
+                    self._rotate()
+            except Exception:
+                ENTRIES.inc(len(batch), result='failed')
+                log.exception('Writing the request log failed')
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, batch):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._opened = time.time()
+        self._file.write(''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in batch))
+        self._file.flush()
+        ENTRIES.inc(len(batch), result='written')
+        if self._due():
+            self._rotate()
+
+    def _due(self):
+        return (self._file.tell() >= self.max_bytes
+                or (self.rotate_seconds > 0 and time.time() - self._opened >= self.rotate_seconds))
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if os.path.getsize(self.path) > 0:
+            stamp = int(time.time() * 1000)
+            os.replace(self.path, os.path.join(self.directory, f'requests-{self.pid}-{stamp}.jsonl'))
+        # Rotated names sort by time within a worker; prune across all of them by age
+        rotated = sorted(glob.glob(os.path.join(self.directory, 'requests-*-*.jsonl')), key=os.path.getmtime)
+        for path in rotated[:max(len(rotated) - self.backups, 0)]:
+            os.remove(path)
+
+
+_log = None
+_lock = threading.Lock()
+
+
+def record(entry):
+    """Queue an entry for writing; never blocks."""
+    global _log
+    if not enabled():
+        return
+    # A log inherited across fork has no writer thread in this process
+    if _log is None or _log.pid != os.getpid():
+        with _lock:
+            if _log is None or _log.pid != os.getpid():
+                _log = RequestLog(REQUEST_LOG_DIR)
+                atexit.register(_log.close)
+    _log.put(entry)
@@ -1,18 +1,48 @@
 import os
 import json
-from flask import session, request, jsonify, render_template, url_for, redirect, flash
-from app import app, db
+from flask import Blueprint, current_app, session, request, jsonify, render_template, url_for, redirect, flash, send_from_directory, Response, stream_with_context
+from app import db
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
-import requests
-from models import User, Chat, Message
+import time
+from datetime import datetime, timedelta
+import metrics
+import profiling
+import user_cache
+import context
+import search
+import purge
+import transfer
+import admission
+import cancellation
+import batch
+import request_log
+import semantic_cache
+import archive
+from passwords import HashingBusy
+from models import User, Chat, Message, ChatTombstone, DeletionJob, CacheHit
 from functools import wraps
+from contextlib import ExitStack
 
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+bp = Blueprint('chat', __name__)
+login_manager = LoginManager()
+login_manager.login_view = 'chat.login'
+
+def init_app(app):
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+DELETED_PASSWORD_HASH = '!'
+
+def active_user(user_id):
+    """The user row, or None once the account has been deleted (its purge may still be running)."""
+    user = User.query.get(user_id)
+    if user is None or user.password_hash == DELETED_PASSWORD_HASH:
+        return None
+    return user
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.load(user_id, active_user)
 
 def require_login(f):
     @wraps(f)
@@ -22,20 +52,43 @@ def require_login(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def require_admin(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required'}), 401
+        if current_user.username not in ADMIN_USERNAMES:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+ADMIN_USERNAMES = {u.strip() for u in os.environ.get('ADMIN_USERNAMES', '').split(',') if u.strip()}
+TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30')))
+SYNC_OVERLAP = timedelta(seconds=2)
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'gpt-4o-mini')
+OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1').rstrip('/')
+# Models a batch may ask for besides OPENROUTER_MODEL
+OPENROUTER_MODELS = {m.strip() for m in os.environ.get('OPENROUTER_MODELS', '').split(',') if m.strip()} | {OPENROUTER_MODEL}
 
-print(f"[INIT] OpenRouter initialized with model: {OPENROUTER_MODEL}")
+def busy_response(retry_after=1):
+    resp = jsonify({'error': 'Server is busy, please try again'})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
 
-@app.before_request
+def too_many_requests(rejection):
+    resp = jsonify({'error': 'Too many requests, please retry later', 'reason': rejection.reason})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(rejection.retry_after)
+    return resp
+
+@bp.before_app_request
 def make_session_permanent():
     session.permanent = True
 
-def try_run_openrouter(prompt, max_tokens=2000, temperature=0.2, images=None):
-    if not OPENROUTER_API_KEY:
-        return None, "OpenRouter API key not configured"
-
-    url = 'https://openrouter.ai/api/v1/chat/completions'
+def openrouter_request(prompt, max_tokens, temperature, images, history, model=None):
+    url = f'{OPENROUTER_BASE_URL}/chat/completions'
     headers = {
         'Authorization': f'Bearer {OPENROUTER_API_KEY}',
         'Content-Type': 'application/json'
@@ -53,20 +106,59 @@ def try_run_openrouter(prompt, max_tokens=2000, temperature=0.2, images=None):
             })
 
     payload = {
-        'model': OPENROUTER_MODEL,
-        'messages': [{'role': 'user', 'content': content if images else prompt}],
+        'model': model or OPENROUTER_MODEL,
+        'messages': (history or []) + [{'role': 'user', 'content': content if images else prompt}],
         'max_tokens': max_tokens,
         'temperature': temperature
     }
+    return url, headers, payload
+
+def record_openrouter_usage(data, stats, labels):
+    usage = data.get('usage') or {}
+    stats['model'] = data.get('model') or labels['model']
+    stats['prompt_tokens'] = usage.get('prompt_tokens')
+    stats['completion_tokens'] = usage.get('completion_tokens')
+    metrics.LLM_TOKENS.inc(usage.get('prompt_tokens') or 0, direction='in', **labels)
+    metrics.LLM_TOKENS.inc(usage.get('completion_tokens') or 0, direction='out', **labels)
+    metrics.LLM_REQUESTS.inc(outcome='ok', **labels)
 
+def try_run_openrouter(prompt, max_tokens=2000, temperature=0.2, images=None, stats=None, history=None,
+                       generation=None, model=None):
+    if not OPENROUTER_API_KEY:
+        return None, "OpenRouter API key not configured"
+    if generation is not None:
+        # Streamed so that a cancelled call keeps the text generated so far
+        upstream = stream_openrouter(prompt, max_tokens, temperature, images, stats, history, generation, model)
+        while True:
+            try:
+                next(upstream)
+            except StopIteration as stop:
+                return stop.value
+
+    url, headers, payload = openrouter_request(prompt, max_tokens, temperature, images, history, model)
+    labels = {'backend': 'openrouter', 'model': model or OPENROUTER_MODEL}
+    if stats is None:
+        stats = {}
+    stats['model'] = labels['model']
+    start = time.perf_counter()
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        resp = cancellation.http_session().post(url, json=payload, headers=headers, timeout=30)
+        ttfb = resp.elapsed.total_seconds()
+        metrics.LLM_TTFB.observe(ttfb, **labels)
         data = resp.json()
+        elapsed = time.perf_counter() - start
+        metrics.LLM_DURATION.observe(elapsed, **labels)
+        # Headers only arrive once the whole answer is generated: no time to first token here
+        stats['ttft_ms'] = None
+        stats['latency_ms'] = int(elapsed * 1000)
         
         if resp.status_code != 200:
+            metrics.LLM_REQUESTS.inc(outcome='error', **labels)
             err = data.get('error') if isinstance(data, dict) else None
             return None, f"OpenRouter API error ({resp.status_code}): {err or data}"
         
+        record_openrouter_usage(data, stats, labels)
+        
         choices = data.get('choices') or []
         if len(choices) > 0:
             message = choices[0].get('message') or choices[0]
@@ -74,18 +166,91 @@ def try_run_openrouter(prompt, max_tokens=2000, temperature=0.2, images=None):
             return (text.strip(), None) if text else (None, None)
         return None, 'No choices in OpenRouter response'
     except Exception as e:
+        metrics.LLM_REQUESTS.inc(outcome='exception', **labels)
         return None, f"OpenRouter request failed: {e}"
 
-@app.route('/')
+def stream_openrouter(prompt, max_tokens=2000, temperature=0.2, images=None, stats=None, history=None,
+                      generation=None, model=None):
+    """Yield text deltas as they arrive, then return (text, error) like try_run_openrouter.
+
+    If the generation is cancelled the text received so far is returned and
+    stats['cancelled'] is set.
+    """
+    if not OPENROUTER_API_KEY:
+        return None, "OpenRouter API key not configured"
+
+    url, headers, payload = openrouter_request(prompt, max_tokens, temperature, images, history, model)
+    payload['stream'] = True
+    payload['stream_options'] = {'include_usage': True}
+    labels = {'backend': 'openrouter', 'model': model or OPENROUTER_MODEL}
+    if stats is None:
+        stats = {}
+    stats['model'] = labels['model']
+    cancelled = lambda: generation is not None and generation.cancelled
+    parts = []
+    final = {}
+    start = time.perf_counter()
+    try:
+        with cancellation.http_session().post(url, json=payload, headers=headers, timeout=30, stream=True) as resp:
+            if resp.status_code != 200:
+                metrics.LLM_REQUESTS.inc(outcome='error', **labels)
+                try:
+                    data = resp.json()
+                except ValueError:
+                    data = resp.text
+                err = data.get('error') if isinstance(data, dict) else None
+                return None, f"OpenRouter API error ({resp.status_code}): {err or data}"
+            for line in resp.iter_lines(decode_unicode=True):
+                if cancelled():
+                    break
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    final = chunk
+                for choice in chunk.get('choices') or []:
+                    delta = (choice.get('delta') or {}).get('content')
+                    if not delta:
+                        continue
+                    if not parts:
+                        ttft = time.perf_counter() - start
+                        metrics.LLM_TTFB.observe(ttft, **labels)
+                        stats['ttft_ms'] = int(ttft * 1000)
+                    parts.append(delta)
+                    yield delta
+    except Exception as e:
+        if not cancelled():
+            metrics.LLM_REQUESTS.inc(outcome='exception', **labels)
+            return None, f"OpenRouter request failed: {e}"
+
+    elapsed = time.perf_counter() - start
+    metrics.LLM_DURATION.observe(elapsed, **labels)
+    stats['latency_ms'] = int(elapsed * 1000)
+    text = ''.join(parts).strip() or None
+    if cancelled():
+        metrics.LLM_REQUESTS.inc(outcome='cancelled', **labels)
+        stats['cancelled'] = True
+    else:
+        record_openrouter_usage(final, stats, labels)
+    return text, None
+
+def summarize_conversation(prompt):
+    summary, error = try_run_openrouter(prompt, max_tokens=context.CONTEXT_SUMMARY_MAX_TOKENS, temperature=0)
+    return None if error else summary
+
+@bp.route('/')
 def index_route():
     if current_user.is_authenticated:
         return render_template('chat.html', user=current_user)
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index_route'))
+        return redirect(url_for('.index_route'))
     
     if request.method == 'POST':
         data = request.json
@@ -97,18 +262,31 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except HashingBusy:
+            return busy_response()
+        
+        if valid and user.password_needs_rehash():
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except HashingBusy:
+                pass
+        
+        if valid:
             login_user(user)
-            return jsonify({'success': True, 'redirect': url_for('index_route')})
+            user_cache.remember(user)
+            return jsonify({'success': True, 'redirect': url_for('.index_route')})
         
         return jsonify({'error': 'Invalid username or password'}), 401
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index_route'))
+        return redirect(url_for('.index_route'))
     
     if request.method == 'POST':
         data = request.json
@@ -126,38 +304,97 @@ def register():
             return jsonify({'error': 'Email already registered'}), 400
         
         user = User(username=username, email=email or None)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except HashingBusy:
+            return busy_response()
         db.session.add(user)
         db.session.commit()
         
         login_user(user)
-        return jsonify({'success': True, 'redirect': url_for('index_route')})
+        user_cache.remember(user)
+        return jsonify({'success': True, 'redirect': url_for('.index_route')})
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    user_cache.forget_session()
+    return redirect(url_for('.login'))
 
-@app.route('/api/chats', methods=['GET'])
+def to_ms(value):
+    return int(value.timestamp() * 1000) if value else 0
+
+def not_modified(etag):
+    # Weak comparison: compressed responses carry a weak version of the ETag
+    if request.if_none_match.contains_weak(etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+    return None
+
+def with_etag(resp, etag):
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+def user_chats():
+    return Chat.query.filter(Chat.user_id == current_user.id, Chat.deleted_at.is_(None))
+
+def chat_summary(chat):
+    return {
+        'id': chat.id,
+        'title': chat.title,
+        'timestamp': to_ms(chat.updated_at)
+    }
+
+@bp.route('/api/chats', methods=['GET'])
 @require_login
 def get_chats():
-    chats = Chat.query.filter_by(user_id=current_user.id).order_by(Chat.updated_at.desc()).all()
-    return jsonify({
-        'chats': [{
-            'id': chat.id,
-            'title': chat.title,
-            'timestamp': int(chat.updated_at.timestamp() * 1000)
-        } for chat in chats]
-    })
+    since_ms = request.args.get('since', type=int)
+    now = datetime.now()
+    
+    # Cheap validator: newest change and number of chats, plus the newest tombstone
+    latest, count = db.session.query(db.func.max(Chat.updated_at), db.func.count(Chat.id)) \
+        .filter(Chat.user_id == current_user.id, Chat.deleted_at.is_(None)).one()
+    deleted = db.session.query(db.func.max(ChatTombstone.deleted_at)) \
+        .filter(ChatTombstone.user_id == current_user.id).scalar()
+    etag = f'chats-{to_ms(latest)}-{count}-{to_ms(deleted)}-{since_ms or 0}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    since = parse_since(since_ms)
+    if since is None or since < now - TOMBSTONE_RETENTION:
+        chats = user_chats().order_by(Chat.updated_at.desc()).all()
+        return with_etag(jsonify({
+            'chats': [chat_summary(chat) for chat in chats],
+            'full': True,
+            'server_time': to_ms(now)
+        }), etag)
+    
+    # Overlap a little so rows committed while the previous delta ran are not missed
+    since -= SYNC_OVERLAP
+    chats = user_chats().filter(Chat.updated_at >= since) \
+        .order_by(Chat.updated_at.desc()).all()
+    tombstones = db.session.query(ChatTombstone.chat_id) \
+        .filter(ChatTombstone.user_id == current_user.id, ChatTombstone.deleted_at >= since).all()
+    live = {chat.id for chat in chats}
+    return with_etag(jsonify({
+        'chats': [chat_summary(chat) for chat in chats],
+        'deleted': [t.chat_id for t in tombstones if t.chat_id not in live],
+        'full': False,
+        'server_time': to_ms(now)
+    }), etag)
 
-@app.route('/api/chats', methods=['POST'])
+@bp.route('/api/chats', methods=['POST'])
 @require_login
 def create_chat():
     data = request.json
-    chat_id = data.get('id', f'chat_{int(db.func.now().op("*")(1000))}')
+    chat_id = data.get('id') or f'chat_{int(time.time() * 1000)}'
     
     chat = Chat(
         id=chat_id,
@@ -169,32 +406,44 @@ def create_chat():
     
     return jsonify({'success': True, 'chat_id': chat.id})
 
-@app.route('/api/chats/<chat_id>', methods=['GET'])
+@bp.route('/api/chats/<chat_id>', methods=['GET'])
 @require_login
 def get_chat(chat_id):
-    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+    chat = user_chats().filter_by(id=chat_id).first()
     if not chat:
         return jsonify({'error': 'Chat not found'}), 404
     
+    if chat.archived_at is not None:
+        last_id, count = archive.chat_stats(chat.id)
+    else:
+        last_id, count = db.session.query(db.func.max(Message.id), db.func.count(Message.id)) \
+            .filter(Message.chat_id == chat.id).one()
+    etag = f'chat-{chat.id}-{to_ms(chat.updated_at)}-{last_id or 0}-{count}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    rows = archive.messages(chat) if chat.archived_at is not None else chat.messages
     messages = [{
         'text': msg.content,
         'role': msg.role,
         'timestamp': int(msg.created_at.timestamp() * 1000),
-        'images': json.loads(msg.images_json) if msg.images_json else []
-    } for msg in chat.messages]
+        'images': json.loads(msg.images_json) if msg.images_json else [],
+        'cancelled': msg.cancelled
+    } for msg in rows]
     
-    return jsonify({
+    return with_etag(jsonify({
         'chat': {
             'id': chat.id,
             'title': chat.title,
             'messages': messages
         }
-    })
+    }), etag)
 
-@app.route('/api/chats/<chat_id>', methods=['PUT'])
+@bp.route('/api/chats/<chat_id>', methods=['PUT'])
 @require_login
 def update_chat(chat_id):
-    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+    chat = user_chats().filter_by(id=chat_id).first()
     if not chat:
         return jsonify({'error': 'Chat not found'}), 404
     
@@ -205,19 +454,53 @@ def update_chat(chat_id):
     
     return jsonify({'success': True})
 
-@app.route('/api/chats/<chat_id>', methods=['DELETE'])
+@bp.route('/api/chats/<chat_id>', methods=['DELETE'])
 @require_login
 def delete_chat(chat_id):
-    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
+    chat = user_chats().filter_by(id=chat_id).first()
     if not chat:
         return jsonify({'error': 'Chat not found'}), 404
     
-    db.session.delete(chat)
-    db.session.commit()
+    return deletion_response(purge.delete_chats(current_user.id, [chat.id]))
+
+@bp.route('/api/chats/bulk-delete', methods=['POST'])
+@require_login
+def bulk_delete_chats():
+    data = request.json or {}
+    chat_ids = data.get('ids')
+    if not isinstance(chat_ids, list) or not chat_ids:
+        return jsonify({'error': 'ids must be a non-empty list'}), 400
     
-    return jsonify({'success': True})
+    return deletion_response(purge.delete_chats(current_user.id, [str(i) for i in chat_ids]))
+
+@bp.route('/api/jobs/<int:job_id>', methods=['GET'])
+@require_login
+def get_job(job_id):
+    job = DeletionJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job_summary(job)})
+
+def job_summary(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'total': job.total,
+        'done': job.done,
+        'created_at': to_ms(job.created_at),
+        'finished_at': to_ms(job.finished_at) or None
+    }
 
-@app.route('/api/user/update', methods=['PUT'])
+def deletion_response(job):
+    ChatTombstone.query.filter(ChatTombstone.user_id == current_user.id,
+                               ChatTombstone.deleted_at < datetime.now() - TOMBSTONE_RETENTION).delete()
+    db.session.commit()
+    if job is None:
+        return jsonify({'success': True})
+    return jsonify({'success': True, 'job': job_summary(job)}), 202
+
+@bp.route('/api/user/update', methods=['PUT'])
 @require_login
 def update_user():
     data = request.json
@@ -227,32 +510,39 @@ def update_user():
         return jsonify({'error': 'Username is required'}), 400
     
     if new_username != current_user.username:
+        # Admin rights follow the name, so nobody may rename into an unclaimed admin name
+        if new_username in ADMIN_USERNAMES:
+            return jsonify({'error': 'Username is reserved'}), 400
         existing = User.query.filter_by(username=new_username).first()
         if existing:
             return jsonify({'error': 'Username already taken'}), 400
     
-    current_user.username = new_username
+    user = User.query.get(current_user.id)
+    user.username = new_username
+    user_cache.invalidate(user.id)
     db.session.commit()
+    user_cache.remember(user)
     
     return jsonify({'success': True})
 
-@app.route('/api/ask', methods=['POST'])
+@bp.route('/api/user', methods=['DELETE'])
 @require_login
-def ask():
-    data = request.json
-    question = data.get('question', '').strip()
-    images = data.get('images', [])
-    chat_id = data.get('chat_id')
-    
-    if not chat_id:
-        return jsonify({'error': 'Chat ID required'}), 400
-    
-    chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
-    if not chat:
-        return jsonify({'error': 'Chat not found'}), 404
+def delete_account():
+    user = User.query.get(current_user.id)
+    user.password_hash = DELETED_PASSWORD_HASH
+    user_cache.invalidate(user.id)
+    job = purge.delete_user(user.id)
+    semantic_cache.forget_user(user.id)
+    logout_user()
+    user_cache.forget_session()
+    return jsonify({'success': True, 'job': job_summary(job)}), 202
+
+def start_turn(chat, question, images):
+    """Add the user's message to chat; returns the history to send before it."""
+    history = context.build_history(chat, summarize=summarize_conversation)
     
     user_message = Message(
-        chat_id=chat_id,
+        chat_id=chat.id,
         role='user',
         content=question or '[Image message]',
         images_json=json.dumps(images) if images else None
@@ -261,19 +551,463 @@ def ask():
     
     if chat.title == 'New Chat' and question:
         chat.title = question[:30] + ('...' if len(question) > 30 else '')
+    chat.updated_at = datetime.now()
+    return history
+
+def save_answer(chat_id, response, stats):
+    assistant_message = Message(
+        chat_id=chat_id,
+        role='assistant',
+        content=response,
+        model=stats.get('model'),
+        prompt_tokens=stats.get('prompt_tokens'),
+        completion_tokens=stats.get('completion_tokens'),
+        latency_ms=stats.get('latency_ms'),
+        ttft_ms=stats.get('ttft_ms'),
+        cache_hit=stats.get('cache_hit', False),
+        cancelled=stats.get('cancelled', False)
+    )
+    db.session.add(assistant_message)
+    return assistant_message
+
+def used_tokens(stats):
+    if stats.get('prompt_tokens') is None:
+        return None
+    return stats['prompt_tokens'] + (stats.get('completion_tokens') or 0)
+
+def ask_params():
+    """((question, images, chat, request_id), None) or (None, error response)."""
+    data = request.json
+    question = data.get('question', '').strip()
+    images = data.get('images', [])
+    chat_id = data.get('chat_id')
+    request_id = data.get('request_id')
     
-    response, error = try_run_openrouter(question, images=images)
+    if not chat_id:
+        return None, (jsonify({'error': 'Chat ID required'}), 400)
+    if request_id is not None and not cancellation.valid_request_id(request_id):
+        return None, (jsonify({'error': 'Invalid request ID'}), 400)
     
+    chat = user_chats().filter_by(id=chat_id).first()
+    if not chat:
+        return None, (jsonify({'error': 'Chat not found'}), 404)
+    if chat.archived_at is not None:
+        # Continuing an old conversation: bring its history back for context building.
+        # Commit at once so the chat row is not kept locked through the upstream call.
+        archive.restore(chat)
+        db.session.commit()
+    return (question, images, chat, request_id), None
+
+def duplicate_request():
+    return jsonify({'error': 'Request ID already in use'}), 409
+
+def ask_outcome(stats, error):
+    if stats.get('cancelled'):
+        return 'cancelled'
+    return 'error' if error else 'ok'
+
+def standalone_question(chat, images):
+    # Follow-ups depend on the conversation, so only a chat's first text question is cached
+    return not images and db.session.query(Message.id).filter(Message.chat_id == chat.id).first() is None
+
+def flagged_wrong(hit):
+    """Whether a user said this entry's answer was wrong since it was stored (on any worker)."""
+    query = CacheHit.query.filter(CacheHit.matched_question == hit.question,
+                                  CacheHit.model == OPENROUTER_MODEL,
+                                  CacheHit.correct.is_(False),
+                                  CacheHit.created_at >= datetime.fromtimestamp(hit.stored_at))
+    if semantic_cache.SEMANTIC_CACHE_SCOPE != 'global':
+        query = query.filter(CacheHit.user_id == current_user.id)
+    return db.session.query(query.exists()).scalar()
+
+def answer_from_cache(chat, question, hit, started):
+    start_turn(chat, question, None)
+    stats = {'model': OPENROUTER_MODEL, 'cache_hit': True}
+    message = save_answer(chat.id, hit.answer, stats)
+    db.session.flush()
+    record = CacheHit(user_id=current_user.id, message_id=message.id, model=OPENROUTER_MODEL, question=question,
+                      matched_question=hit.question, similarity=hit.similarity)
+    db.session.add(record)
+    db.session.commit()
+    log_ask(started, chat.id, question, None, stats, hit.answer, 'cached')
+    return jsonify({'response': hit.answer, 'cancelled': False,
+                    'cache': {'id': record.id, 'similarity': round(hit.similarity, 3)}})
+
+def log_ask(started, chat_id, question, images, stats, response, outcome):
+    if request_log.enabled():
+        request_log.record(request_log.ask_entry(request.path, started, current_user.id, chat_id, question,
+                                                 images, stats, response, outcome))
+
+@bp.route('/api/ask', methods=['POST'])
+@require_login
+def ask():
+    started = time.time()
+    params, error = ask_params()
+    if error:
+        return error
+    question, images, chat, request_id = params
+    chat_id = chat.id
+    
+    stats = {}
+    cacheable = semantic_cache.enabled() and standalone_question(chat, images)
+    if cacheable and not request.json.get('no_cache'):
+        hit = semantic_cache.lookup(question, OPENROUTER_MODEL, current_user.id, rejected=flagged_wrong)
+        if hit is not None:
+            return answer_from_cache(chat, question, hit, started)
+    
+    try:
+        with admission.upstream_slot(current_user.id, tokens=admission.estimate_tokens(question, 2000)) as ticket, \
+                cancellation.track(current_user.id, request_id) as generation:
+            history = start_turn(chat, question, images)
+            # Commit now so the chat row (and any summary folded into it) is not locked during the call
+            db.session.commit()
+            # Only requests with an ID can be cancelled, so only those need streaming upstream
+            response, error = try_run_openrouter(question, images=images, stats=stats, history=history,
+                                                 generation=generation if request_id else None)
+            ticket['used_tokens'] = used_tokens(stats)
+    except admission.AdmissionRejected as e:
+        log_ask(started, chat_id, question, images, stats, None, 'rejected')
+        return too_many_requests(e)
+    except cancellation.DuplicateRequest:
+        return duplicate_request()
+    
+    log_ask(started, chat_id, question, images, stats, response, ask_outcome(stats, error))
     if error:
         db.session.commit()
         return jsonify({'error': error}), 400
     
-    assistant_message = Message(
-        chat_id=chat_id,
-        role='assistant',
-        content=response
-    )
-    db.session.add(assistant_message)
+    if response:
+        save_answer(chat_id, response, stats)
+    db.session.commit()
+    if response and cacheable and not stats.get('cancelled'):
+        semantic_cache.store(question, OPENROUTER_MODEL, current_user.id, response)
+    
+    return jsonify({'response': response, 'cancelled': stats.get('cancelled', False)})
+
+@bp.route('/api/ask/cache-feedback', methods=['POST'])
+@require_login
+def cache_feedback():
+    """Body: {"id": <cache id from /api/ask>, "correct": false}.
+
+    Marking an answer wrong also removes the cached turn from its chat, so the
+    question can be asked again (with "no_cache": true) without it in the history.
+    """
+    data = request.json or {}
+    record = CacheHit.query.filter_by(id=data.get('id'), user_id=current_user.id).first()
+    if not record:
+        return jsonify({'error': 'Cache hit not found'}), 404
+    
+    record.correct = bool(data.get('correct'))
+    semantic_cache.FEEDBACK.inc(verdict='correct' if record.correct else 'wrong')
+    removed = False
+    answer = db.session.get(Message, record.message_id) if record.message_id else None
+    if not record.correct:
+        # Stop serving it here at once; other workers check cache_hits before serving
+        semantic_cache.forget(record.matched_question, record.model, current_user.id)
+    if not record.correct and answer is not None and answer.chat.user_id == current_user.id:
+        asked = Message.query.filter(Message.chat_id == answer.chat_id, Message.role == 'user',
+                                     Message.id < answer.id).order_by(Message.id.desc()).first()
+        for message in (asked, answer):
+            if message is not None:
+                db.session.delete(message)
+        record.message_id = None
+        removed = True
+    db.session.commit()
+    return jsonify({'success': True, 'removed': removed})
+
+def ndjson_line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+@bp.route('/api/ask/stream', methods=['POST'])
+@require_login
+def ask_stream():
+    """Like /api/ask, but streams the answer as NDJSON events.
+
+    The first line carries the request ID, followed by {"delta": ...} lines and a
+    final {"done": true, ...} or {"error": ...}. If the client disconnects, the
+    generation is cancelled and the partial answer is saved.
+    """
+    started = time.time()
+    params, error = ask_params()
+    if error:
+        return error
+    question, images, chat, request_id = params
+    chat_id = chat.id
+    
+    stack = ExitStack()
+    try:
+        ticket = stack.enter_context(
+            admission.upstream_slot(current_user.id, tokens=admission.estimate_tokens(question, 2000)))
+        generation = stack.enter_context(cancellation.track(current_user.id, request_id))
+        history = start_turn(chat, question, images)
+        # Commit now so the write lock is not held while the answer streams
+        db.session.commit()
+    except admission.AdmissionRejected as e:
+        stack.close()
+        log_ask(started, chat_id, question, images, {}, None, 'rejected')
+        return too_many_requests(e)
+    except cancellation.DuplicateRequest:
+        stack.close()
+        return duplicate_request()
+    except Exception:
+        stack.close()
+        raise
+    
+    def generate():
+        stats = {}
+        parts = []
+        result = None
+        upstream = stream_openrouter(question, images=images, stats=stats, history=history,
+                                     generation=generation)
+        try:
+            yield ndjson_line({'request_id': generation.request_id})
+            while True:
+                try:
+                    delta = next(upstream)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                parts.append(delta)
+                yield ndjson_line({'delta': delta})
+        except GeneratorExit:
+            # The client went away; stop the upstream call and keep what arrived
+            generation.cancel('disconnect')
+            raise
+        finally:
+            upstream.close()
+            response, error = result or (''.join(parts).strip() or None, None)
+            if generation.cancelled:
+                stats['cancelled'] = True
+            try:
+                if response and not error:
+                    save_answer(chat_id, response, stats)
+                    db.session.commit()
+                ticket['used_tokens'] = used_tokens(stats)
+            finally:
+                stack.close()
+                log_ask(started, chat_id, question, images, stats, response, ask_outcome(stats, error))
+        
+        if error:
+            yield ndjson_line({'error': error})
+        else:
+            yield ndjson_line({'done': True, 'response': response, 'cancelled': stats.get('cancelled', False)})
+    
+    resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    resp.headers['X-Accel-Buffering'] = 'no'
+    # Releases the slot even if the body is never iterated
+    resp.call_on_close(stack.close)
+    return resp
+
+@bp.route('/api/ask/batch', methods=['POST'])
+@require_login
+def ask_batch():
+    """Answer many questions concurrently, streaming NDJSON results as each completes.
+
+    Body: {"items": [question or {"question", "chat_id", "model", "images"}],
+    "chat_id", "model", "parallelism", "request_id"}. The first line carries the
+    request ID (cancel with /api/ask/<request_id>/cancel), then one line per
+    item in completion order and a final {"done": true, ...} summary.
+    """
+    data = request.json or {}
+    try:
+        items = batch.parse_items(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    request_id = data.get('request_id')
+    if request_id is not None and not cancellation.valid_request_id(request_id):
+        return jsonify({'error': 'Invalid request ID'}), 400
+    
+    models = {item.model for item in items if item.model}
+    if models - OPENROUTER_MODELS:
+        return jsonify({'error': f"Model not allowed: {', '.join(sorted(models - OPENROUTER_MODELS))}"}), 400
+    
+    chat_ids = {item.chat_id for item in items}
+    chats = {chat.id: chat for chat in user_chats().filter(Chat.id.in_(chat_ids))}
+    missing = chat_ids - chats.keys()
+    if missing:
+        return jsonify({'error': f"Chat not found: {', '.join(sorted(missing))}"}), 404
+    
+    user_id = current_user.id
+    stack = ExitStack()
+    try:
+        # The whole batch is one admission: its calls then only wait for upstream slots
+        budget = stack.enter_context(admission.budget(user_id, sum(batch.estimated_tokens(i) for i in items)))
+    except admission.AdmissionRejected as e:
+        return too_many_requests(e)
+    
+    archived = [chat for chat in chats.values() if chat.archived_at is not None]
+    for chat in archived:
+        archive.restore(chat)
+    if archived:
+        db.session.commit()
+    
+    # Every question sees its chat as it was before the batch
+    histories = {chat_id: context.build_history(chat, summarize=summarize_conversation)
+                 for chat_id, chat in chats.items()}
+    for item in items:
+        item.history = histories[item.chat_id]
     db.session.commit()
     
-    return jsonify({'response': response})
+    parallelism = batch.parallelism_for(data.get('parallelism'))
+    try:
+        generation = stack.enter_context(cancellation.track(user_id, request_id))
+    except cancellation.DuplicateRequest:
+        budget['used_tokens'] = 0
+        stack.close()
+        return duplicate_request()
+    
+    def call(item):
+        return try_run_openrouter(item.question, images=item.images, stats=item.stats,
+                                  history=item.history, model=item.model)
+    
+    def generate():
+        runner = batch.run(user_id, items, call, parallelism, generation)
+        failed = saved = 0
+        try:
+            yield ndjson_line({'request_id': generation.request_id, 'items': len(items),
+                               'parallelism': parallelism})
+            for item in runner:
+                failed += bool(item.error)
+                yield ndjson_line(item.result())
+        except GeneratorExit:
+            generation.cancel('disconnect')
+            raise
+        finally:
+            try:
+                runner.close()
+                budget['used_tokens'] = batch.used_tokens(items)
+                saved = batch.save(chats, items)
+            finally:
+                stack.close()
+        yield ndjson_line({'done': True, 'completed': len(items) - failed, 'failed': failed,
+                           'saved_messages': saved})
+    
+    resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.call_on_close(stack.close)
+    return resp
+
+@bp.route('/api/ask/<request_id>/cancel', methods=['POST'])
+@require_login
+def cancel_ask(request_id):
+    if not cancellation.valid_request_id(request_id):
+        return jsonify({'error': 'Invalid request ID'}), 400
+    local = cancellation.cancel(current_user.id, request_id)
+    return jsonify({'success': True, 'forwarded': not local}), 202
+
+def usage_report(group_by, user_id=None, since=None):
+    if group_by == 'user':
+        key = Chat.user_id
+    else:
+        key = db.func.coalesce(Message.model, 'unknown')
+    
+    query = db.session.query(
+        key.label('key'),
+        db.func.count(Message.id).label('messages'),
+        db.func.coalesce(db.func.sum(Message.prompt_tokens), 0).label('prompt_tokens'),
+        db.func.coalesce(db.func.sum(Message.completion_tokens), 0).label('completion_tokens'),
+        db.func.avg(Message.latency_ms).label('avg_latency_ms'),
+        db.func.max(Message.latency_ms).label('max_latency_ms'),
+        db.func.avg(Message.ttft_ms).label('avg_ttft_ms'),
+        db.func.sum(db.case((Message.cache_hit.is_(True), 1), else_=0)).label('cache_hits')
+    ).join(Chat, Chat.id == Message.chat_id).filter(Message.role == 'assistant')
+    
+    if user_id:
+        query = query.filter(Chat.user_id == user_id)
+    if since:
+        query = query.filter(Message.created_at >= since)
+    
+    rows = query.group_by(key).order_by(db.desc('completion_tokens')).all()
+    return [{
+        group_by: row.key,
+        'messages': row.messages,
+        'prompt_tokens': int(row.prompt_tokens),
+        'completion_tokens': int(row.completion_tokens),
+        'avg_latency_ms': round(float(row.avg_latency_ms), 1) if row.avg_latency_ms is not None else None,
+        'max_latency_ms': row.max_latency_ms,
+        'avg_ttft_ms': round(float(row.avg_ttft_ms), 1) if row.avg_ttft_ms is not None else None,
+        'cache_hits': int(row.cache_hits or 0)
+    } for row in rows]
+
+def parse_since(value):
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(int(value) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+@bp.route('/api/usage', methods=['GET'])
+@require_login
+def get_usage():
+    since = parse_since(request.args.get('since'))
+    return jsonify({'models': usage_report('model', user_id=current_user.id, since=since)})
+
+@bp.route('/api/admin/usage', methods=['GET'])
+@require_admin
+def get_usage_report():
+    group_by = request.args.get('group_by', 'model')
+    if group_by not in ('model', 'user'):
+        return jsonify({'error': "group_by must be 'model' or 'user'"}), 400
+    since = parse_since(request.args.get('since'))
+    return jsonify({'group_by': group_by, 'rows': usage_report(group_by, since=since)})
+
+@bp.route('/api/admin/cache-feedback', methods=['GET'])
+@require_admin
+def get_cache_feedback():
+    query = db.session.query(CacheHit.similarity, CacheHit.correct)
+    since = parse_since(request.args.get('since'))
+    if since is not None:
+        query = query.filter(CacheHit.created_at >= since)
+    if request.args.get('model'):
+        query = query.filter(CacheHit.model == request.args['model'])
+    return jsonify({'threshold': semantic_cache.SEMANTIC_CACHE_THRESHOLD,
+                    'buckets': semantic_cache.precision_report(query.all())})
+
+@bp.route('/api/admin/profiles', methods=['GET'])
+@require_admin
+def list_profiles():
+    return jsonify({'profiles': profiling.list_profiles()})
+
+@bp.route('/api/admin/profiles/<name>', methods=['GET'])
+@require_admin
+def download_profile(name):
+    if not profiling.is_profile_name(name):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), name, as_attachment=True)
+
+@bp.route('/api/search', methods=['GET'])
+@require_login
+def search_chats():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query required'}), 400
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    results, has_more = search.search_messages(db, current_user.id, query,
+                                               limit=per_page, offset=(page - 1) * per_page)
+    return jsonify({'results': results, 'page': page, 'per_page': per_page, 'has_more': has_more})
+
+@bp.route('/api/export', methods=['GET'])
+@require_login
+def export_chats():
+    include_blobs = request.args.get('blobs', '1') != '0'
+    filename = f"chats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    return Response(
+        stream_with_context(transfer.export_user(current_user.id, include_blobs=include_blobs)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@bp.route('/api/import', methods=['POST'])
+@require_login
+def import_chats():
+    if request.content_length is not None and request.content_length > transfer.IMPORT_MAX_BYTES:
+        return jsonify({'error': f'Import files are limited to {transfer.IMPORT_MAX_BYTES} bytes'}), 413
+    try:
+        counts = transfer.import_user(current_user.id, request.stream)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': f'Invalid import file: {e}'}), 400
+    return jsonify({'success': True, 'imported': counts})
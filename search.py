@@ -0,0 +1,288 @@
+"""
+Full-text search over a user's messages.
+
+On PostgreSQL each message carries a stored, generated content_tsv
+column (to_tsvector of its content) with a GIN index, so matching and
+ranking both read the stored vector instead of re-parsing content; on
+SQLite with an FTS5 table kept in sync by triggers. Either way the index
+is maintained by the database on every insert, update and delete, so
+there is no rebuild job. Other databases fall back to a LIKE scan.
+
+Messages moved into archive segments stay searchable: archive.py calls
+index_archived() before deleting them, which records each one in
+archived_message_search (plus its tsvector on PostgreSQL) and keeps its
+FTS5 row on SQLite. Snippets for archived hits on PostgreSQL are cut from
+the decoded segment, since the text is no longer in messages.
+"""
+import html
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+import metrics
+
+SEARCH_LANGUAGE = 'english'
+SNIPPET_WORDS = 16
+# Ranking cost grows with the number of hits; broader queries are ordered by recency
+SEARCH_RANK_MAX = int(os.environ.get('SEARCH_RANK_MAX', '2000'))
+_START, _STOP = '\x02', '\x03'
+
+POSTGRES_DDL = [
+    f"ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_LANGUAGE}', content)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING GIN (content_tsv)",
+    # Superseded by the column index above
+    "DROP INDEX IF EXISTS ix_messages_content_fts",
+    "ALTER TABLE archived_message_search ADD COLUMN IF NOT EXISTS content_tsv tsvector",
+    "CREATE INDEX IF NOT EXISTS ix_archived_message_search_tsv ON archived_message_search USING GIN (content_tsv)",
+]
+
+POSTGRES_MATCH = f"m.content_tsv @@ plainto_tsquery('{SEARCH_LANGUAGE}', :q)"
+POSTGRES_ARCHIVED_MATCH = f"a.content_tsv @@ plainto_tsquery('{SEARCH_LANGUAGE}', :q)"
+
+POSTGRES_COUNT = text(f"""
+    SELECT count(*) FROM (
+        SELECT 1 FROM messages m
+        JOIN chats c ON c.id = m.chat_id
+        WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND {POSTGRES_MATCH}
+        UNION ALL
+        SELECT 1 FROM archived_message_search a
+        JOIN chats c ON c.id = a.chat_id
+        WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND {POSTGRES_ARCHIVED_MATCH}
+        LIMIT :cap
+    ) hits
+""")
+
+# Ranks and pages in the inner query; ts_headline re-parses the whole
+# message, so it only runs on the page of rows being returned.
+POSTGRES_QUERY = f"""
+    SELECT r.id, r.chat_id, r.role, r.created_at, r.title, r.rank, r.archived,
+           ts_headline('{SEARCH_LANGUAGE}', m.content, plainto_tsquery('{SEARCH_LANGUAGE}', :q),
+                       :headline_opts) AS snippet
+    FROM (
+        SELECT m.id, m.chat_id, m.role, m.created_at, c.title,
+               ts_rank(m.content_tsv, plainto_tsquery('{SEARCH_LANGUAGE}', :q)) AS rank, false AS archived
+        FROM messages m
+        JOIN chats c ON c.id = m.chat_id
+        WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND {POSTGRES_MATCH}
+        UNION ALL
+        SELECT a.message_id, a.chat_id, a.role, a.created_at, c.title,
+               ts_rank(a.content_tsv, plainto_tsquery('{SEARCH_LANGUAGE}', :q)), true
+        FROM archived_message_search a
+        JOIN chats c ON c.id = a.chat_id
+        WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND {POSTGRES_ARCHIVED_MATCH}
+        ORDER BY {{order}}
+        LIMIT :limit OFFSET :offset
+    ) r
+    LEFT JOIN messages m ON m.id = r.id
+    ORDER BY {{order_outer}}
+"""
+
+POSTGRES_INDEX_ARCHIVED = text(f"""
+    INSERT INTO archived_message_search (message_id, chat_id, role, created_at, content_tsv)
+    VALUES (:id, :chat_id, :role, :created_at, to_tsvector('{SEARCH_LANGUAGE}', :content))
+""")
+
+# The FTS table carries an encoded user key so a user's matches are found
+# inside the index without joining every hit to messages and chats.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, user_key, chat_id UNINDEXED, tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content, user_key, chat_id) "
+    "SELECT new.id, new.content, 'u' || hex(c.user_id), new.chat_id FROM chats c WHERE c.id = new.chat_id; END",
+    # Archiving deletes messages but keeps their FTS rows; they go with the archived_message_search row
+    "DROP TRIGGER IF EXISTS messages_fts_ad",
+    "CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages "
+    "WHEN NOT EXISTS (SELECT 1 FROM archived_message_search WHERE message_id = old.id) BEGIN "
+    "DELETE FROM messages_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS archived_message_search_ad AFTER DELETE ON archived_message_search BEGIN "
+    "DELETE FROM messages_fts WHERE rowid = old.message_id; END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+    "UPDATE messages_fts SET content = new.content WHERE rowid = new.id; END",
+]
+
+SQLITE_BACKFILL = """
+    INSERT INTO messages_fts(rowid, content, user_key, chat_id)
+    SELECT m.id, m.content, 'u' || hex(c.user_id), m.chat_id
+    FROM messages m JOIN chats c ON c.id = m.chat_id
+"""
+
+SQLITE_INDEX_ARCHIVED = [
+    text("INSERT INTO archived_message_search (message_id, chat_id, role, created_at) "
+         "VALUES (:id, :chat_id, :role, :created_at)"),
+    # Normally rewrites the row the delete trigger kept; recreates it for chats archived before this index
+    text("INSERT OR REPLACE INTO messages_fts(rowid, content, user_key, chat_id) "
+         "SELECT :id, :content, 'u' || hex(c.user_id), c.id FROM chats c WHERE c.id = :chat_id"),
+]
+
+UNINDEX_ARCHIVED = text("DELETE FROM archived_message_search WHERE chat_id = :chat_id")
+
+SQLITE_COUNT = text("SELECT count(*) FROM (SELECT 1 FROM messages_fts WHERE messages_fts MATCH :q LIMIT :cap)")
+
+SQLITE_QUERY = """
+    SELECT f.rowid AS id, f.chat_id, coalesce(m.role, a.role) AS role,
+           coalesce(m.created_at, a.created_at) AS created_at, c.title, -f.rank AS rank,
+           snippet(messages_fts, 0, :start, :stop, '...', :words) AS snippet
+    FROM messages_fts f
+    LEFT JOIN messages m ON m.id = f.rowid
+    LEFT JOIN archived_message_search a ON a.message_id = f.rowid
+    JOIN chats c ON c.id = f.chat_id
+    WHERE messages_fts MATCH :q AND c.deleted_at IS NULL
+    ORDER BY {order}
+    LIMIT :limit OFFSET :offset
+"""
+
+LIKE_QUERY = text("""
+    SELECT m.id, m.chat_id, m.role, m.created_at, c.title, 0 AS rank, m.content AS snippet
+    FROM messages m
+    JOIN chats c ON c.id = m.chat_id
+    WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND m.content LIKE :q
+    ORDER BY m.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def dialect(db):
+    return db.engine.dialect.name
+
+
+def setup(db):
+    """Create the full-text index for the current database (idempotent)."""
+    name = dialect(db)
+    with db.engine.begin() as conn:
+        if name == 'postgresql':
+            for stmt in POSTGRES_DDL:
+                conn.execute(text(stmt))
+        elif name == 'sqlite':
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")).first()
+            for stmt in SQLITE_DDL:
+                conn.execute(text(stmt))
+            if not exists:
+                # Index rows written before the FTS table existed
+                conn.execute(text(SQLITE_BACKFILL))
+        else:
+            logging.warning('Full-text search not supported on %s; falling back to LIKE', name)
+
+
+def index_archived(db, chat_id, rows):
+    """Keep rows, messages of chat_id about to move into a segment, searchable (caller commits).
+
+    Call before deleting them from messages.
+    """
+    name = dialect(db)
+    if not rows or name not in ('postgresql', 'sqlite'):
+        return
+    params = [{'id': row.id, 'chat_id': chat_id, 'role': row.role, 'created_at': row.created_at,
+               'content': row.content} for row in rows]
+    statements = [POSTGRES_INDEX_ARCHIVED] if name == 'postgresql' else SQLITE_INDEX_ARCHIVED
+    for statement in statements:
+        db.session.execute(statement, params)
+
+
+def unindex_archived(db, chat_id):
+    """Drop chat_id's archived entries before its messages are restored (caller commits)."""
+    if dialect(db) in ('postgresql', 'sqlite'):
+        db.session.execute(UNINDEX_ARCHIVED, {'chat_id': chat_id})
+
+
+def user_key(user_id):
+    # Same encoding as 'u' || hex(user_id) in the triggers
+    return 'u' + str(user_id).encode('utf-8').hex()
+
+
+def fts5_query(user_id, query):
+    tokens = re.findall(r'\w+', query, re.UNICODE)
+    if not tokens:
+        return None
+    terms = ' AND '.join(f'content:"{t}"' for t in tokens)
+    return f'user_key:"{user_key(user_id)}" AND {terms}'
+
+
+def _rank_by_relevance(db, count_query, params):
+    hits = db.session.execute(count_query, dict(params, cap=SEARCH_RANK_MAX + 1)).scalar()
+    return hits <= SEARCH_RANK_MAX
+
+
+def _like_snippet(content, query):
+    words = re.findall(r'\w+', query.lower())
+    lowered = content.lower()
+    pos = min((lowered.find(w) for w in words if w in lowered), default=0)
+    start = max(0, pos - 60)
+    end = min(len(content), pos + 120)
+    return ('...' if start else '') + content[start:end] + ('...' if end < len(content) else '')
+
+
+def _archived_snippets(db, rows, query):
+    """Fill in snippets for archived hits from their segments."""
+    import archive
+    from models import Chat
+
+    chat_ids = {row.chat_id for row in rows if row.archived}
+    if not chat_ids:
+        return rows
+    contents = {}
+    for chat in db.session.query(Chat).filter(Chat.id.in_(chat_ids), Chat.archived_at.isnot(None)):
+        contents.update((msg.id, msg.content) for msg in archive.archived_messages(chat))
+    return [row._replace(snippet=_like_snippet(contents.get(row.id, ''), query)) if row.archived else row
+            for row in rows]
+
+
+def _render_snippet(snippet):
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def search_messages(db, user_id, query, limit=20, offset=0):
+    """Ranked matches for user_id; fetches limit + 1 rows so callers can page."""
+    name = dialect(db)
+    with metrics.RETRIEVAL_LATENCY.time(mode=f'search_{name}'):
+        return _search_messages(db, name, user_id, query, limit, offset)
+
+
+def _search_messages(db, name, user_id, query, limit, offset):
+    params = {'user_id': user_id, 'limit': limit + 1, 'offset': offset}
+    if name == 'postgresql':
+        params['q'] = query
+        if _rank_by_relevance(db, POSTGRES_COUNT, params):
+            order, order_outer = 'rank DESC, id DESC', 'r.rank DESC, r.id DESC'
+        else:
+            order, order_outer = 'id DESC', 'r.id DESC'
+        params['headline_opts'] = (f'StartSel={_START}, StopSel={_STOP}, '
+                                   f'MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}')
+        sql = POSTGRES_QUERY.format(order=order, order_outer=order_outer)
+        rows = _archived_snippets(db, db.session.execute(text(sql), params).all(), query)
+    elif name == 'sqlite':
+        match = fts5_query(user_id, query)
+        if not match:
+            return [], False
+        params['q'] = match
+        order = 'f.rank' if _rank_by_relevance(db, SQLITE_COUNT, params) else 'f.rowid DESC'
+        params.update(start=_START, stop=_STOP, words=SNIPPET_WORDS)
+        rows = db.session.execute(text(SQLITE_QUERY.format(order=order)), params).all()
+    else:
+        params.update(q=f'%{query}%')
+        rows = [r._replace(snippet=_like_snippet(r.snippet, query))
+                for r in db.session.execute(LIKE_QUERY, params).all()]
+
+    results = [{
+        'message_id': row.id,
+        'chat_id': row.chat_id,
+        'chat_title': row.title,
+        'role': row.role,
+        'snippet': _render_snippet(row.snippet),
+        'rank': float(row.rank or 0),
+        'timestamp': _timestamp_ms(row.created_at),
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
+
+
+def _timestamp_ms(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
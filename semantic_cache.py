@@ -0,0 +1,297 @@
+"""
+Near-duplicate answer cache for standalone questions.
+
+Questions are normalized to the set of their content words (lower-cased,
+stop words and question filler removed, plurals folded), so word order
+does not matter: "How do Python decorators work?" and "explain decorators
+in python" both become {python, decorator}. Order only matters around
+direction words, which change the meaning: "to", "into", "onto" and "than"
+add a "before > after" feature for the content words around them, and
+"from" the same with the two swapped. "convert a list to a dict" gets
+{convert, list, dict, list > dict} and "convert a dict to a list" gets
+dict > list instead. Questions with a feature reversed never match, however
+many words they share, while "convert to a dict from a list" still matches
+the first. Each set gets a MinHash signature; signatures live in one flat
+array and are split into LSH bands, so a lookup only compares against
+entries sharing at least one band. Candidates are scored by the exact
+Jaccard similarity of the sets and the best one at or above
+SEMANTIC_CACHE_THRESHOLD is served.
+
+Entries are scoped by model and, unless SEMANTIC_CACHE_SCOPE=global, by user.
+The cache is per worker process, holds SEMANTIC_CACHE_SIZE entries in a ring
+(oldest replaced first) and expires them after SEMANTIC_CACHE_TTL seconds.
+
+Every served answer is recorded in cache_hits with its similarity; users
+flag the ones that did not fit their question through
+POST /api/ask/cache-feedback, and /api/admin/cache-feedback reports
+precision per similarity so the threshold can be tuned. A flagged entry is
+evicted by the worker that takes the feedback, and other workers drop it the
+next time it would be served (see `rejected` in lookup()).
+"""
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from array import array
+
+import metrics
+
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', '10000'))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.75'))
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', '86400'))
+SEMANTIC_CACHE_SCOPE = os.environ.get('SEMANTIC_CACHE_SCOPE', 'user')
+SEMANTIC_CACHE_MIN_WORDS = int(os.environ.get('SEMANTIC_CACHE_MIN_WORDS', '2'))
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = 4294967311  # smallest prime above 2**32
+
+STOP_WORDS = frozenset('''
+a about all am an and any are as at be been but by can could did do does doing explain for from give
+have having he help her him his how i if in into is it its me mean means my of on or our please she
+show so some tell than that the their them then there these they this those to us use using was we
+were what whats when where which who why will with work works would you your
+'''.split())
+
+# Words that make "a <word> b" mean something different from "b <word> a"
+FORWARD_WORDS = frozenset(('to', 'into', 'onto', 'than'))
+BACKWARD_WORDS = frozenset(('from',))
+
+SIMILARITY = metrics.histogram('semantic_cache_hit_similarity', 'Similarity of served near-duplicate answers',
+                               buckets=(0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0))
+FEEDBACK = metrics.counter('semantic_cache_feedback_total', 'Feedback on served cached answers', ('verdict',))
+
+_rng = random.Random(0x5eed)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def enabled():
+    return SEMANTIC_CACHE_SIZE > 0
+
+
+def _stem(word):
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'xes', 'ches', 'shes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def _words(question):
+    return re.findall(r"[a-z0-9+#]+", question.lower().replace("'", ''))
+
+
+def normalize(question):
+    """Content words of a question plus its direction features, as a frozenset."""
+    features = set()
+    previous = direction = None
+    for word in _words(question):
+        if word in FORWARD_WORDS or word in BACKWARD_WORDS:
+            direction = word
+        elif word not in STOP_WORDS:
+            word = _stem(word)
+            if direction is not None and previous is not None and previous != word:
+                pair = (previous, word) if direction in FORWARD_WORDS else (word, previous)
+                features.add(f'{pair[0]} > {pair[1]}')
+            features.add(word)
+            previous, direction = word, None
+    return frozenset(features)
+
+
+def signature(words):
+    hashes = [zlib.crc32(w.encode('utf-8')) for w in words]
+    return [min((a * h + b) % _PRIME for h in hashes) & 0xffffffff for a, b in _PERMUTATIONS]
+
+
+def _reversed(a, b):
+    """Whether b has some direction feature of a the other way round."""
+    for feature in a:
+        before, arrow, after = feature.partition(' > ')
+        if arrow and f'{after} > {before}' in b:
+            return True
+    return False
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class Hit:
+    def __init__(self, answer, question, similarity, stored_at):
+        self.answer = answer
+        self.question = question
+        self.similarity = similarity
+        self.stored_at = stored_at
+
+
+def _enough_words(words):
+    return sum(' ' not in w for w in words) >= SEMANTIC_CACHE_MIN_WORDS
+
+
+class SemanticCache:
+    """Fixed-capacity MinHash/LSH index over normalized questions."""
+
+    def __init__(self, capacity=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.signatures = array('I', bytes(4 * NUM_PERM * capacity))
+        self.expires = array('d', bytes(8 * capacity))
+        self.words = [None] * capacity
+        self.scopes = [None] * capacity
+        self.owners = [None] * capacity
+        self.questions = [None] * capacity
+        self.answers = [None] * capacity
+        self.bands = [{} for _ in range(BANDS)]
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def _band_keys(self, scope, sig):
+        return [(scope,) + tuple(sig[b * ROWS:(b + 1) * ROWS]) for b in range(BANDS)]
+
+    def lookup(self, question, scope, now=None):
+        words = normalize(question)
+        if not _enough_words(words):
+            return None
+        sig = signature(words)
+        now = time.time() if now is None else now
+        best, best_score = None, self.threshold
+        with self.lock:
+            seen = set()
+            for band, key in zip(self.bands, self._band_keys(scope, sig)):
+                for slot in band.get(key, ()):
+                    if slot in seen:
+                        continue
+                    seen.add(slot)
+                    if self.expires[slot] < now:
+                        continue
+                    if _reversed(words, self.words[slot]):
+                        continue
+                    score = jaccard(words, self.words[slot])
+                    if score >= best_score:
+                        best, best_score = slot, score
+            if best is None:
+                return None
+            return Hit(self.answers[best], self.questions[best], best_score, self.expires[best] - self.ttl)
+
+    def store(self, question, scope, answer, owner=None, now=None):
+        words = normalize(question)
+        if not _enough_words(words):
+            return False
+        sig = signature(words)
+        now = time.time() if now is None else now
+        with self.lock:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % self.capacity
+            self._evict(slot)
+            self.signatures[slot * NUM_PERM:(slot + 1) * NUM_PERM] = array('I', sig)
+            self.expires[slot] = now + self.ttl
+            self.words[slot] = words
+            self.scopes[slot] = scope
+            self.owners[slot] = owner
+            self.questions[slot] = question
+            self.answers[slot] = answer
+            for band, key in zip(self.bands, self._band_keys(scope, sig)):
+                band.setdefault(key, []).append(slot)
+        return True
+
+    def _evict(self, slot):
+        if self.words[slot] is None:
+            return
+        sig = self.signatures[slot * NUM_PERM:(slot + 1) * NUM_PERM]
+        for band, key in zip(self.bands, self._band_keys(self.scopes[slot], sig)):
+            slots = band.get(key)
+            if slots is not None:
+                slots.remove(slot)
+                if not slots:
+                    del band[key]
+        self.words[slot] = self.scopes[slot] = self.owners[slot] = None
+        self.questions[slot] = self.answers[slot] = None
+        self.expires[slot] = 0.0
+
+    def forget(self, question, scope):
+        """Drop the entries stored for exactly this question in scope."""
+        words = normalize(question)
+        if not _enough_words(words):
+            return
+        with self.lock:
+            slots = {slot for band, key in zip(self.bands, self._band_keys(scope, signature(words)))
+                     for slot in band.get(key, ())}
+            for slot in slots:
+                if self.questions[slot] == question and self.scopes[slot] == scope:
+                    self._evict(slot)
+
+    def forget_owner(self, owner):
+        """Drop every entry created from owner's questions."""
+        with self.lock:
+            for slot in range(self.capacity):
+                if self.owners[slot] == owner:
+                    self._evict(slot)
+
+    def __len__(self):
+        return sum(w is not None for w in self.words)
+
+
+_cache = SemanticCache() if enabled() else None
+
+
+def scope_for(model, user_id):
+    return (model, None if SEMANTIC_CACHE_SCOPE == 'global' else user_id)
+
+
+def lookup(question, model, user_id, rejected=None):
+    """Cached Hit for a near-duplicate of question, or None.
+
+    rejected(hit) can veto a hit, e.g. one flagged as wrong on another
+    worker; the entry is then evicted here too.
+    """
+    scope = scope_for(model, user_id)
+    hit = _cache.lookup(question, scope)
+    if hit is not None and rejected is not None and rejected(hit):
+        _cache.forget(hit.question, scope)
+        hit = None
+    metrics.record_cache('semantic_answer', hit is not None)
+    if hit is not None:
+        SIMILARITY.observe(hit.similarity)
+    return hit
+
+
+def store(question, model, user_id, answer):
+    _cache.store(question, scope_for(model, user_id), answer, owner=user_id)
+
+
+def forget(question, model, user_id):
+    if _cache is not None:
+        _cache.forget(question, scope_for(model, user_id))
+
+
+def forget_user(user_id):
+    if _cache is not None:
+        _cache.forget_owner(user_id)
+
+
+def precision_report(rows, step=0.05):
+    """Per-bucket and at-or-above precision from (similarity, correct) pairs."""
+    buckets = {}
+    for similarity, correct in rows:
+        floor = round(int(similarity / step + 1e-9) * step, 2)
+        total, good = buckets.get(floor, (0, 0))
+        buckets[floor] = (total + 1, good + bool(correct))
+    report = []
+    above_total = above_good = 0
+    for floor in sorted(buckets, reverse=True):
+        total, good = buckets[floor]
+        above_total += total
+        above_good += good
+        report.append({'similarity': floor, 'served': total, 'correct': good,
+                       'precision': round(good / total, 3),
+                       'precision_at_or_above': round(above_good / above_total, 3)})
+    report.reverse()
+    return report
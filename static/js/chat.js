@@ -0,0 +1,485 @@
+let currentChatId = null;
+let attachedImages = [];
+let pendingRequestId = null;
+
+// Tell the server to stop generating an answer nobody will read
+function cancelPendingAsk() {
+    if (!pendingRequestId) return;
+    navigator.sendBeacon(`/api/ask/${encodeURIComponent(pendingRequestId)}/cancel`);
+    pendingRequestId = null;
+}
+
+window.addEventListener('pagehide', cancelPendingAsk);
+
+// Sidebar state, kept in sync with /api/chats?since= deltas
+const chatsById = new Map();
+const chatElements = new Map();
+let chatsSyncedAt = null;
+
+function createChatItem(chat) {
+    const item = document.createElement('div');
+    item.className = 'chat-item';
+
+    const titleDiv = document.createElement('div');
+    titleDiv.className = 'chat-item-title';
+    titleDiv.onclick = () => loadChat(item.dataset.chatId);
+
+    const actionsDiv = document.createElement('div');
+    actionsDiv.className = 'chat-item-actions';
+
+    const renameBtn = document.createElement('button');
+    renameBtn.className = 'chat-item-btn';
+    renameBtn.textContent = '✎';
+    renameBtn.onclick = (e) => {
+        e.stopPropagation();
+        document.getElementById('renameChatInput').value = chatsById.get(item.dataset.chatId).title;
+        document.getElementById('renameChatModal').classList.add('active');
+        document.getElementById('renameChatModal').dataset.chatId = item.dataset.chatId;
+    };
+
+    const deleteBtn = document.createElement('button');
+    deleteBtn.className = 'chat-item-btn';
+    deleteBtn.textContent = '🗑️';
+    deleteBtn.onclick = (e) => {
+        e.stopPropagation();
+        document.getElementById('deleteChatModal').classList.add('active');
+        document.getElementById('deleteChatModal').dataset.chatId = item.dataset.chatId;
+    };
+
+    actionsDiv.appendChild(renameBtn);
+    actionsDiv.appendChild(deleteBtn);
+    item.appendChild(titleDiv);
+    item.appendChild(actionsDiv);
+    item.dataset.chatId = chat.id;
+    return item;
+}
+
+function renderChatList() {
+    const chatList = document.getElementById('chatList');
+    const ordered = Array.from(chatsById.values()).sort((a, b) => b.timestamp - a.timestamp);
+    ordered.forEach((chat, idx) => {
+        let item = chatElements.get(chat.id);
+        if (!item) {
+            item = createChatItem(chat);
+            chatElements.set(chat.id, item);
+        }
+        const titleDiv = item.firstChild;
+        if (titleDiv.textContent !== chat.title) titleDiv.textContent = chat.title;
+        item.classList.toggle('active', currentChatId === chat.id);
+        // Only move nodes that are out of place
+        if (chatList.children[idx] !== item) {
+            chatList.insertBefore(item, chatList.children[idx] || null);
+        }
+    });
+    chatElements.forEach((item, id) => {
+        if (!chatsById.has(id)) {
+            item.remove();
+            chatElements.delete(id);
+        }
+    });
+}
+
+async function loadChats() {
+    try {
+        const url = chatsSyncedAt === null ? '/api/chats' : `/api/chats?since=${chatsSyncedAt}`;
+        const res = await fetch(url);
+        if (res.status === 304) {
+            renderChatList();
+            return;
+        }
+        const data = await res.json();
+        if (data.full) chatsById.clear();
+        data.chats.forEach(chat => chatsById.set(chat.id, chat));
+        (data.deleted || []).forEach(id => chatsById.delete(id));
+        chatsSyncedAt = data.server_time;
+        renderChatList();
+    } catch (err) {
+        console.error('Failed to load chats:', err);
+    }
+}
+
+async function loadChat(chatId) {
+    if (chatId !== currentChatId) cancelPendingAsk();
+    try {
+        const res = await fetch(`/api/chats/${chatId}`);
+        const data = await res.json();
+        currentChatId = chatId;
+
+        const chatMessages = document.getElementById('chatMessages');
+        chatMessages.innerHTML = '';
+
+        data.chat.messages.forEach(msg => {
+            const div = document.createElement('div');
+            div.className = 'message ' + msg.role;
+            const content = document.createElement('div');
+            content.className = 'content';
+            content.textContent = msg.text;
+
+            if (msg.images && msg.images.length > 0) {
+                const imagesContainer = document.createElement('div');
+                imagesContainer.className = 'message-images';
+                msg.images.forEach(imgBase64 => {
+                    const img = document.createElement('img');
+                    img.src = 'data:image/jpeg;base64,' + imgBase64;
+                    img.className = 'message-image';
+                    imagesContainer.appendChild(img);
+                });
+                content.appendChild(imagesContainer);
+            }
+
+            div.appendChild(content);
+            chatMessages.appendChild(div);
+        });
+
+        document.getElementById('heroSection').classList.add('hidden');
+        document.getElementById('chatMessages').classList.remove('hidden');
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+        loadChats();
+    } catch (err) {
+        console.error('Failed to load chat:', err);
+    }
+}
+
+async function createNewChat() {
+    cancelPendingAsk();
+    currentChatId = 'chat_' + Date.now();
+    document.getElementById('heroSection').classList.remove('hidden');
+    document.getElementById('chatMessages').classList.add('hidden');
+    document.getElementById('messageInput').focus();
+}
+
+function updateImagePreview() {
+    const preview = document.getElementById('imagePreview');
+    preview.innerHTML = '';
+    attachedImages.forEach((imgBase64, idx) => {
+        const thumb = document.createElement('div');
+        thumb.className = 'image-thumb';
+        const img = document.createElement('img');
+        img.src = 'data:image/jpeg;base64,' + imgBase64;
+        thumb.appendChild(img);
+        const removeBtn = document.createElement('button');
+        removeBtn.className = 'remove';
+        removeBtn.textContent = '✕';
+        removeBtn.type = 'button';
+        removeBtn.onclick = () => {
+            attachedImages.splice(idx, 1);
+            updateImagePreview();
+        };
+        thumb.appendChild(removeBtn);
+        preview.appendChild(thumb);
+    });
+}
+
+document.getElementById('newChatBtn').addEventListener('click', createNewChat);
+
+document.getElementById('imageBtn').addEventListener('click', (e) => {
+    e.preventDefault();
+    document.getElementById('imageInput').click();
+});
+
+document.getElementById('imageInput').addEventListener('change', (e) => {
+    const files = Array.from(e.target.files);
+    let processed = 0;
+    files.forEach(file => {
+        const reader = new FileReader();
+        reader.onload = (event) => {
+            attachedImages.push(event.target.result.split(',')[1]);
+            processed++;
+            if (processed === files.length) {
+                updateImagePreview();
+                document.getElementById('imageInput').value = '';
+            }
+        };
+        reader.readAsDataURL(file);
+    });
+});
+
+document.getElementById('renameChatCancelBtn').addEventListener('click', () => {
+    document.getElementById('renameChatModal').classList.remove('active');
+});
+
+document.getElementById('renameChatConfirmBtn').addEventListener('click', async () => {
+    const chatId = document.getElementById('renameChatModal').dataset.chatId;
+    const newTitle = document.getElementById('renameChatInput').value.trim();
+    if (newTitle) {
+        await fetch(`/api/chats/${chatId}`, {
+            method: 'PUT',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({title: newTitle})
+        });
+        loadChats();
+        document.getElementById('renameChatModal').classList.remove('active');
+    }
+});
+
+document.getElementById('deleteChatCancelBtn').addEventListener('click', () => {
+    document.getElementById('deleteChatModal').classList.remove('active');
+});
+
+document.getElementById('deleteChatConfirmBtn').addEventListener('click', async () => {
+    const chatId = document.getElementById('deleteChatModal').dataset.chatId;
+    await fetch(`/api/chats/${chatId}`, {method: 'DELETE'});
+    if (currentChatId === chatId) {
+        currentChatId = null;
+        document.getElementById('heroSection').classList.remove('hidden');
+        document.getElementById('chatMessages').classList.add('hidden');
+    }
+    loadChats();
+    document.getElementById('deleteChatModal').classList.remove('active');
+});
+
+// Set to ask the next question without the near-duplicate answer cache
+let skipCacheOnce = false;
+
+function cacheNote(cache, question, userDiv, assistantDiv) {
+    const note = document.createElement('div');
+    note.className = 'cache-note';
+    note.textContent = 'Reused the answer to a similar question. ';
+    const retry = document.createElement('button');
+    retry.type = 'button';
+    retry.textContent = 'Not what I asked';
+    retry.addEventListener('click', async () => {
+        retry.disabled = true;
+        const res = await fetch('/api/ask/cache-feedback', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({id: cache.id, correct: false})
+        });
+        const data = await res.json();
+        if (!data.removed) {
+            note.textContent = 'Thanks for the feedback.';
+            return;
+        }
+        userDiv.remove();
+        assistantDiv.remove();
+        skipCacheOnce = true;
+        document.getElementById('messageInput').value = question;
+        document.getElementById('chatForm').dispatchEvent(new Event('submit'));
+    });
+    note.appendChild(retry);
+    return note;
+}
+
+document.getElementById('chatForm').addEventListener('submit', async (e) => {
+    e.preventDefault();
+    const text = document.getElementById('messageInput').value.trim();
+    if (!text && attachedImages.length === 0) return;
+
+    if (!currentChatId) {
+        currentChatId = 'chat_' + Date.now();
+        await fetch('/api/chats', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({id: currentChatId, title: text.substring(0, 30)})
+        });
+    }
+
+    document.getElementById('heroSection').classList.add('hidden');
+    document.getElementById('chatMessages').classList.remove('hidden');
+    document.getElementById('messageInput').value = '';
+    document.getElementById('sendBtn').disabled = true;
+
+    const chatMessages = document.getElementById('chatMessages');
+    const userDiv = document.createElement('div');
+    userDiv.className = 'message user';
+    const userContent = document.createElement('div');
+    userContent.className = 'content';
+    userContent.textContent = text || '[Image message]';
+    userDiv.appendChild(userContent);
+    chatMessages.appendChild(userDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    const noCache = skipCacheOnce;
+    skipCacheOnce = false;
+    const requestId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    pendingRequestId = requestId;
+
+    try {
+        const res = await fetch('/api/ask', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                question: text,
+                chat_id: currentChatId,
+                request_id: requestId,
+                no_cache: noCache || undefined,
+                images: attachedImages.length > 0 ? attachedImages : undefined
+            })
+        });
+        const data = await res.json();
+
+        // A cancelled answer belongs to a chat the user has already left
+        if (pendingRequestId === requestId) {
+            const assistantDiv = document.createElement('div');
+            assistantDiv.className = 'message assistant';
+            const assistantContent = document.createElement('div');
+            assistantContent.className = 'content';
+            assistantContent.textContent = data.response || ('Error: ' + (data.error || 'Unknown error'));
+            assistantDiv.appendChild(assistantContent);
+            if (data.cache) {
+                assistantContent.appendChild(cacheNote(data.cache, text, userDiv, assistantDiv));
+            }
+            chatMessages.appendChild(assistantDiv);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        }
+
+        loadChats();
+    } catch (err) {
+        console.error('Error:', err);
+    }
+    if (pendingRequestId === requestId) pendingRequestId = null;
+
+    attachedImages = [];
+    updateImagePreview();
+    document.getElementById('sendBtn').disabled = false;
+    document.getElementById('messageInput').focus();
+});
+
+document.getElementById('messageInput').addEventListener('keydown', (e) => {
+    if (e.key === 'Enter' && !e.shiftKey) {
+        e.preventDefault();
+        document.getElementById('chatForm').dispatchEvent(new Event('submit'));
+    }
+});
+
+// Settings modal
+document.getElementById('settingsBtn').addEventListener('click', (e) => {
+    e.preventDefault();
+    document.getElementById('settingsModal').classList.add('active');
+    loadSettings();
+});
+
+document.getElementById('settingsCloseBtn').addEventListener('click', () => {
+    document.getElementById('settingsModal').classList.remove('active');
+});
+
+// Settings tabs
+document.querySelectorAll('.settings-tab').forEach(tab => {
+    tab.addEventListener('click', () => {
+        document.querySelectorAll('.settings-tab').forEach(t => t.classList.remove('active'));
+        document.querySelectorAll('.settings-panel').forEach(p => p.classList.remove('active'));
+        tab.classList.add('active');
+        document.getElementById(tab.dataset.tab + 'Panel').classList.add('active');
+    });
+});
+
+// Load and save settings
+function loadSettings() {
+    const language = localStorage.getItem('language') || 'en';
+    const autoSave = localStorage.getItem('autoSave') !== 'false';
+    const showTimestamps = localStorage.getItem('showTimestamps') === 'true';
+    const soundNotif = localStorage.getItem('soundNotif') === 'true';
+    const compactMode = localStorage.getItem('compactMode') === 'true';
+    const fontSize = localStorage.getItem('fontSize') || 'medium';
+    const messageDensity = localStorage.getItem('messageDensity') || 'normal';
+    const sidebarWidth = localStorage.getItem('sidebarWidth') || 'normal';
+    const codeTheme = localStorage.getItem('codeTheme') || 'dracula';
+
+    document.getElementById('languageSelect').value = language;
+    document.getElementById('autoSave').checked = autoSave;
+    document.getElementById('showTimestamps').checked = showTimestamps;
+    document.getElementById('soundNotif').checked = soundNotif;
+    document.getElementById('compactMode').checked = compactMode;
+    document.getElementById('fontSize').value = fontSize;
+    document.getElementById('messageDensity').value = messageDensity;
+    document.getElementById('sidebarWidth').value = sidebarWidth;
+    document.getElementById('codeTheme').value = codeTheme;
+}
+
+// Save settings on change
+document.getElementById('languageSelect').addEventListener('change', (e) => {
+    localStorage.setItem('language', e.target.value);
+});
+
+document.getElementById('autoSave').addEventListener('change', (e) => {
+    localStorage.setItem('autoSave', e.target.checked);
+});
+
+document.getElementById('showTimestamps').addEventListener('change', (e) => {
+    localStorage.setItem('showTimestamps', e.target.checked);
+});
+
+document.getElementById('soundNotif').addEventListener('change', (e) => {
+    localStorage.setItem('soundNotif', e.target.checked);
+});
+
+document.getElementById('compactMode').addEventListener('change', (e) => {
+    localStorage.setItem('compactMode', e.target.checked);
+});
+
+document.getElementById('fontSize').addEventListener('change', (e) => {
+    localStorage.setItem('fontSize', e.target.value);
+});
+
+document.getElementById('messageDensity').addEventListener('change', (e) => {
+    localStorage.setItem('messageDensity', e.target.value);
+});
+
+document.getElementById('sidebarWidth').addEventListener('change', (e) => {
+    localStorage.setItem('sidebarWidth', e.target.value);
+});
+
+document.getElementById('codeTheme').addEventListener('change', (e) => {
+    localStorage.setItem('codeTheme', e.target.value);
+});
+
+// Theme switching
+const savedTheme = localStorage.getItem('theme') || 'default';
+if (savedTheme !== 'default') {
+    document.documentElement.setAttribute('data-theme', savedTheme);
+    document.querySelectorAll('.theme-card').forEach(card => {
+        card.classList.toggle('active', card.dataset.theme === savedTheme);
+    });
+}
+
+document.querySelectorAll('.theme-card').forEach(card => {
+    card.addEventListener('click', () => {
+        const theme = card.dataset.theme;
+        document.querySelectorAll('.theme-card').forEach(c => c.classList.remove('active'));
+        card.classList.add('active');
+
+        if (theme === 'default') {
+            document.documentElement.removeAttribute('data-theme');
+        } else {
+            document.documentElement.setAttribute('data-theme', theme);
+        }
+        localStorage.setItem('theme', theme);
+    });
+});
+
+// Rename account
+document.getElementById('renameAccountBtn').addEventListener('click', () => {
+    document.getElementById('settingsModal').classList.remove('active');
+    document.getElementById('renameAccountModal').classList.add('active');
+    document.getElementById('renameAccountInput').value = document.body.dataset.username;
+});
+
+document.getElementById('renameAccountCancelBtn').addEventListener('click', () => {
+    document.getElementById('renameAccountModal').classList.remove('active');
+});
+
+document.getElementById('renameAccountConfirmBtn').addEventListener('click', async () => {
+    const newUsername = document.getElementById('renameAccountInput').value.trim();
+    if (newUsername) {
+        try {
+            const res = await fetch('/api/user/update', {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({username: newUsername})
+            });
+
+            if (res.ok) {
+                location.reload();
+            } else {
+                const data = await res.json();
+                alert(data.error || 'Failed to update username');
+            }
+        } catch (err) {
+            alert('Network error');
+        }
+    }
+});
+
+loadChats();
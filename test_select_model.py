@@ -1,4 +1,3 @@
-import app
-import os
-print('MODEL_PATH ->', app.MODEL_PATH)
-print('Exists ->', os.path.exists(app.MODEL_PATH))
+import routes
+print('OPENROUTER_MODEL ->', routes.OPENROUTER_MODEL)
+print('Allowed models ->', ', '.join(sorted(routes.OPENROUTER_MODELS)))
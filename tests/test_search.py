@@ -0,0 +1,144 @@
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+import search
+
+ORDERS = [
+    ('rank DESC, id DESC', 'r.rank DESC, r.id DESC'),
+    ('id DESC', 'r.id DESC'),
+]
+
+
+def _compile(statement, dialect):
+    if isinstance(statement, str):
+        statement = text(statement)
+    return statement.compile(dialect=dialect)
+
+
+def test_postgres_count_compiles():
+    compiled = _compile(search.POSTGRES_COUNT, postgresql.dialect())
+    assert set(compiled.params) == {'user_id', 'q', 'cap'}
+    assert 'plainto_tsquery' in str(compiled)
+
+
+@pytest.mark.parametrize('order,order_outer', ORDERS)
+def test_postgres_query_compiles(order, order_outer):
+    sql = search.POSTGRES_QUERY.format(order=order, order_outer=order_outer)
+    compiled = _compile(sql, postgresql.dialect())
+    assert set(compiled.params) == {'user_id', 'q', 'headline_opts', 'limit', 'offset'}
+    for fn in ('plainto_tsquery', 'ts_rank', 'ts_headline'):
+        assert fn in sql
+    # Matching and ranking read the stored vector; nothing re-parses content per row
+    assert 'content_tsv' in sql and 'to_tsvector' not in sql
+    assert 'deleted_at IS NULL' in sql
+
+
+@pytest.mark.parametrize('order', ['f.rank', 'f.rowid DESC'])
+def test_sqlite_statements_compile(order):
+    _compile(search.SQLITE_COUNT, sqlite.dialect())
+    compiled = _compile(search.SQLITE_QUERY.format(order=order), sqlite.dialect())
+    assert {'q', 'start', 'stop', 'words', 'limit', 'offset'} <= set(compiled.params)
+
+
+@pytest.fixture
+def sqlite_app(tmp_path):
+    from app import create_app, db, init_db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'search.db'}", 'TESTING': True})
+    init_db(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def _add_chat(user_id, *contents):
+    from app import db
+    from models import Chat, Message
+
+    chat = Chat(id=str(uuid.uuid4()), user_id=user_id, title='t')
+    db.session.add(chat)
+    db.session.flush()
+    messages = [Message(chat_id=chat.id, role='user', content=content) for content in contents]
+    db.session.add_all(messages)
+    db.session.commit()
+    return chat, messages
+
+
+def _ids(user_id, query):
+    from app import db
+
+    results, _ = search.search_messages(db, user_id, query)
+    return [r['message_id'] for r in results]
+
+
+def test_sqlite_search_follows_writes(sqlite_app):
+    from app import db
+    from models import User
+
+    alice, bob = User(username='alice', password_hash='x'), User(username='bob', password_hash='x')
+    db.session.add_all([alice, bob])
+    db.session.commit()
+
+    chat, (once, twice, other) = _add_chat(
+        alice.id, 'a python question', 'python python, always python', 'something about rust')
+    _add_chat(bob.id, 'python for bob')
+
+    # More occurrences rank higher; other users' messages never match
+    assert _ids(alice.id, 'python') == [twice.id, once.id]
+    results, has_more = search.search_messages(db, alice.id, 'python', limit=1)
+    assert [r['message_id'] for r in results] == [twice.id] and has_more
+    assert '<mark>' in results[0]['snippet']
+
+    other.content = 'now about python too'
+    once.content = 'a rust question'
+    db.session.commit()
+    assert set(_ids(alice.id, 'python')) == {twice.id, other.id}
+    assert _ids(alice.id, 'rust') == [once.id]
+
+    db.session.delete(twice)
+    db.session.commit()
+    assert _ids(alice.id, 'python') == [other.id]
+
+    chat.deleted_at = chat.created_at
+    db.session.commit()
+    assert _ids(alice.id, 'python') == []
+
+
+def test_sqlite_search_finds_archived_messages(sqlite_app):
+    from datetime import datetime
+
+    import archive
+    import purge
+    from app import db
+    from models import ArchivedMessageSearch, Chat, User
+
+    user = User(username='carol', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    chat, (message,) = _add_chat(user.id, 'archived python question')
+    chat_id, message_id, created_at = chat.id, message.id, message.created_at
+
+    archive.archive_inactive(datetime.max)
+    results, _ = search.search_messages(db, user.id, 'python')
+    assert [(r['message_id'], r['role']) for r in results] == [(message_id, 'user')]
+    assert results[0]['timestamp'] == int(created_at.timestamp() * 1000)
+
+    # Chats archived before they were indexed become searchable once reindexed
+    ArchivedMessageSearch.query.delete()
+    db.session.commit()
+    assert _ids(user.id, 'python') == []
+    assert archive.index_unsearchable() == 1
+    assert _ids(user.id, 'python') == [message_id]
+
+    archive.restore(db.session.get(Chat, chat_id))
+    db.session.commit()
+    assert _ids(user.id, 'python') == [message_id]
+
+    archive.archive_inactive(datetime.max)
+    purge.delete_chats_now([chat_id])
+    db.session.commit()
+    assert db.session.execute(text('SELECT count(*) FROM messages_fts')).scalar() == 0
@@ -0,0 +1,35 @@
+import pytest
+
+from semantic_cache import SemanticCache, normalize
+
+SCOPE = ('model', 'user')
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(capacity=64, threshold=0.75, ttl=3600)
+
+
+def test_rephrasing_in_any_order_hits(cache):
+    assert normalize('How do Python decorators work?') == normalize('explain decorators in python')
+    cache.store('How do Python decorators work?', SCOPE, 'answer')
+    hit = cache.lookup('explain decorators in python', SCOPE)
+    assert hit is not None and hit.answer == 'answer' and hit.similarity == 1.0
+
+
+def test_reversed_direction_misses(cache):
+    cache.store('How do I convert a list to a dict in Python?', SCOPE, 'list to dict')
+    assert cache.lookup('How do I convert a dict to a list in Python?', SCOPE) is None
+    assert cache.lookup('convert a python list into a dict', SCOPE).answer == 'list to dict'
+    assert cache.lookup('convert to a python dict from a list', SCOPE).answer == 'list to dict'
+
+
+def test_reversed_direction_misses_with_many_shared_words(cache):
+    # The shared words alone would pass the threshold
+    cache.store('convert a nested python json list to a dict without losing key order', SCOPE, 'answer')
+    assert cache.lookup('convert a nested python json dict to a list without losing key order', SCOPE) is None
+
+
+def test_scopes_are_separate(cache):
+    cache.store('How do Python decorators work?', SCOPE, 'answer')
+    assert cache.lookup('How do Python decorators work?', ('model', 'other')) is None
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Streaming NDJSON export and import of a user's chats.
+
+Export walks chats, messages and archived segments with server-side
+cursors (yield_per), so memory does not depend on account size. Images
+are written as `blob` records keyed by their SHA-256 and messages
+reference them by hash; the last EXPORT_DEDUP_BLOBS hashes are
+remembered, so a repeated image is usually written once.
+Import reads the stream line by line, spills blobs to a temporary directory
+and writes chats and messages with chunked executemany inserts, all in one
+transaction: a file that fails partway imports nothing.
+
+    python transfer.py export --user alice -o alice.ndjson
+    python transfer.py import --user bob alice.ndjson
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+
+import archive
+from app import create_app, db
+from cache import TTLCache
+from models import Chat, Message, MessageSegment, User
+
+EXPORT_VERSION = 1
+YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', '500'))
+# Segments hold up to ARCHIVE_SEGMENT_SIZE messages each, so fetch fewer at a time
+SEGMENT_YIELD_PER = int(os.environ.get('EXPORT_SEGMENT_YIELD_PER', '8'))
+EXPORT_DEDUP_BLOBS = int(os.environ.get('EXPORT_DEDUP_BLOBS', '10000'))
+IMPORT_CHUNK = int(os.environ.get('IMPORT_CHUNK', '500'))
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(512 * 1024 * 1024)))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', str(32 * 1024 * 1024)))
+
+MESSAGE_FIELDS = ('role', 'content', 'model', 'prompt_tokens', 'completion_tokens',
+                  'latency_ms', 'ttft_ms', 'cache_hit', 'cancelled')
+
+
+def blob_hash(data):
+    return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+
+def _dt(value):
+    return value.isoformat() if value else None
+
+
+def _line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def export_user(user_id, include_blobs=True):
+    """Yield NDJSON lines for all chats and messages of user_id."""
+    yield _line({'type': 'header', 'version': EXPORT_VERSION, 'exported_at': _dt(datetime.now())})
+
+    chats = db.session.execute(
+        db.select(Chat.id, Chat.title, Chat.created_at, Chat.updated_at)
+        .where(Chat.user_id == user_id, Chat.deleted_at.is_(None))
+        .order_by(Chat.created_at)
+        .execution_options(yield_per=YIELD_PER))
+    for row in chats:
+        yield _line({'type': 'chat', 'id': row.id, 'title': row.title,
+                     'created_at': _dt(row.created_at), 'updated_at': _dt(row.updated_at)})
+
+    columns = [getattr(Message, f) for f in MESSAGE_FIELDS]
+    messages = db.session.execute(
+        db.select(Message.chat_id, Message.created_at, Message.images_json, *columns)
+        .join(Chat, Chat.id == Message.chat_id)
+        .where(Chat.user_id == user_id, Chat.deleted_at.is_(None))
+        .order_by(Message.chat_id, Message.id)
+        .execution_options(yield_per=YIELD_PER))
+    # A blob evicted from here is just written again; importers accept repeats
+    seen = TTLCache(maxsize=EXPORT_DEDUP_BLOBS, ttl=None)
+    for row in messages:
+        yield from _message_lines(row, seen, include_blobs)
+
+    # Archived chats keep their messages in compressed segments instead; decode
+    # them one at a time rather than through the archive's per-chat LRU
+    segments = db.session.execute(
+        db.select(MessageSegment.chat_id, MessageSegment.codec, MessageSegment.data)
+        .join(Chat, Chat.id == MessageSegment.chat_id)
+        .where(Chat.user_id == user_id, Chat.deleted_at.is_(None))
+        .order_by(MessageSegment.chat_id, MessageSegment.seq)
+        .execution_options(yield_per=SEGMENT_YIELD_PER))
+    for segment in segments:
+        for msg in archive.decode(segment.codec, segment.data, segment.chat_id):
+            yield from _message_lines(msg, seen, include_blobs)
+
+
+def _message_lines(row, seen, include_blobs):
+    record = {'type': 'message', 'chat_id': row.chat_id, 'created_at': _dt(row.created_at)}
+    record.update({f: getattr(row, f) for f in MESSAGE_FIELDS if getattr(row, f) is not None})
+    if row.images_json:
+        hashes = []
+        for data in json.loads(row.images_json):
+            h = blob_hash(data)
+            if include_blobs and h not in seen:
+                seen.set(h, True)
+                yield _line({'type': 'blob', 'hash': h, 'data': data})
+            hashes.append(h)
+        record['images'] = hashes
+    yield _line(record)
+
+
+class BlobSpool:
+    """Image blobs seen during an import, kept on disk rather than in memory."""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='import_blobs_')
+
+    def _path(self, h):
+        if len(h) != 64 or any(c not in '0123456789abcdef' for c in h):
+            raise ValueError(f'invalid blob hash: {h!r}')
+        return os.path.join(self.dir, h)
+
+    def put(self, h, data):
+        if blob_hash(data) != h:
+            raise ValueError(f'blob does not match its hash: {h}')
+        with open(self._path(h), 'w', encoding='ascii') as f:
+            f.write(data)
+
+    def get(self, h):
+        try:
+            with open(self._path(h), 'r', encoding='ascii') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def _parse_dt(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _lines(src, limit):
+    if not hasattr(src, 'readline'):
+        yield from src
+        return
+    while True:
+        # A size limit keeps a line without newlines from being buffered whole
+        raw = src.readline(limit)
+        if not raw:
+            return
+        yield raw
+
+
+def _limited_lines(src, max_bytes=IMPORT_MAX_BYTES, max_line=IMPORT_MAX_LINE_BYTES):
+    """Lines of a stream or iterable, refusing oversized lines and inputs."""
+    total = 0
+    for raw in _lines(src, max_line + 1):
+        if len(raw) > max_line:
+            raise ValueError(f'line longer than {max_line} bytes')
+        total += len(raw)
+        if total > max_bytes:
+            raise ValueError(f'import larger than {max_bytes} bytes')
+        yield raw
+
+
+def _string(record, key):
+    value = record.get(key)
+    if not isinstance(value, str):
+        raise ValueError(f'{record.get("type")} record without a string {key!r}')
+    return value
+
+
+def import_user(user_id, lines):
+    """Import NDJSON lines into user_id's account; returns counts."""
+    counts = {'chats': 0, 'messages': 0, 'blobs': 0, 'missing_blobs': 0, 'skipped': 0}
+    chat_ids = {}
+    pending_chats, pending_messages = [], []
+    spool = BlobSpool()
+
+    def flush_chats():
+        if not pending_chats:
+            return
+        existing = {row.id for row in db.session.query(Chat.id).filter(
+            Chat.id.in_([c['id'] for c in pending_chats]))}
+        for chat in pending_chats:
+            original = chat['id']
+            if original in existing or original in chat_ids:
+                chat['id'] = f'{original}_{uuid.uuid4().hex[:8]}'
+            chat_ids[original] = chat['id']
+        db.session.execute(db.insert(Chat), pending_chats)
+        counts['chats'] += len(pending_chats)
+        pending_chats.clear()
+
+    def flush_messages():
+        flush_chats()
+        if not pending_messages:
+            return
+        db.session.execute(db.insert(Message), pending_messages)
+        counts['messages'] += len(pending_messages)
+        pending_messages.clear()
+
+    try:
+        for raw in _limited_lines(lines):
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+            raw = raw.strip()
+            if not raw:
+                continue
+            record = json.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError('every line must be a JSON object')
+            kind = record.get('type')
+            if kind == 'header':
+                if record.get('version') != EXPORT_VERSION:
+                    raise ValueError(f"unsupported export version: {record.get('version')}")
+            elif kind == 'blob':
+                spool.put(_string(record, 'hash'), _string(record, 'data'))
+                counts['blobs'] += 1
+            elif kind == 'chat':
+                pending_chats.append({
+                    'id': _string(record, 'id'),
+                    'user_id': user_id,
+                    'title': str(record.get('title') or 'New Chat'),
+                    'created_at': _parse_dt(record.get('created_at')) or datetime.now(),
+                    'updated_at': _parse_dt(record.get('updated_at')) or datetime.now(),
+                })
+                if len(pending_chats) >= IMPORT_CHUNK:
+                    flush_chats()
+            elif kind == 'message':
+                _string(record, 'role')
+                _string(record, 'content')
+                if pending_chats:
+                    flush_chats()
+                chat_id = chat_ids.get(record.get('chat_id'))
+                if chat_id is None:
+                    # Only messages of chats in this stream can be imported
+                    counts['skipped'] += 1
+                    continue
+                images = []
+                hashes = record.get('images') or []
+                if not isinstance(hashes, list):
+                    raise ValueError('message images must be a list of hashes')
+                for h in hashes:
+                    data = spool.get(h) if isinstance(h, str) else None
+                    if data is None:
+                        counts['missing_blobs'] += 1
+                    else:
+                        images.append(data)
+                message = {f: record.get(f) for f in MESSAGE_FIELDS}
+                message.update({
+                    'chat_id': chat_id,
+                    'cache_hit': bool(record.get('cache_hit')),
+                    'cancelled': bool(record.get('cancelled')),
+                    'images_json': json.dumps(images) if images else None,
+                    'created_at': _parse_dt(record.get('created_at')) or datetime.now(),
+                })
+                pending_messages.append(message)
+                if len(pending_messages) >= IMPORT_CHUNK:
+                    flush_messages()
+            else:
+                raise ValueError(f'unknown record type: {kind!r}')
+        flush_messages()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        spool.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import chats as NDJSON')
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export')
+    exp.add_argument('--user', required=True, help='Username')
+    exp.add_argument('-o', '--output', help='Output file (default: stdout)')
+    exp.add_argument('--no-blobs', action='store_true', help='Reference images by hash without their data')
+    imp = sub.add_parser('import')
+    imp.add_argument('--user', required=True, help='Username to import into')
+    imp.add_argument('input', help='NDJSON file ("-" for stdin)')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        user = User.query.filter_by(username=args.user).first()
+        if user is None:
+            print(f'No such user: {args.user}', file=sys.stderr)
+            sys.exit(1)
+
+        if args.command == 'export':
+            out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for line in export_user(user.id, include_blobs=not args.no_blobs):
+                    out.write(line)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            src = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+            try:
+                counts = import_user(user.id, src)
+            finally:
+                if src is not sys.stdin:
+                    src.close()
+            print('Imported', ', '.join(f'{v} {k}' for k, v in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
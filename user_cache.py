@@ -0,0 +1,151 @@
+"""
+Per-worker cache for flask-login's user_loader.
+
+Most requests (including the /api/chats refresh after every answer) only
+need the user's id and name. Those are carried in the signed session
+cookie for SESSION_USER_TTL seconds and otherwise served from a bounded,
+TTL'd in-process cache, so the users table is only queried on a miss.
+
+The cookie is signed, not encrypted, so nothing else goes into it. Renaming
+or deleting an account records a SessionRevocation row; every worker checks
+for new rows at most every SESSION_REVOCATION_POLL seconds and then stops
+trusting older cookies and cached rows for that user.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import session
+from flask_login import UserMixin
+
+import metrics
+from cache import TTLCache
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+SESSION_USER_TTL = float(os.environ.get('SESSION_USER_TTL', '300'))
+SESSION_REVOCATION_POLL = float(os.environ.get('SESSION_REVOCATION_POLL', '5'))
+SESSION_KEY = '_user'
+
+FIELDS = ('id', 'username', 'email', 'first_name', 'last_name')
+SESSION_FIELDS = ('id', 'username')
+
+# Revocations matter until every cookie and cache entry issued before them has expired
+REVOCATION_WINDOW = max(SESSION_USER_TTL, USER_CACHE_TTL) + SESSION_REVOCATION_POLL
+
+_users = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_revoked = TTLCache(maxsize=USER_CACHE_SIZE, ttl=REVOCATION_WINDOW)
+_poll_lock = threading.Lock()
+_last_poll = 0.0
+
+
+class CachedUser(UserMixin):
+    """Detached, read-only view of a User row; load the model to modify it."""
+
+    def __init__(self, **fields):
+        for name in FIELDS:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(**{name: getattr(user, name) for name in FIELDS})
+
+
+def _from_session(user_id):
+    payload = session.get(SESSION_KEY)
+    if not payload or payload.get('id') != user_id:
+        return None
+    issued = payload.get('ts', 0)
+    if SESSION_USER_TTL <= 0 or time.time() - issued > SESSION_USER_TTL:
+        return None
+    if issued <= _revoked.get(user_id, 0):
+        return None
+    return CachedUser(**{name: payload.get(name) for name in SESSION_FIELDS})
+
+
+def _store_session(cached):
+    if SESSION_USER_TTL > 0:
+        session[SESSION_KEY] = dict({name: getattr(cached, name) for name in SESSION_FIELDS},
+                                    ts=round(time.time(), 3))
+
+
+def _poll_revocations():
+    """Pick up revocations made by other workers, at most every SESSION_REVOCATION_POLL seconds."""
+    global _last_poll
+    from models import SessionRevocation
+
+    now = time.monotonic()
+    if now - _last_poll < SESSION_REVOCATION_POLL or not _poll_lock.acquire(blocking=False):
+        return
+    try:
+        _last_poll = now
+        since = datetime.now() - timedelta(seconds=REVOCATION_WINDOW)
+        rows = SessionRevocation.query.filter(SessionRevocation.created_at >= since).all()
+        for row in rows:
+            _mark_revoked(row.user_id, row.created_at.timestamp())
+    except Exception:
+        logging.exception('Polling session revocations failed')
+    finally:
+        _poll_lock.release()
+
+
+def _mark_revoked(user_id, revoked_at):
+    if revoked_at > _revoked.get(user_id, 0):
+        _revoked.set(user_id, revoked_at)
+        _users.pop(user_id)
+
+
+def load(user_id, query):
+    """Resolve user_id from the session, the worker cache, or `query(user_id)`."""
+    _poll_revocations()
+    cached = _from_session(user_id)
+    if cached is not None:
+        metrics.CACHE_REQUESTS.inc(cache='user_loader', result='session')
+        return cached
+
+    cached = _users.get(user_id)
+    if cached is not None:
+        metrics.record_cache('user_loader', True)
+        _store_session(cached)
+        return cached
+
+    metrics.record_cache('user_loader', False)
+    user = query(user_id)
+    if user is None:
+        return None
+    return remember(user)
+
+
+def remember(user):
+    cached = CachedUser.from_model(user)
+    _users.set(cached.id, cached)
+    _store_session(cached)
+    return cached
+
+
+def invalidate(user_id):
+    """Drop user_id from this worker now and from every worker and session within the poll interval.
+
+    Adds a SessionRevocation to the current transaction; the caller commits it.
+    """
+    from app import db
+    from models import SessionRevocation
+
+    revoked_at = datetime.now()
+    db.session.add(SessionRevocation(user_id=user_id, created_at=revoked_at))
+    SessionRevocation.query.filter(
+        SessionRevocation.created_at < revoked_at - timedelta(seconds=REVOCATION_WINDOW)
+    ).delete(synchronize_session=False)
+    _mark_revoked(user_id, revoked_at.timestamp())
+    payload = session.get(SESSION_KEY)
+    if payload and payload.get('id') == user_id:
+        session.pop(SESSION_KEY, None)
+
+
+def forget_session():
+    session.pop(SESSION_KEY, None)